@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+笔记解析微基准：对 bench/fixtures/state 下的 __INITIAL_STATE__ 样本（camelCase / snake_case、
+嵌套 .note 链、noteDetail 包装、单档 infoList、大体积笔记、空笔记等结构变体）分两个阶段测量：
+
+- html：parse_initial_state_from_html，从 SSR 页面（样本按服务端渲染的形式嵌入，null 输出为 undefined）取出 state
+- extract：XHSScraper.extract_note_from_state，从 state 解析出笔记
+
+每个阶段、每个样本：
+1. 对照校验：当前实现与下方保留的旧实现（_reference_*）输出一致，或抛出相同类型与信息的异常
+2. 吞吐：每秒解析次数（timeit 取多轮最优）
+3. 分配：单次解析的 tracemalloc 峰值分配字节数
+
+用法（在 backend 目录下）：
+    python bench/bench_extract.py
+    python bench/bench_extract.py --fixture large_note --min-time 1 --json extract.json
+"""
+import io
+import os
+import re
+import sys
+import json
+import glob
+import timeit
+import argparse
+import tracemalloc
+from contextlib import redirect_stdout
+from typing import Callable, Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE_DIR = os.path.join(BACKEND_DIR, "bench", "fixtures", "state")
+sys.path.insert(0, BACKEND_DIR)
+
+from exception import DataEmptyError, DataFetchError  # noqa: E402
+from scraper import XHSScraper, parse_initial_state_from_html  # noqa: E402
+
+FIXTURE_URL = "https://www.xiaohongshu.com/explore/bench"
+
+_REF_INITIAL_STATE_RE = re.compile(r"window\.__INITIAL_STATE__\s*=\s*(\{.*?\})\s*;?\s*</script>", re.S)
+_REF_JS_UNDEFINED_RE = re.compile(r"(?<=[:\[,])\s*undefined(?=\s*[,}\]])")
+_NULL_TOKEN_RE = re.compile(r"(?<=[:\[,])null(?=[,}\]])")
+
+
+def _reference_parse_html(html: str, url: str = "") -> Optional[dict]:
+    """优化前的 parse_initial_state_from_html（逐字保留）。"""
+    if not html:
+        return None
+    m = _REF_INITIAL_STATE_RE.search(html)
+    if not m:
+        return None
+    raw = _REF_JS_UNDEFINED_RE.sub("null", m.group(1))
+    try:
+        state = json.loads(raw)
+    except ValueError:
+        return None
+    return state if isinstance(state, dict) else None
+
+
+def _current_parse_html(html: str, url: str = "") -> Optional[dict]:
+    return parse_initial_state_from_html(html)
+
+
+def render_page(state: dict) -> str:
+    """按小红书 SSR 的形式把 state 嵌入笔记页：JS 对象字面量（null 输出为 undefined），前后还有其他脚本。"""
+    literal = _NULL_TOKEN_RE.sub("undefined", json.dumps(state, ensure_ascii=False, separators=(",", ":")))
+    return (
+        "<!doctype html><html><head><script>window.__SETUP__={env:\"prod\"};</script></head>"
+        "<body><div id=\"app\"></div>"
+        f"<script>window.__INITIAL_STATE__={literal}</script>"
+        "<script src=\"/static/vendor.js\"></script></body></html>"
+    )
+
+
+def _reference_extract(initial_state: dict, url: str) -> Dict:
+    """优化前的实现（逐字保留），作为对照校验与基准的基线。"""
+    if not initial_state:
+        raise DataFetchError("__INITIAL_STATE__ 为空")
+
+    try:
+        note_data = initial_state.get("note", {}).get("noteDetailMap") or initial_state.get("note", {}).get("note_detail_map")
+        if not note_data or not isinstance(note_data, dict):
+            raise DataFetchError("note.noteDetailMap 不存在或为空")
+        first_key = list(note_data.keys())[0]
+        wrapper = note_data[first_key]
+        if not isinstance(wrapper, dict):
+            wrapper = {}
+        note_item = wrapper.get("note") or wrapper.get("noteDetail") or wrapper
+        if not isinstance(note_item, dict):
+            note_item = {}
+        while isinstance(note_item, dict) and note_item.get("note") and isinstance(note_item.get("note"), dict):
+            inner = note_item["note"]
+            has_content = (
+                (inner.get("title") or inner.get("note_title") or "").strip()
+                or (inner.get("desc") or inner.get("description") or "").strip()
+                or (len(inner.get("imageList") or inner.get("image_list") or []) > 0)
+            )
+            if has_content:
+                note_item = inner
+                break
+            note_item = inner
+        if not note_item and wrapper:
+            note_item = wrapper
+    except KeyError as e:
+        keys = list(initial_state.keys()) if isinstance(initial_state, dict) else []
+        raise DataFetchError(f"数据结构解析失败: 缺少键 {e}。顶层键: {keys}")
+    except (IndexError, TypeError) as e:
+        raise DataFetchError(f"数据结构解析失败: noteDetailMap 为空或格式异常 ({e})")
+
+    title = (note_item.get("title") or note_item.get("note_title") or "").strip()
+    desc = (note_item.get("desc") or note_item.get("description") or "").strip()
+    tag_list = note_item.get("tagList") or note_item.get("tag_list") or []
+    tags = [t.get("name", t) if isinstance(t, dict) else str(t) for t in tag_list] if isinstance(tag_list, list) else []
+    image_list = note_item.get("imageList") or note_item.get("image_list") or []
+    if not isinstance(image_list, list):
+        image_list = []
+    images: List[str] = []
+    for img in image_list:
+        info_list = img.get("infoList", [{}])
+        raw_url = (
+            info_list[1].get("url", "")
+            if len(info_list) > 1
+            else info_list[0].get("url", "")
+        )
+        if raw_url:
+            images.append(raw_url)
+
+    has_title = (title or "").strip()
+    has_content = (desc or "").strip()
+    if not has_title and not has_content and not images:
+        note_keys = list(note_item.keys()) if isinstance(note_item, dict) else []
+        wrapper_keys = list(wrapper.keys()) if isinstance(wrapper, dict) else []
+        print(f"❌ [抓取] 笔记内容为空。URL={url}, note_item 键: {note_keys}, wrapper 键: {wrapper_keys}")
+        raise DataEmptyError(
+            "笔记内容为空：未解析到标题、正文或图片。可能页面结构已变化、需登录或该链接不是笔记页。"
+        )
+
+    return {
+        "title": title,
+        "content": desc,
+        "tags": tags,
+        "images": images,
+        "origin_url": url,
+    }
+
+
+def _outcome(fn: Callable, payload):
+    """返回 ("ok", 结果) 或 ("error", 异常类型名, 异常信息)，用于对照校验。"""
+    try:
+        with redirect_stdout(io.StringIO()):
+            return ("ok", fn(payload, FIXTURE_URL))
+    except Exception as e:
+        return ("error", type(e).__name__, str(e))
+
+
+def _calls_per_sec(fn: Callable, payload, min_time: float, repeat: int) -> float:
+    """每轮调用次数按 min_time 自动确定（大样本与小样本都能测到稳定的耗时），取多轮最优。"""
+
+    def call():
+        try:
+            fn(payload, FIXTURE_URL)
+        except (DataEmptyError, DataFetchError):
+            pass
+
+    with redirect_stdout(io.StringIO()):
+        timer = timeit.Timer(call)
+        number, elapsed = timer.autorange()
+        number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+        best = min(timer.repeat(number=number, repeat=repeat))
+    return number / best if best else 0.0
+
+
+def _peak_alloc(fn: Callable, payload) -> int:
+    with redirect_stdout(io.StringIO()):
+        tracemalloc.start()
+        try:
+            fn(payload, FIXTURE_URL)
+        except (DataEmptyError, DataFetchError):
+            pass
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return peak
+
+
+def load_fixtures(names: List[str]) -> Dict[str, dict]:
+    fixtures = {}
+    for path in sorted(glob.glob(os.path.join(FIXTURE_DIR, "*.json"))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if names and name not in names:
+            continue
+        with open(path, encoding="utf-8") as f:
+            fixtures[name] = json.load(f)
+    return fixtures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="笔记解析微基准（HTML -> state -> 笔记）")
+    parser.add_argument("--fixture", action="append", default=[], help="只跑指定样本（可多次指定），默认全部")
+    parser.add_argument("--min-time", type=float, default=0.2, help="每轮至少运行的秒数")
+    parser.add_argument("--repeat", type=int, default=5, help="轮数（取最优）")
+    parser.add_argument("--json", default="", help="结果另存为 JSON 文件")
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixture)
+    if not fixtures:
+        print(f"未找到样本：{FIXTURE_DIR}", file=sys.stderr)
+        return 1
+
+    stages = (
+        ("html", _reference_parse_html, _current_parse_html, render_page),
+        ("extract", _reference_extract, XHSScraper.extract_note_from_state, lambda state: state),
+    )
+    rows = []
+    mismatches = []
+    print(f"{'阶段':<9}{'样本':<26}{'结果':<16}{'旧 次/秒':>10}{'新 次/秒':>10}{'加速':>8}{'旧 峰值B':>10}{'新 峰值B':>10}")
+    for stage, reference, current, prepare in stages:
+        for name, state in fixtures.items():
+            payload = prepare(state)
+            expected = _outcome(reference, payload)
+            actual = _outcome(current, payload)
+            if expected != actual:
+                mismatches.append(f"{stage}/{name}")
+            ref_rate = _calls_per_sec(reference, payload, args.min_time, args.repeat)
+            new_rate = _calls_per_sec(current, payload, args.min_time, args.repeat)
+            row = {
+                "stage": stage,
+                "fixture": name,
+                "bytes": len(payload.encode()) if isinstance(payload, str) else None,
+                "outcome": actual[0] if actual[0] == "ok" else actual[1],
+                "matches_reference": expected == actual,
+                "reference_calls_per_sec": round(ref_rate),
+                "calls_per_sec": round(new_rate),
+                "speedup": round(new_rate / ref_rate, 2) if ref_rate else 0.0,
+                "reference_peak_alloc_bytes": _peak_alloc(reference, payload),
+                "peak_alloc_bytes": _peak_alloc(current, payload),
+            }
+            rows.append(row)
+            print(
+                f"{stage:<9}{name:<26}{row['outcome']:<16}{row['reference_calls_per_sec']:>10}{row['calls_per_sec']:>10}"
+                f"{row['speedup']:>7}x{row['reference_peak_alloc_bytes']:>10}{row['peak_alloc_bytes']:>10}"
+            )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+    if mismatches:
+        print(f"❌ 与旧实现不一致的样本：{', '.join(mismatches)}", file=sys.stderr)
+        return 1
+    print(f"✅ {len(fixtures)} 个样本在 {len(stages)} 个阶段的解析结果均与旧实现一致")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
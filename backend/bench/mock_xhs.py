@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+离线的小红书替身站点，供基准测试使用，不访问真实站点、不触发 300013 限流。
+
+- GET /explore/{note_id}：笔记页，内容由笔记 ID 决定（同一 ID 每次相同），可配置：
+  - --state-mode inline：SSR 内嵌 window.__INITIAL_STATE__（HTTP 快速路径可直接命中）
+  - --state-mode js：页面加载 --inject-delay-ms 毫秒后由脚本注入（HTTP 快速路径读不到，走浏览器）
+  - --latency-ms / --jitter-ms：响应延迟；--ratelimit-rate：按比例返回「安全限制 300013」页面；
+    --login-rate：按比例 302 跳转到 /login
+  - --images-per-note / --state-padding-kb：每条笔记的图片数与额外的评论等数据量（模拟真实 state 体积）
+- GET /img/{note_id}/{index}：CDN 图片（--image-kb 大小，--image-latency-ms 延迟；--webp 时返回 webp，需 Pillow）
+- GET /__stats：各类响应计数
+
+用法：python bench/mock_xhs.py --port 9100 --state-mode js --ratelimit-rate 0.02
+"""
+import io
+import os
+import sys
+import json
+import base64
+import random
+import asyncio
+import argparse
+import hashlib
+from collections import Counter
+
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import HTMLResponse, RedirectResponse, Response
+
+
+def _build_state(note_id: str, base_url: str, images_per_note: int, padding_kb: int) -> dict:
+    """按笔记 ID 生成确定性的 __INITIAL_STATE__，结构与真实笔记页一致（noteDetailMap -> note）。"""
+    rnd = random.Random(note_id)
+    image_list = []
+    for i in range(images_per_note):
+        url = f"{base_url}/img/{note_id}/{i}"
+        image_list.append({
+            "width": 1080,
+            "height": 1440,
+            "infoList": [
+                {"imageScene": "WB_PRV", "url": f"{url}?scene=prv"},
+                {"imageScene": "WB_DFT", "url": url},
+            ],
+        })
+    comments = []
+    filler = "评论内容" * 16
+    while len(json.dumps(comments, ensure_ascii=False).encode()) < padding_kb * 1024:
+        comments.append({"id": f"{rnd.getrandbits(64):016x}", "content": filler, "likeCount": rnd.randint(0, 999)})
+    note = {
+        "noteId": note_id,
+        "title": f"基准测试笔记 {note_id[:6]}",
+        "desc": "这是一条由离线替身站点生成的笔记正文。\n" * rnd.randint(2, 6),
+        "tagList": [{"name": f"标签{rnd.randint(1, 50)}"} for _ in range(rnd.randint(1, 5))],
+        "imageList": image_list,
+        "interactInfo": {"likedCount": str(rnd.randint(0, 99999)), "collectedCount": str(rnd.randint(0, 9999))},
+    }
+    return {"note": {"noteDetailMap": {note_id: {"note": note, "comments": {"list": comments}}}}}
+
+
+def create_app(args: argparse.Namespace) -> FastAPI:
+    app = FastAPI()
+    stats: Counter = Counter()
+    base_url = args.public_url or f"http://127.0.0.1:{args.port}"
+    image_cache: dict = {}
+
+    async def delay(ms: float) -> None:
+        total = ms + (random.uniform(0, args.jitter_ms) if args.jitter_ms else 0)
+        if total > 0:
+            await asyncio.sleep(total / 1000)
+
+    @app.get("/explore/{note_id}")
+    async def note_page(note_id: str):
+        await delay(args.latency_ms)
+        roll = random.random()
+        if roll < args.ratelimit_rate:
+            stats["ratelimit"] += 1
+            return HTMLResponse("<html><body><h1>安全限制</h1><p>访问频繁，请稍后再试 (300013)</p></body></html>")
+        if roll < args.ratelimit_rate + args.login_rate:
+            stats["login_redirect"] += 1
+            return RedirectResponse(f"/login?redirect=/explore/{note_id}", status_code=302)
+        stats["note"] += 1
+        state = json.dumps(_build_state(note_id, base_url, args.images_per_note, args.state_padding_kb), ensure_ascii=False)
+        if args.state_mode == "inline":
+            script = f"<script>window.__INITIAL_STATE__={state}</script>"
+        else:
+            # 以 base64 注入，HTML 中没有 window.__INITIAL_STATE__= 字面量，模拟只有浏览器能拿到数据的页面
+            encoded = base64.b64encode(state.encode()).decode()
+            script = (
+                "<script>setTimeout(function(){"
+                "var b=atob('" + encoded + "');var u=new Uint8Array(b.length);"
+                "for(var i=0;i<b.length;i++)u[i]=b.charCodeAt(i);"
+                "window.__INITIAL_STATE__=JSON.parse(new TextDecoder().decode(u));"
+                f"}},{args.inject_delay_ms});</script>"
+            )
+        return HTMLResponse(f"<html><head><title>笔记 {note_id}</title></head><body><div id='app'></div>{script}</body></html>")
+
+    @app.get("/login")
+    async def login_page():
+        stats["login_page"] += 1
+        return HTMLResponse("<html><head><title>登录</title></head><body>请登录后查看</body></html>")
+
+    @app.get("/img/{note_id}/{index}")
+    async def image(note_id: str, index: int):
+        await delay(args.image_latency_ms)
+        stats["image"] += 1
+        key = (note_id, index)
+        if key not in image_cache:
+            if len(image_cache) > 1000:
+                image_cache.clear()
+            image_cache[key] = _make_image(f"{note_id}:{index}", args.image_kb, args.webp)
+        data, mime = image_cache[key]
+        return Response(content=data, media_type=mime)
+
+    @app.get("/__stats")
+    async def get_stats():
+        return dict(stats)
+
+    return app
+
+
+def _make_image(seed: str, size_kb: int, webp: bool) -> tuple:
+    """生成约 size_kb 大小的图片；webp 需要 Pillow（未安装时退回 JPEG 字节）。"""
+    if webp:
+        try:
+            from PIL import Image
+
+            side = max(16, int((size_kb * 1024 / 3) ** 0.5))
+            img = Image.frombytes("RGB", (side, side), os.urandom(side * side * 3))
+            buffer = io.BytesIO()
+            img.save(buffer, format="WEBP", quality=90)
+            return buffer.getvalue(), "image/webp"
+        except ImportError:
+            print("ℹ️  未安装 Pillow，--webp 退回 JPEG", file=sys.stderr)
+    digest = hashlib.sha256(seed.encode()).digest()
+    body = (digest * (size_kb * 1024 // len(digest) + 1))[: max(0, size_kb * 1024 - 4)]
+    return b"\xff\xd8\xff\xe0" + body, "image/jpeg"
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="离线小红书替身站点（基准测试用）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--public-url", default="", help="页面中图片链接使用的站点地址，默认 http://127.0.0.1:<port>")
+    parser.add_argument("--state-mode", choices=("inline", "js"), default="inline")
+    parser.add_argument("--inject-delay-ms", type=int, default=300)
+    parser.add_argument("--latency-ms", type=float, default=150)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--ratelimit-rate", type=float, default=0.0)
+    parser.add_argument("--login-rate", type=float, default=0.0)
+    parser.add_argument("--images-per-note", type=int, default=6)
+    parser.add_argument("--state-padding-kb", type=int, default=40)
+    parser.add_argument("--image-kb", type=int, default=200)
+    parser.add_argument("--image-latency-ms", type=float, default=50)
+    parser.add_argument("--webp", action="store_true")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+"""
+后端负载基准：启动离线替身站点（mock_xhs.py）与后端（uvicorn main:app），按指定并发驱动接口，
+输出吞吐（notes/sec）、延迟 p50/p95/p99 与后端进程树（含 Chromium、转码子进程）的峰值 RSS。
+
+场景：
+- parse：每个请求 POST /api/batch_parse 一条链接，--concurrency 个客户端并发，延迟为单条请求耗时
+- stream：一次 POST /api/batch_parse_stream 提交全部链接，延迟为每条笔记从提交到收到 progress 的耗时
+- zip：POST /api/download_zip 打包替身站点的图片，--concurrency 个客户端并发，延迟为完整下载一个 ZIP 的耗时
+
+用法（在 backend 目录下）：
+    python bench/run_bench.py --scenario parse --notes 200 --concurrency 10
+    python bench/run_bench.py --scenario stream --notes 500 --state-mode js --unthrottled
+    python bench/run_bench.py --scenario zip --notes 20 --concurrency 4 --webp --json result.json
+"""
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import shutil
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+from typing import Dict, List, Optional
+
+import httpx
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MOCK_SCRIPT = os.path.join(BACKEND_DIR, "bench", "mock_xhs.py")
+
+# 不限速时覆盖的后端环境变量：放开令牌桶、去掉图片与重试的人为延迟
+UNTHROTTLED_ENV = {
+    "CRAWL_RATE_INITIAL": "1000",
+    "CRAWL_RATE_MAX": "1000",
+    "CRAWL_BURST": "1000",
+    "IMAGE_DOWNLOAD_DELAY_MIN": "0",
+    "IMAGE_DOWNLOAD_DELAY_MAX": "0",
+    "PARSE_RETRY_DELAY_MIN": "0",
+    "PARSE_RETRY_DELAY_MAX": "0",
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    """最近秩法百分位数。"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+class RssSampler:
+    """后台线程定期采样进程树（进程本身 + 全部子孙进程）的 RSS 总和，记录峰值。优先用 psutil，否则读 /proc。"""
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        try:
+            import psutil
+
+            self._psutil = psutil
+        except ImportError:
+            self._psutil = None
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _tree_rss(self) -> int:
+        if self._psutil is not None:
+            try:
+                root = self._psutil.Process(self.pid)
+                procs = [root] + root.children(recursive=True)
+            except self._psutil.NoSuchProcess:
+                return 0
+            total = 0
+            for p in procs:
+                try:
+                    total += p.memory_info().rss
+                except self._psutil.Error:
+                    pass
+            return total
+        return self._tree_rss_proc()
+
+    def _tree_rss_proc(self) -> int:
+        children: Dict[int, List[int]] = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+        total, stack = 0, [self.pid]
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        while stack:
+            pid = stack.pop()
+            stack.extend(children.get(pid, []))
+            try:
+                with open(f"/proc/{pid}/statm") as f:
+                    total += int(f.read().split()[1]) * page_size
+            except (OSError, IndexError, ValueError):
+                pass
+        return total
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self.peak_bytes = max(self.peak_bytes, self._tree_rss())
+            self._stop.wait(self.interval)
+
+
+def _start_process(cmd: List[str], env: Dict[str, str], log_path: str) -> subprocess.Popen:
+    log = open(log_path, "wb")
+    return subprocess.Popen(cmd, cwd=BACKEND_DIR, env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT)
+
+
+def _wait_http(url: str, proc: subprocess.Popen, timeout: float, log_path: str) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"进程提前退出（见日志 {log_path}）")
+        try:
+            if httpx.get(url, timeout=2).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.3)
+    raise RuntimeError(f"等待 {url} 就绪超时（见日志 {log_path}）")
+
+
+def _stop_process(proc: Optional[subprocess.Popen]) -> None:
+    if proc is None or proc.poll() is not None:
+        return
+    proc.terminate()
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def _note_urls(mock_url: str, count: int) -> List[str]:
+    # 每次运行使用新的随机笔记 ID，避免命中上一次运行的缓存
+    return [f"{mock_url}/explore/{uuid.uuid4().hex[:24]}" for _ in range(count)]
+
+
+async def _bench_parse(client: httpx.AsyncClient, backend: str, urls: List[str], concurrency: int) -> Dict:
+    latencies: List[float] = []
+    failed = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for url in urls:
+        queue.put_nowait(url)
+
+    async def worker():
+        nonlocal failed
+        while not queue.empty():
+            url = queue.get_nowait()
+            t0 = time.perf_counter()
+            resp = await client.post(f"{backend}/api/batch_parse", json={"urls": [url], "prefetch_images": False})
+            latencies.append(time.perf_counter() - t0)
+            if resp.status_code != 200 or not resp.json().get("notes"):
+                failed += 1
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return {"latencies": latencies, "succeeded": len(urls) - failed, "failed": failed}
+
+
+async def _bench_stream(client: httpx.AsyncClient, backend: str, urls: List[str], concurrency: int) -> Dict:
+    latencies: List[float] = []
+    counts = {"succeeded": 0, "failed": 0}
+    t0 = time.perf_counter()
+    async with client.stream(
+        "POST", f"{backend}/api/batch_parse_stream", json={"urls": urls, "prefetch_images": False}
+    ) as resp:
+        async for line in resp.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            event = json.loads(line[5:])
+            if event.get("type") == "progress":
+                latencies.append(time.perf_counter() - t0)
+                counts["succeeded" if event.get("note") else "failed"] += 1
+    return {"latencies": latencies, **counts}
+
+
+async def _bench_zip(client: httpx.AsyncClient, backend: str, urls: List[str], concurrency: int, args) -> Dict:
+    latencies: List[float] = []
+    failed = 0
+    total_bytes = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for url in urls:
+        queue.put_nowait(url)
+
+    async def worker():
+        nonlocal failed, total_bytes
+        while not queue.empty():
+            url = queue.get_nowait()
+            note_id = url.rsplit("/", 1)[1]
+            base = url.split("/explore/")[0]
+            note_data = {
+                "title": f"基准 {note_id[:6]}",
+                "content": "正文",
+                "tags": ["基准"],
+                "images": [f"{base}/img/{note_id}/{i}" for i in range(args.images_per_note)],
+                "origin_url": url,
+            }
+            t0 = time.perf_counter()
+            size = 0
+            async with client.stream(
+                "POST", f"{backend}/api/download_zip", json={"note_data": note_data, "image_format": args.image_format}
+            ) as resp:
+                async for chunk in resp.aiter_bytes():
+                    size += len(chunk)
+            latencies.append(time.perf_counter() - t0)
+            total_bytes += size
+            if resp.status_code != 200:
+                failed += 1
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return {"latencies": latencies, "succeeded": len(urls) - failed, "failed": failed, "bytes": total_bytes}
+
+
+def _report(scenario: str, result: Dict, wall: float, peak_rss: int, mock_stats: Dict, args) -> Dict:
+    lat = result["latencies"]
+    report = {
+        "scenario": scenario,
+        "notes": args.notes,
+        "concurrency": args.concurrency,
+        "state_mode": args.state_mode,
+        "wall_seconds": round(wall, 3),
+        "succeeded": result["succeeded"],
+        "failed": result["failed"],
+        "notes_per_second": round(result["succeeded"] / wall, 3) if wall else 0.0,
+        "latency_seconds": {
+            "p50": round(_percentile(lat, 50), 3),
+            "p95": round(_percentile(lat, 95), 3),
+            "p99": round(_percentile(lat, 99), 3),
+            "max": round(max(lat), 3) if lat else 0.0,
+        },
+        "peak_rss_mb": round(peak_rss / 1024 / 1024, 1) if peak_rss else None,
+        "mock": mock_stats,
+    }
+    if result.get("state_transfer"):
+        report["state_transfer"] = result["state_transfer"]
+    if "bytes" in result:
+        report["mb_per_second"] = round(result["bytes"] / 1024 / 1024 / wall, 2) if wall else 0.0
+    return report
+
+
+def _print_report(report: Dict) -> None:
+    lat = report["latency_seconds"]
+    print()
+    print(f"场景 {report['scenario']}：{report['notes']} 条笔记，并发 {report['concurrency']}，state={report['state_mode']}")
+    print(f"  耗时        {report['wall_seconds']:.2f}s（成功 {report['succeeded']}，失败 {report['failed']}）")
+    print(f"  吞吐        {report['notes_per_second']:.2f} notes/sec")
+    if "mb_per_second" in report:
+        print(f"  下载        {report['mb_per_second']:.2f} MB/s")
+    print(f"  延迟        p50 {lat['p50']:.3f}s  p95 {lat['p95']:.3f}s  p99 {lat['p99']:.3f}s  max {lat['max']:.3f}s")
+    if report["peak_rss_mb"] is not None:
+        print(f"  峰值 RSS    {report['peak_rss_mb']:.1f} MB（后端进程树）")
+    transfer = report.get("state_transfer")
+    if transfer and (transfer["slim"]["count"] or transfer["full"]["count"]):
+        line = f"slim {transfer['slim']['avg_bytes']} B × {transfer['slim']['count']}，full {transfer['full']['avg_bytes']} B × {transfer['full']['count']}"
+        if transfer["full_measured"]["count"]:
+            line += f"，同批笔记完整 map {transfer['full_measured']['avg_bytes']} B"
+        print(f"  state 传输  每条平均 {line}（后端累计）")
+    print(f"  替身站点    {report['mock']}")
+
+
+async def _run(args, backend: str, mock_url: str) -> tuple:
+    urls = _note_urls(mock_url, args.notes)
+    timeout = httpx.Timeout(args.request_timeout)
+    limits = httpx.Limits(max_connections=max(10, args.concurrency * 2))
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        t0 = time.perf_counter()
+        if args.scenario == "parse":
+            result = await _bench_parse(client, backend, urls, args.concurrency)
+        elif args.scenario == "stream":
+            result = await _bench_stream(client, backend, urls, args.concurrency)
+        else:
+            result = await _bench_zip(client, backend, urls, args.concurrency, args)
+        wall = time.perf_counter() - t0
+        mock_stats = (await client.get(f"{mock_url}/__stats")).json()
+        try:
+            result["state_transfer"] = (await client.get(f"{backend}/api/stats")).json().get("state_transfer")
+        except (httpx.HTTPError, ValueError):
+            pass
+    return result, wall, mock_stats
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="XHS Factory 后端负载基准（离线替身站点）")
+    parser.add_argument("--scenario", choices=("parse", "stream", "zip"), default="parse")
+    parser.add_argument("--notes", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--unthrottled", action="store_true", help="放开调度器限速与人为延迟，测后端本身的上限")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="额外的后端环境变量，可重复")
+    parser.add_argument("--backend-url", default="", help="使用已运行的后端（不再启动；峰值 RSS 需配合 --backend-pid）")
+    parser.add_argument("--backend-pid", type=int, default=0)
+    parser.add_argument("--image-format", choices=("png", "jpeg", "passthrough"), default="png")
+    parser.add_argument("--request-timeout", type=float, default=300)
+    parser.add_argument("--json", default="", help="把结果写入 JSON 文件")
+    # 替身站点参数（透传给 mock_xhs.py）
+    parser.add_argument("--state-mode", choices=("inline", "js"), default="inline")
+    parser.add_argument("--latency-ms", type=float, default=150)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--ratelimit-rate", type=float, default=0.0)
+    parser.add_argument("--login-rate", type=float, default=0.0)
+    parser.add_argument("--images-per-note", type=int, default=6)
+    parser.add_argument("--state-padding-kb", type=int, default=40)
+    parser.add_argument("--image-kb", type=int, default=200)
+    parser.add_argument("--image-latency-ms", type=float, default=50)
+    parser.add_argument("--webp", action="store_true")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="xhs-bench-")
+    mock_port = _free_port()
+    mock_url = f"http://127.0.0.1:{mock_port}"
+    mock_cmd = [
+        sys.executable, MOCK_SCRIPT, "--port", str(mock_port),
+        "--state-mode", args.state_mode,
+        "--latency-ms", str(args.latency_ms),
+        "--jitter-ms", str(args.jitter_ms),
+        "--ratelimit-rate", str(args.ratelimit_rate),
+        "--login-rate", str(args.login_rate),
+        "--images-per-note", str(args.images_per_note),
+        "--state-padding-kb", str(args.state_padding_kb),
+        "--image-kb", str(args.image_kb),
+        "--image-latency-ms", str(args.image_latency_ms),
+    ] + (["--webp"] if args.webp else [])
+
+    mock_proc = backend_proc = None
+    sampler: Optional[RssSampler] = None
+    ok = False
+    try:
+        mock_log = os.path.join(work_dir, "mock.log")
+        mock_proc = _start_process(mock_cmd, {}, mock_log)
+        _wait_http(f"{mock_url}/__stats", mock_proc, 30, mock_log)
+
+        if args.backend_url:
+            backend = args.backend_url.rstrip("/")
+            backend_pid = args.backend_pid
+        else:
+            backend_port = _free_port()
+            backend = f"http://127.0.0.1:{backend_port}"
+            env = {
+                # 独立的数据目录，且关闭解析缓存与图片预取，每次运行都真实抓取
+                "XHS_DATA_DIR": os.path.join(work_dir, "data"),
+                "XHS_PARSE_CACHE": "0",
+                "XHS_IMAGE_PREFETCH": "0",
+            }
+            if args.unthrottled:
+                env.update(UNTHROTTLED_ENV)
+            for item in args.env:
+                key, _, value = item.partition("=")
+                env[key] = value
+            backend_log = os.path.join(work_dir, "backend.log")
+            backend_proc = _start_process(
+                [sys.executable, "-m", "uvicorn", "main:app", "--port", str(backend_port), "--log-level", "warning"],
+                env,
+                backend_log,
+            )
+            _wait_http(f"{backend}/api/stats", backend_proc, 120, backend_log)
+            backend_pid = backend_proc.pid
+
+        if backend_pid:
+            sampler = RssSampler(backend_pid)
+            sampler.start()
+        result, wall, mock_stats = asyncio.run(_run(args, backend, mock_url))
+        if sampler:
+            sampler.stop()
+        report = _report(args.scenario, result, wall, sampler.peak_bytes if sampler else 0, mock_stats, args)
+        _print_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        ok = True
+        return 0
+    finally:
+        _stop_process(backend_proc)
+        _stop_process(mock_proc)
+        if ok:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        else:
+            print(f"\n基准未完成，日志保留在: {work_dir}")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+"""
+应用级共享 Chromium 浏览器池：在 FastAPI lifespan 中创建，所有抓取请求从池中租用页面，
+避免每条链接都启动一次浏览器（启动耗时与内存是单条笔记延迟的大头）。
+
+- 浏览器数、每个浏览器的 context 数、每个 context 的并发页面数均可通过环境变量配置
+- 租用页面时挑选在用页面最少的健康浏览器；每个浏览器累计服务 N 个页面后自动回收（新建替换、旧的用完即关，启动与关闭都在后台进行，不占用池锁）
+- 后台定时健康检查，替换已断开的浏览器
+- 每个 context 带一个页面池（page_pool.PagePool）：页面用完重置后复用，不在热路径上新建/关闭页面
+- 内存管控：定时采样每个浏览器的进程 RSS（经 CDP SystemInfo.getProcessInfo 取得进程号）与打开的页面数，
+  超过 BROWSER_MAX_RSS_MB / BROWSER_MAX_OPEN_PAGES 时按上面的回收流程替换，进行中的抓取不受影响；
+  回收事件与内存读数见 stats()
+"""
+import os
+import asyncio
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Set
+
+from playwright.async_api import async_playwright
+
+from scraper import BROWSER_LAUNCH_ARGS, CONTEXT_OPTIONS, _log
+from resource_filter import resource_filter
+from page_pool import PagePool, page_pool_stats
+import metrics
+
+
+# 池中浏览器数量
+BROWSER_POOL_SIZE = max(1, int(os.getenv("BROWSER_POOL_SIZE", "2")))
+# 每个浏览器的 context 数（context 之间 cookie/缓存隔离）
+BROWSER_POOL_CONTEXTS = max(1, int(os.getenv("BROWSER_POOL_CONTEXTS", "1")))
+# 每个 context 同时打开的页面上限
+BROWSER_POOL_PAGES_PER_CONTEXT = max(1, int(os.getenv("BROWSER_POOL_PAGES_PER_CONTEXT", "3")))
+# 每个浏览器累计服务多少个页面后回收重建（0 表示不回收）
+BROWSER_RECYCLE_AFTER_PAGES = max(0, int(os.getenv("BROWSER_RECYCLE_AFTER_PAGES", "200")))
+# 健康检查间隔（秒）
+BROWSER_HEALTH_CHECK_INTERVAL = max(1.0, float(os.getenv("BROWSER_HEALTH_CHECK_INTERVAL", "30")))
+# 单个浏览器（含 GPU、渲染等全部子进程）RSS 超过多少 MB 时回收（0 表示不按内存回收）
+BROWSER_MAX_RSS_MB = max(0.0, float(os.getenv("BROWSER_MAX_RSS_MB", "1500")))
+# 单个浏览器打开的页面数超过多少时回收（页面泄漏兜底，0 表示不限）
+BROWSER_MAX_OPEN_PAGES = max(0, int(os.getenv("BROWSER_MAX_OPEN_PAGES", "0")))
+# 内存采样间隔（秒）
+BROWSER_MEMORY_CHECK_INTERVAL = max(1.0, float(os.getenv("BROWSER_MEMORY_CHECK_INTERVAL", "15")))
+# 保留最近多少条回收事件
+BROWSER_RECYCLE_EVENTS = 50
+
+
+def _process_rss(pids: List[int]) -> Optional[int]:
+    """若干进程的 RSS 总和（字节）；优先用 psutil，否则读 /proc，都不可用时返回 None。"""
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    total = 0
+    for pid in pids:
+        if psutil is not None:
+            try:
+                total += psutil.Process(pid).memory_info().rss
+            except psutil.Error:
+                pass
+            continue
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, IndexError):
+            return None
+    return total
+
+
+class _BrowserSlot:
+    """池中的一个浏览器及其 context（每个 context 一个页面池），记录在用页面数与累计服务页面数。"""
+
+    def __init__(self, slot_id: int, browser, page_pools: List[PagePool]):
+        self.slot_id = slot_id
+        self.browser = browser
+        self.page_pools = page_pools
+        self.in_flight = 0
+        self.pages_served = 0
+        self.retired = False
+        self.drained = asyncio.Event()  # 回收后在用页面全部归还时置位，之后才关闭浏览器
+        self.created_at = time.time()
+        self.rss_bytes: Optional[int] = None
+        self.open_pages = 0
+        self.sampled_at: Optional[float] = None
+        self._cdp = None
+        self._next_context = 0
+
+    def healthy(self) -> bool:
+        try:
+            return self.browser.is_connected()
+        except Exception:
+            return False
+
+    def next_page_pool(self) -> PagePool:
+        """在本浏览器的各 context 之间轮询。"""
+        pages = self.page_pools[self._next_context % len(self.page_pools)]
+        self._next_context += 1
+        return pages
+
+    async def sample_memory(self) -> None:
+        """采样本浏览器全部进程的 RSS 与打开的页面数。"""
+        self.open_pages = sum(len(ctx.pages) for ctx in self.browser.contexts)
+        try:
+            if self._cdp is None:
+                self._cdp = await self.browser.new_browser_cdp_session()
+            info = await self._cdp.send("SystemInfo.getProcessInfo")
+            pids = [p["id"] for p in info.get("processInfo", []) if p.get("id")]
+            self.rss_bytes = _process_rss(pids)
+        except Exception as e:
+            self._cdp = None
+            self.rss_bytes = None
+            _log(f"[浏览器池] 浏览器 #{self.slot_id} 内存采样失败: {e}")
+        self.sampled_at = time.time()
+
+
+class BrowserPool:
+    def __init__(
+        self,
+        size: int = BROWSER_POOL_SIZE,
+        contexts_per_browser: int = BROWSER_POOL_CONTEXTS,
+        pages_per_context: int = BROWSER_POOL_PAGES_PER_CONTEXT,
+        recycle_after_pages: int = BROWSER_RECYCLE_AFTER_PAGES,
+        health_check_interval: float = BROWSER_HEALTH_CHECK_INTERVAL,
+        max_rss_mb: float = BROWSER_MAX_RSS_MB,
+        max_open_pages: int = BROWSER_MAX_OPEN_PAGES,
+        memory_check_interval: float = BROWSER_MEMORY_CHECK_INTERVAL,
+    ):
+        self.size = size
+        self.contexts_per_browser = contexts_per_browser
+        self.pages_per_context = pages_per_context
+        self.recycle_after_pages = recycle_after_pages
+        self.health_check_interval = health_check_interval
+        self.max_rss_mb = max_rss_mb
+        self.max_open_pages = max_open_pages
+        self.memory_check_interval = memory_check_interval
+
+        self._playwright = None
+        self._slots: List[_BrowserSlot] = []
+        self._lock = asyncio.Lock()
+        self._launches: Set[asyncio.Task] = set()
+        self._teardowns: Dict[_BrowserSlot, asyncio.Task] = {}
+        self._capacity = asyncio.Semaphore(size * contexts_per_browser * pages_per_context)
+        self._health_task: Optional[asyncio.Task] = None
+        self._memory_task: Optional[asyncio.Task] = None
+        self._next_slot_id = 0
+        self._closed = False
+
+        # 统计
+        self.leases_total = 0
+        self.in_use = 0
+        self.browsers_launched = 0
+        self.browsers_recycled = 0
+        self.browsers_replaced_unhealthy = 0
+        self.browsers_recycled_memory = 0
+        self.page_counters: Counter = Counter()
+        self.recycle_events: deque = deque(maxlen=BROWSER_RECYCLE_EVENTS)
+
+    @property
+    def capacity(self) -> int:
+        return self.size * self.contexts_per_browser * self.pages_per_context
+
+    async def start(self):
+        """启动 Playwright 驱动与全部浏览器，并开启健康检查。"""
+        if self._playwright:
+            return
+        self._playwright = await async_playwright().start()
+        async with self._lock:
+            for _ in range(self.size):
+                self._slots.append(await self._launch_slot())
+        self._health_task = asyncio.create_task(self._health_loop())
+        if self.max_rss_mb or self.max_open_pages:
+            self._memory_task = asyncio.create_task(self._memory_loop())
+        print(f"🌐 [浏览器池] 已启动 {self.size} 个浏览器，可同时租用 {self.capacity} 个页面")
+
+    async def close(self):
+        """关闭所有浏览器与 Playwright 驱动。"""
+        self._closed = True
+        for task in (self._health_task, self._memory_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._health_task = self._memory_task = None
+        # 正在启动的替换浏览器启动完成后发现池已关闭会自行关闭；回收中的浏览器不再等在用页面归还
+        await asyncio.gather(*self._launches, return_exceptions=True)
+        for slot in list(self._teardowns):
+            slot.drained.set()
+        await asyncio.gather(*self._teardowns.values(), return_exceptions=True)
+        async with self._lock:
+            slots, self._slots = self._slots, []
+        for slot in slots:
+            await self._close_slot(slot)
+        if self._playwright:
+            await self._playwright.stop()
+            self._playwright = None
+
+    async def _launch_slot(self) -> _BrowserSlot:
+        browser = await self._playwright.chromium.launch(headless=True, args=BROWSER_LAUNCH_ARGS)
+        page_pools = []
+        for _ in range(self.contexts_per_browser):
+            ctx = await browser.new_context(**CONTEXT_OPTIONS)
+            await resource_filter.install(ctx)
+            pages = PagePool(ctx, max_idle=self.pages_per_context, counters=self.page_counters)
+            await pages.prewarm()
+            page_pools.append(pages)
+        slot = _BrowserSlot(self._next_slot_id, browser, page_pools)
+        self._next_slot_id += 1
+        self.browsers_launched += 1
+        _log(f"[浏览器池] 启动浏览器 #{slot.slot_id}")
+        return slot
+
+    async def _close_slot(self, slot: _BrowserSlot):
+        try:
+            await slot.browser.close()
+        except Exception as e:
+            print(f"   [浏览器池] 关闭浏览器 #{slot.slot_id} 失败: {e}")
+
+    def _spawn_replacement(self) -> None:
+        """在后台启动一个浏览器，启动期间不持有 self._lock（启动要数秒，不能阻塞其他租用），就绪后再加锁放入池中。"""
+        task = asyncio.create_task(self._add_slot())
+        self._launches.add(task)
+        task.add_done_callback(self._launch_done)
+
+    def _launch_done(self, task: asyncio.Task) -> None:
+        self._launches.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"   [浏览器池] 启动浏览器失败: {task.exception()}")
+
+    async def _add_slot(self) -> None:
+        slot = await self._launch_slot()
+        async with self._lock:
+            closed = self._closed
+            if not closed:
+                self._slots.append(slot)
+        if closed:
+            await self._close_slot(slot)
+
+    def _retire(self, slot: _BrowserSlot, reason: str):
+        """
+        将浏览器移出池（调用方需持有 self._lock）：锁内只摘除并标记，在后台启动替换者（就绪前新租用分到其余浏览器）
+        并在后台关闭旧浏览器的空闲页面，旧浏览器待在用页面归还后再关闭，不影响进行中的抓取与其他租用。
+        """
+        if slot.retired:
+            return
+        slot.retired = True
+        if slot in self._slots:
+            self._slots.remove(slot)
+        _log(f"[浏览器池] 回收浏览器 #{slot.slot_id}（{reason}，已服务 {slot.pages_served} 页）")
+        self.recycle_events.append({
+            "at": time.time(),
+            "browser": slot.slot_id,
+            "reason": reason,
+            "pages_served": slot.pages_served,
+            "in_flight": slot.in_flight,
+            "rss_mb": _mb(slot.rss_bytes),
+            "open_pages": slot.open_pages,
+        })
+        if not self._closed:
+            self._spawn_replacement()
+        if slot.in_flight == 0:
+            slot.drained.set()
+        task = asyncio.create_task(self._teardown(slot))
+        self._teardowns[slot] = task
+        task.add_done_callback(lambda _: self._teardowns.pop(slot, None))
+
+    async def _teardown(self, slot: _BrowserSlot):
+        """后台关闭回收的浏览器（不持有 self._lock）：先关空闲页面，等在用页面全部归还后关闭浏览器。"""
+        try:
+            for pages in slot.page_pools:
+                await pages.close()
+        except Exception as e:
+            print(f"   [浏览器池] 关闭浏览器 #{slot.slot_id} 的页面失败: {e}")
+        await slot.drained.wait()
+        await self._close_slot(slot)
+
+    async def _acquire_slot(self) -> _BrowserSlot:
+        while True:
+            async with self._lock:
+                for slot in list(self._slots):
+                    if not slot.healthy():
+                        self.browsers_replaced_unhealthy += 1
+                        metrics.BROWSER_RECYCLES.labels("unhealthy").inc()
+                        self._retire(slot, "已断开")
+                if self._slots:
+                    slot = min(self._slots, key=lambda s: s.in_flight)
+                    slot.in_flight += 1
+                    return slot
+                # 池中暂无可用浏览器：不持锁等待替换者启动完成
+                if not self._launches:
+                    self._spawn_replacement()
+                launches = list(self._launches)
+            done, _ = await asyncio.wait(launches, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is not None and not self._slots:
+                    raise task.exception()
+
+    async def _release_slot(self, slot: _BrowserSlot):
+        async with self._lock:
+            slot.in_flight -= 1
+            slot.pages_served += 1
+            if (
+                not slot.retired
+                and self.recycle_after_pages
+                and slot.pages_served >= self.recycle_after_pages
+            ):
+                self.browsers_recycled += 1
+                metrics.BROWSER_RECYCLES.labels("pages_served").inc()
+                self._retire(slot, f"达到 {self.recycle_after_pages} 页上限")
+            elif slot.retired and slot.in_flight == 0:
+                slot.drained.set()
+
+    @asynccontextmanager
+    async def lease_page(self):
+        """从页面池租用一个页面，用完重置后放回（出错则关闭），并归还浏览器容量。"""
+        if not self._playwright:
+            await self.start()
+        async with self._capacity:
+            slot = await self._acquire_slot()
+            try:
+                async with slot.next_page_pool().lease() as page:
+                    self.leases_total += 1
+                    self.in_use += 1
+                    try:
+                        yield page
+                    finally:
+                        self.in_use -= 1
+            finally:
+                await self._release_slot(slot)
+
+    async def _health_loop(self):
+        while not self._closed:
+            await asyncio.sleep(self.health_check_interval)
+            try:
+                async with self._lock:
+                    for slot in list(self._slots):
+                        if not slot.healthy():
+                            self.browsers_replaced_unhealthy += 1
+                            metrics.BROWSER_RECYCLES.labels("unhealthy").inc()
+                            self._retire(slot, "健康检查失败")
+            except Exception as e:
+                print(f"   [浏览器池] 健康检查异常: {e}")
+
+    async def _memory_loop(self):
+        while not self._closed:
+            await asyncio.sleep(self.memory_check_interval)
+            try:
+                await self.check_memory()
+            except Exception as e:
+                print(f"   [浏览器池] 内存检查异常: {e}")
+
+    async def check_memory(self):
+        """采样各浏览器的内存与页面数，超限的浏览器走回收流程（在用页面归还后才关闭）。"""
+        for slot in list(self._slots):
+            await slot.sample_memory()
+        async with self._lock:
+            for slot in list(self._slots):
+                # 还没服务过页面的新浏览器不回收，避免阈值过低时反复重建
+                if slot.retired or slot.pages_served == 0:
+                    continue
+                reason = None
+                if self.max_rss_mb and slot.rss_bytes is not None and slot.rss_bytes > self.max_rss_mb * 1024 * 1024:
+                    reason = f"内存 {_mb(slot.rss_bytes)} MB 超过 {self.max_rss_mb:g} MB"
+                elif self.max_open_pages and slot.open_pages > self.max_open_pages:
+                    reason = f"打开 {slot.open_pages} 个页面，超过 {self.max_open_pages}"
+                if reason:
+                    self.browsers_recycled_memory += 1
+                    metrics.BROWSER_RECYCLES.labels("memory").inc()
+                    self._retire(slot, reason)
+
+    @property
+    def rss_bytes(self) -> int:
+        """最近一次采样时各浏览器 RSS 之和（字节）。"""
+        return sum(s.rss_bytes or 0 for s in self._slots)
+
+    def stats(self) -> dict:
+        return {
+            "browsers": [
+                {
+                    "id": s.slot_id,
+                    "connected": s.healthy(),
+                    "in_flight": s.in_flight,
+                    "pages_served": s.pages_served,
+                    "age_seconds": round(time.time() - s.created_at, 1),
+                    "rss_mb": _mb(s.rss_bytes),
+                    "open_pages": s.open_pages,
+                }
+                for s in self._slots
+            ],
+            "capacity": self.capacity,
+            "in_use": self.in_use,
+            "leases_total": self.leases_total,
+            "browsers_launched": self.browsers_launched,
+            "browsers_recycled": self.browsers_recycled,
+            "browsers_replaced_unhealthy": self.browsers_replaced_unhealthy,
+            "browsers_recycled_memory": self.browsers_recycled_memory,
+            "memory_limits": {"max_rss_mb": self.max_rss_mb, "max_open_pages": self.max_open_pages},
+            "recycle_events": list(self.recycle_events)[-10:],
+            "pages": page_pool_stats(self.page_counters, sum(p.idle for s in self._slots for p in s.page_pools)),
+        }
+
+
+def _mb(nbytes: Optional[int]) -> Optional[float]:
+    return round(nbytes / 1024 / 1024, 1) if nbytes is not None else None
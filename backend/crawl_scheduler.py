@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+"""
+进程级抓取调度器：所有接口的抓取都经由同一个调度器，取代每个请求各自的 Semaphore 与固定 sleep。
+
+- 并发上限：全进程共享（BATCH_PARSE_CONCURRENCY），两个批次同时跑也不会叠加压力
+- 令牌桶控速：每次抓取前取一个令牌，速率为 rate（条/秒）
+- AIMD 自适应：成功一次速率加 CRAWL_RATE_INCREASE（加性增），遇到 RateLimitError 速率乘以
+  CRAWL_RATE_DECREASE（乘性减）并清空令牌、冷却 CRAWL_RATE_LIMIT_COOLDOWN 秒
+- 熔断器：窗口内限流比例过高时全进程暂停抓取，冷却时间按连续熔断次数指数退避；冷却结束后只放行一个
+  试探请求，成功才恢复，仍被限流则再次熔断。被限流的链接在恢复后重新排队（最多 CRAWL_RATE_LIMIT_RETRIES 次），
+  批次等待而不是整批失败；单链接的时间预算（budget）只在放行抓取后计时，熔断冷却不会让排队中的链接超时
+- bounded_map：批次内固定数量的 worker 从输入迭代器逐个取任务，不为每个链接预先创建协程
+"""
+import os
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, Optional, TypeVar, Union
+
+from exception import RateLimitError
+
+
+# 全进程抓取并发上限（默认 5，范围 1～10）
+BATCH_PARSE_CONCURRENCY = max(1, min(10, int(os.getenv("BATCH_PARSE_CONCURRENCY", "5"))))
+# 令牌桶速率（条/秒）：初始值、下限、上限
+CRAWL_RATE_INITIAL = float(os.getenv("CRAWL_RATE_INITIAL", "1.0"))
+CRAWL_RATE_MIN = float(os.getenv("CRAWL_RATE_MIN", "0.1"))
+CRAWL_RATE_MAX = float(os.getenv("CRAWL_RATE_MAX", "3.0"))
+# 每次成功后速率增加量（条/秒）；每次限流后速率乘数
+CRAWL_RATE_INCREASE = float(os.getenv("CRAWL_RATE_INCREASE", "0.05"))
+CRAWL_RATE_DECREASE = min(1.0, max(0.05, float(os.getenv("CRAWL_RATE_DECREASE", "0.5"))))
+# 限流后暂停发放令牌的秒数
+CRAWL_RATE_LIMIT_COOLDOWN = float(os.getenv("CRAWL_RATE_LIMIT_COOLDOWN", "10"))
+# 令牌桶容量（允许的突发条数）
+CRAWL_BURST = max(1.0, float(os.getenv("CRAWL_BURST", "2")))
+# 每个批次的 worker 数（默认为并发上限的 2 倍，排队等令牌的 worker 保证调度器名额不空闲）
+BATCH_WORKERS = max(1, int(os.getenv("BATCH_WORKERS", str(BATCH_PARSE_CONCURRENCY * 2))))
+# 是否启用限流熔断器
+CRAWL_BREAKER_ENABLED = os.getenv("CRAWL_BREAKER", "1").strip().lower() in ("1", "true", "yes")
+# 统计窗口（秒）：窗口内至少 CRAWL_BREAKER_MIN_EVENTS 次限流、且占抓取结果的比例达到 CRAWL_BREAKER_THRESHOLD 时熔断
+CRAWL_BREAKER_WINDOW = max(1.0, float(os.getenv("CRAWL_BREAKER_WINDOW", "60")))
+CRAWL_BREAKER_MIN_EVENTS = max(1, int(os.getenv("CRAWL_BREAKER_MIN_EVENTS", "3")))
+CRAWL_BREAKER_THRESHOLD = min(1.0, max(0.0, float(os.getenv("CRAWL_BREAKER_THRESHOLD", "0.3"))))
+# 熔断冷却（秒）：首次为 CRAWL_BREAKER_COOLDOWN，试探仍被限流时翻倍，最长 CRAWL_BREAKER_COOLDOWN_MAX
+CRAWL_BREAKER_COOLDOWN = max(1.0, float(os.getenv("CRAWL_BREAKER_COOLDOWN", "60")))
+CRAWL_BREAKER_COOLDOWN_MAX = max(CRAWL_BREAKER_COOLDOWN, float(os.getenv("CRAWL_BREAKER_COOLDOWN_MAX", "900")))
+# 被限流的链接最多重新排队几次（等熔断恢复 / 速率冷却后再抓），用完仍限流才判为失败
+CRAWL_RATE_LIMIT_RETRIES = max(0, int(os.getenv("CRAWL_RATE_LIMIT_RETRIES", "2")))
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half_open"
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class CircuitBreaker:
+    """
+    限流熔断器：closed（正常放行）-> open（全部等待冷却）-> half_open（只放行一个试探请求）-> closed / open。
+    state 每次变化 version 加一，便于流式接口推送状态。
+    """
+
+    def __init__(
+        self,
+        enabled: bool = CRAWL_BREAKER_ENABLED,
+        window: float = CRAWL_BREAKER_WINDOW,
+        min_events: int = CRAWL_BREAKER_MIN_EVENTS,
+        threshold: float = CRAWL_BREAKER_THRESHOLD,
+        cooldown: float = CRAWL_BREAKER_COOLDOWN,
+        cooldown_max: float = CRAWL_BREAKER_COOLDOWN_MAX,
+    ):
+        self.enabled = enabled
+        self.window = window
+        self.min_events = min_events
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.cooldown_max = max(cooldown, cooldown_max)
+
+        self.state = BREAKER_CLOSED
+        self.version = 0
+        self._outcomes: deque = deque()  # (时间, 是否限流)
+        self._open_until = 0.0
+        self._consecutive_trips = 0
+        self._probe_in_flight = False
+        self._changed = asyncio.Event()
+
+        # 统计
+        self.trips = 0
+        self.waiting = 0
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        self.version += 1
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _wait_change(self, timeout: Optional[float]) -> None:
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    @property
+    def blocking(self) -> bool:
+        """是否处于熔断（open / half_open），非试探请求应等待。"""
+        return self.enabled and self.state != BREAKER_CLOSED
+
+    async def acquire(self) -> bool:
+        """
+        closed 时直接放行；open 时等待冷却结束；half_open 时只放行一个试探请求，其余等待试探结果。
+        返回本次是否为试探请求（试探请求结束后须调用 record / release_probe）。
+        """
+        self.waiting += 1
+        try:
+            while self.blocking:
+                now = time.monotonic()
+                if self.state == BREAKER_OPEN and now < self._open_until:
+                    await self._wait_change(self._open_until - now)
+                    continue
+                if self.state == BREAKER_OPEN:
+                    self._set_state(BREAKER_HALF_OPEN)
+                    print("🔎 [熔断] 冷却结束，放行一个试探请求")
+                if not self._probe_in_flight:
+                    self._probe_in_flight = True
+                    return True
+                await self._wait_change(None)
+            return False
+        finally:
+            self.waiting -= 1
+
+    def release_probe(self) -> None:
+        """试探请求未产生结果就结束（如被取消）时交还试探名额，由下一个等待者试探。"""
+        if self._probe_in_flight:
+            self._probe_in_flight = False
+            self._changed.set()
+            self._changed = asyncio.Event()
+
+    def record(self, rate_limited: bool, probe: bool = False) -> None:
+        """记录一次抓取结果：试探请求决定恢复或再次熔断；closed 时按窗口内限流比例判断是否熔断。"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if probe:
+            self._probe_in_flight = False
+            if rate_limited:
+                self._trip(now, "试探请求仍被限流")
+            else:
+                self._consecutive_trips = 0
+                self._outcomes.clear()
+                self._set_state(BREAKER_CLOSED)
+                print("✅ [熔断] 试探成功，恢复抓取")
+            return
+        self._outcomes.append((now, rate_limited))
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            self._outcomes.popleft()
+        if rate_limited and self.state == BREAKER_CLOSED:
+            limited = sum(1 for _, r in self._outcomes if r)
+            if limited >= self.min_events and limited / len(self._outcomes) >= self.threshold:
+                self._trip(now, f"{self.window:.0f}s 内 {limited}/{len(self._outcomes)} 次限流")
+
+    def _trip(self, now: float, reason: str) -> None:
+        self._consecutive_trips += 1
+        self.trips += 1
+        cooldown = min(self.cooldown_max, self.cooldown * 2 ** (self._consecutive_trips - 1))
+        self._open_until = now + cooldown
+        self._set_state(BREAKER_OPEN)
+        print(f"⛔ [熔断] {reason}，暂停全部抓取 {cooldown:.0f}s")
+
+    def stats(self) -> dict:
+        limited = sum(1 for _, r in self._outcomes if r)
+        return {
+            "enabled": self.enabled,
+            "state": self.state,
+            "cooldown_seconds_left": round(max(0.0, self._open_until - time.monotonic()), 1)
+            if self.state == BREAKER_OPEN
+            else 0.0,
+            "consecutive_trips": self._consecutive_trips,
+            "trips": self.trips,
+            "waiting": self.waiting,
+            "window": {"rate_limited": limited, "total": len(self._outcomes)},
+        }
+
+
+class CrawlScheduler:
+    def __init__(
+        self,
+        max_concurrency: int = BATCH_PARSE_CONCURRENCY,
+        rate: float = CRAWL_RATE_INITIAL,
+        rate_min: float = CRAWL_RATE_MIN,
+        rate_max: float = CRAWL_RATE_MAX,
+        increase: float = CRAWL_RATE_INCREASE,
+        decrease: float = CRAWL_RATE_DECREASE,
+        cooldown: float = CRAWL_RATE_LIMIT_COOLDOWN,
+        burst: float = CRAWL_BURST,
+        rate_limit_retries: int = CRAWL_RATE_LIMIT_RETRIES,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.rate_min = rate_min
+        self.rate_max = max(rate_min, rate_max)
+        self.rate = min(self.rate_max, max(rate_min, rate))
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.burst = burst
+        self.rate_limit_retries = rate_limit_retries
+        self.breaker = breaker or CircuitBreaker()
+
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._token_lock = asyncio.Lock()
+        self._tokens = min(1.0, burst)
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+
+        # 统计
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rate_limited = 0
+        self.rate_limit_requeued = 0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    async def _take_token(self) -> None:
+        """按令牌桶速率等待并取走一个令牌；冷却期内不发放。"""
+        async with self._token_lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    @asynccontextmanager
+    async def slot(self):
+        """占用一个并发名额并取得令牌后进入；退出时释放名额。"""
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            await self._take_token()
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+        finally:
+            self._slots.release()
+
+    def on_success(self) -> None:
+        self.completed += 1
+        self.rate = min(self.rate_max, self.rate + self.increase)
+
+    def on_rate_limit(self) -> None:
+        self.completed += 1
+        self.rate_limited += 1
+        self.rate = max(self.rate_min, self.rate * self.decrease)
+        self._tokens = 0.0
+        self._paused_until = max(self._paused_until, time.monotonic() + self.cooldown)
+        print(f"⚠️ [调度] 命中限流，速率降至 {self.rate:.2f} 条/秒，暂停 {self.cooldown:.0f}s")
+
+    async def run(self, fn, *args, budget: Optional[float] = None, **kwargs):
+        """
+        在调度器控制下执行一次抓取；根据是否限流调整速率并反馈给熔断器，其他异常不影响速率。
+        熔断期间等待恢复；被限流时重新排队（最多 rate_limit_retries 次），等熔断恢复或速率冷却后再抓。
+        budget 为单条链接的抓取时间预算（秒），只在拿到名额与令牌后计时，等熔断 / 速率冷却 / 名额期间暂停，
+        重新排队的各次尝试共用这一预算；设置时 fn 收到的 deadline 为本次尝试的截止时刻（与传入的 deadline，
+        如整批截止时间，取较早者），超出截止时刻的尝试被取消并抛出 TimeoutError。
+        """
+        outer_deadline = kwargs.pop("deadline", None) if budget is not None else None
+        spent = 0.0
+        requeued = 0
+        while True:
+            probe = await self.breaker.acquire()
+            try:
+                async with self.slot():
+                    # 排队等名额/令牌期间熔断已触发：让出名额，回到熔断器等待
+                    if not probe and self.breaker.blocking:
+                        continue
+                    started = time.monotonic()
+                    try:
+                        if budget is None:
+                            result = await fn(*args, **kwargs)
+                        else:
+                            deadline = started + budget - spent
+                            if outer_deadline is not None:
+                                deadline = min(deadline, outer_deadline)
+                            async with asyncio.timeout_at(deadline):
+                                result = await fn(*args, deadline=deadline, **kwargs)
+                    except RateLimitError:
+                        self.on_rate_limit()
+                        self.breaker.record(True, probe)
+                        spent += time.monotonic() - started
+                        if requeued < self.rate_limit_retries:
+                            requeued += 1
+                            self.rate_limit_requeued += 1
+                            continue
+                        raise
+                    except Exception:
+                        self.completed += 1
+                        self.breaker.record(False, probe)
+                        raise
+                    self.on_success()
+                    self.breaker.record(False, probe)
+                    return result
+            finally:
+                if probe:
+                    self.breaker.release_probe()
+
+    def stats(self) -> dict:
+        return {
+            "rate_per_second": round(self.rate, 3),
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rate_limited": self.rate_limited,
+            "rate_limit_requeued": self.rate_limit_requeued,
+            "paused_seconds_left": round(max(0.0, self._paused_until - time.monotonic()), 1),
+            "breaker": self.breaker.stats(),
+        }
+
+
+async def bounded_map(
+    items: Union[Iterable[T], AsyncIterable[T]], fn: Callable[[T], Awaitable[R]], workers: int = BATCH_WORKERS
+) -> AsyncIterator[R]:
+    """
+    固定 workers 个协程从 items（可以是惰性迭代器，也可以是边到达边产出的异步迭代器）逐个取任务执行，
+    按完成顺序产出结果。结果队列有界，消费方跟不上时 worker 暂停取新任务，内存占用与批次大小无关。
+    fn 或输入源抛出的异常在消费方重新抛出；消费方停止迭代（如客户端断开）时取消全部 worker 并等待其退出，
+    返回后不会再有 worker 在写数据库或占用页面。
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=workers)
+    stop = object()
+
+    if hasattr(items, "__aiter__"):
+        ait = items.__aiter__()
+        pull_lock = asyncio.Lock()
+
+        async def next_item():
+            # 异步迭代器不允许并发 __anext__，多个 worker 排队取
+            async with pull_lock:
+                try:
+                    return await ait.__anext__()
+                except StopAsyncIteration:
+                    return stop
+    else:
+        it = iter(items)
+
+        async def next_item():
+            return next(it, stop)
+
+    async def worker() -> None:
+        while True:
+            try:
+                item = await next_item()
+            except Exception as e:
+                # 输入源出错（如客户端断开、请求体格式错误）：交给消费方抛出，否则其他 worker 退出后消费方会一直等
+                await queue.put((False, e))
+                return
+            if item is stop:
+                break
+            try:
+                result = await fn(item)
+            except Exception as e:
+                await queue.put((False, e))
+                return
+            await queue.put((True, result))
+        await queue.put(stop)
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    try:
+        alive = len(tasks)
+        while alive:
+            msg = await queue.get()
+            if msg is stop:
+                alive -= 1
+                continue
+            ok, value = msg
+            if not ok:
+                raise value
+            yield value
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# 进程内唯一调度器
+crawl_scheduler = CrawlScheduler()
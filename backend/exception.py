@@ -22,3 +22,7 @@ class DataEmptyError(CrawlerError):
 
 class DataFetchError(CrawlerError):
     """抓取或解析失败（网络、超时、数据结构异常等）。"""
+
+
+class ScrapeTimeoutError(CrawlerError):
+    """超出时间预算（单条链接的总截止时间或整批的截止时间），已提前放弃，不再继续重试。"""
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+图片的两级缓存（/api/proxy_image、ZIP 打包、落盘、AI 识别与后台预取共用）：
+
+- 内存：按总字节数限额的 LRU（XHS_IMAGE_MEM_CACHE_BYTES）
+- 磁盘：按内容 sha256 寻址的对象存储（相同内容只存一份），另有「URL -> 对象」索引；
+  对象与索引的总字节数超过 XHS_IMAGE_DISK_CACHE_BYTES 时按最近访问时间淘汰对象及指向它的索引
+- 请求合并：同一 URL 的并发请求只触发一次上游下载，其余等待同一结果
+
+ETag 取内容 sha256，Last-Modified 取首次抓取时间，供浏览器 If-None-Match / If-Modified-Since 协商缓存。
+"""
+import os
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from email.utils import formatdate
+from typing import Awaitable, Callable, Dict, Optional
+
+from parse_cache import DATA_DIR
+
+
+IMAGE_CACHE_DIR = os.path.join(DATA_DIR, "images")
+# 内存缓存总字节上限，默认 64MB
+IMAGE_MEM_CACHE_BYTES = max(0, int(os.getenv("XHS_IMAGE_MEM_CACHE_BYTES", str(64 * 1024 * 1024))))
+# 磁盘缓存总字节上限，默认 1GB
+IMAGE_DISK_CACHE_BYTES = max(0, int(os.getenv("XHS_IMAGE_DISK_CACHE_BYTES", str(1024 * 1024 * 1024))))
+
+
+@dataclass
+class CachedImage:
+    data: bytes
+    mime_type: str
+    sha256: str
+    fetched_at: float
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.sha256}"'
+
+    @property
+    def last_modified(self) -> str:
+        return formatdate(self.fetched_at, usegmt=True)
+
+
+def _url_key(url: str) -> str:
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+
+def _remove(path: str, size: int) -> int:
+    """删除文件，返回释放的字节数（删除失败时为 0）。"""
+    try:
+        os.remove(path)
+    except OSError:
+        return 0
+    return size
+
+
+class ImageCache:
+    def __init__(
+        self,
+        root: str = IMAGE_CACHE_DIR,
+        mem_max_bytes: int = IMAGE_MEM_CACHE_BYTES,
+        disk_max_bytes: int = IMAGE_DISK_CACHE_BYTES,
+    ):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.index_dir = os.path.join(root, "index")
+        self.mem_max_bytes = mem_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+
+        self._mem: "OrderedDict[str, CachedImage]" = OrderedDict()
+        self._mem_bytes = 0
+        self._disk_bytes: Optional[int] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._evict_lock = asyncio.Lock()
+
+        # 统计
+        self.mem_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evicted_bytes = 0
+
+    # ---------- 内存层 ----------
+
+    def _mem_get(self, key: str) -> Optional[CachedImage]:
+        img = self._mem.get(key)
+        if img is not None:
+            self._mem.move_to_end(key)
+        return img
+
+    def _mem_put(self, key: str, img: CachedImage) -> None:
+        size = len(img.data)
+        if size > self.mem_max_bytes:
+            return
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._mem_bytes -= len(old.data)
+        self._mem[key] = img
+        self._mem_bytes += size
+        while self._mem_bytes > self.mem_max_bytes and self._mem:
+            _, evicted = self._mem.popitem(last=False)
+            self._mem_bytes -= len(evicted.data)
+
+    # ---------- 磁盘层（同步函数，经 asyncio.to_thread 调用） ----------
+
+    def _object_path(self, sha: str) -> str:
+        return os.path.join(self.objects_dir, sha[:2], sha)
+
+    def _index_path(self, key: str) -> str:
+        return os.path.join(self.index_dir, key[:2], key + ".json")
+
+    def _disk_get(self, key: str) -> Optional[CachedImage]:
+        try:
+            with open(self._index_path(key), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            obj_path = self._object_path(meta["sha256"])
+            with open(obj_path, "rb") as f:
+                data = f.read()
+            os.utime(obj_path)  # 刷新访问时间，供 LRU 淘汰
+        except (OSError, ValueError, KeyError):
+            return None
+        return CachedImage(data=data, mime_type=meta["mime_type"], sha256=meta["sha256"], fetched_at=meta["fetched_at"])
+
+    def _disk_put(self, key: str, img: CachedImage) -> int:
+        """写入对象（已存在则跳过）与索引，返回磁盘上新增的字节数（对象与索引都计入）。"""
+        added = 0
+        obj_path = self._object_path(img.sha256)
+        if not os.path.exists(obj_path):
+            os.makedirs(os.path.dirname(obj_path), exist_ok=True)
+            tmp = obj_path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(img.data)
+            os.replace(tmp, obj_path)
+            added = len(img.data)
+        index_path = self._index_path(key)
+        try:
+            added -= os.path.getsize(index_path)
+        except OSError:
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        with open(index_path, "w", encoding="utf-8") as f:
+            json.dump({"sha256": img.sha256, "mime_type": img.mime_type, "fetched_at": img.fetched_at}, f)
+        return added + os.path.getsize(index_path)
+
+    def _scan_disk_bytes(self) -> int:
+        """对象与索引文件的总字节数。"""
+        total = 0
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(dirpath, name))
+                except OSError:
+                    pass
+        return total
+
+    def _evict_disk(self, target_bytes: int) -> int:
+        """按对象最近访问时间从旧到新删除，连同指向它的索引一起删除，直到总量（对象与索引）不超过 target_bytes；
+        指向已不存在对象的索引也一并清理。返回删除的字节数。"""
+        objects = []
+        for dirpath, _, files in os.walk(self.objects_dir):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                objects.append((st.st_mtime, st.st_size, name, path))
+        existing = {name for _, _, name, _ in objects}
+        # sha256 -> [(索引路径, 字节数)]
+        indexes: Dict[str, list] = {}
+        orphans = []
+        index_bytes = 0
+        for dirpath, _, files in os.walk(self.index_dir):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    continue
+                index_bytes += size
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        sha = json.load(f)["sha256"]
+                except (OSError, ValueError, KeyError):
+                    sha = None
+                if sha in existing:
+                    indexes.setdefault(sha, []).append((path, size))
+                else:
+                    orphans.append((path, size))
+
+        removed = 0
+        for path, size in orphans:
+            removed += _remove(path, size)
+        total = sum(size for _, size, _, _ in objects) + index_bytes
+        for _, size, sha, path in sorted(objects):
+            if total - removed <= target_bytes:
+                break
+            removed += _remove(path, size)
+            for index_path, index_size in indexes.get(sha, ()):
+                removed += _remove(index_path, index_size)
+        return removed
+
+    async def _store(self, key: str, img: CachedImage, promote: bool = True) -> None:
+        if promote:
+            self._mem_put(key, img)
+        if self.disk_max_bytes <= 0:
+            return
+        try:
+            added = await asyncio.to_thread(self._disk_put, key, img)
+        except OSError as e:
+            print(f"   [图片缓存] 写入磁盘失败: {e}")
+            return
+        async with self._evict_lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = await asyncio.to_thread(self._scan_disk_bytes)
+            else:
+                self._disk_bytes += added
+            if self._disk_bytes > self.disk_max_bytes:
+                # 一次淘汰到上限的 90%，避免每次写入都触发扫描
+                removed = await asyncio.to_thread(self._evict_disk, int(self.disk_max_bytes * 0.9))
+                self._disk_bytes -= removed
+                self.evicted_bytes += removed
+
+    # ---------- 对外接口 ----------
+
+    async def get_or_fetch(
+        self, url: str, fetch: Callable[[], Awaitable[Optional[dict]]], promote: bool = True
+    ) -> Optional[CachedImage]:
+        """
+        先查内存、再查磁盘，都未命中时调用 fetch() 下载（返回 {"mime_type", "data"} 或 None）并写入两级缓存。
+        同一 URL 的并发调用共享一次下载：下载在独立任务中进行，任一调用方被取消（如客户端断开）
+        不影响其他等待者，也不中断下载本身。
+        promote=False 时结果只写磁盘、不进内存（后台预取用，避免挤掉热点图片）。
+        """
+        key = _url_key(url)
+        img = self._mem_get(key)
+        if img is not None:
+            self.mem_hits += 1
+            return img
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(self._load(key, fetch, promote))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._load_done(key, t))
+        return await asyncio.shield(task)
+
+    async def _load(
+        self, key: str, fetch: Callable[[], Awaitable[Optional[dict]]], promote: bool
+    ) -> Optional[CachedImage]:
+        img = await asyncio.to_thread(self._disk_get, key) if self.disk_max_bytes > 0 else None
+        if img is not None:
+            self.disk_hits += 1
+            if promote:
+                self._mem_put(key, img)
+            return img
+        self.misses += 1
+        result = await fetch()
+        if not result:
+            return None
+        data = result["data"]
+        img = CachedImage(
+            data=data,
+            mime_type=result.get("mime_type", "image/jpeg"),
+            sha256=hashlib.sha256(data).hexdigest(),
+            fetched_at=time.time(),
+        )
+        await self._store(key, img, promote=promote)
+        return img
+
+    def _load_done(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 等待者都已被取消时取走异常，避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    def contains_on_disk(self, url: str) -> bool:
+        """磁盘上是否已缓存该 URL：索引存在且其指向的对象未被淘汰。"""
+        try:
+            with open(self._index_path(_url_key(url)), "r", encoding="utf-8") as f:
+                sha = json.load(f)["sha256"]
+        except (OSError, ValueError, KeyError):
+            return False
+        return os.path.exists(self._object_path(sha))
+
+    @property
+    def disk_bytes(self) -> int:
+        return self._disk_bytes or 0
+
+    def stats(self) -> dict:
+        return {
+            "mem_entries": len(self._mem),
+            "mem_bytes": self._mem_bytes,
+            "disk_bytes": self._disk_bytes,
+            "mem_hits": self.mem_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evicted_bytes": self.evicted_bytes,
+        }
+
+
+# 进程内共享实例
+image_cache = ImageCache()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+共享的图片下载客户端：由 FastAPI lifespan 创建与关闭，所有图片下载（代理、ZIP、落盘、AI 识别）复用同一连接池，
+不再每张图新建 httpx.AsyncClient（每次都要重新 TLS 握手）。
+
+- 连接池 + keep-alive，可选 HTTP/2（需安装 h2，未安装时自动退回 HTTP/1.1）
+- 每个域名的并发连接上限（httpx 只有全局上限，这里用每域名信号量补上）
+- 通过 httpcore trace 统计新建连接数，计算连接复用率
+"""
+import os
+import asyncio
+import importlib.util
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import httpx
+
+import metrics
+
+
+IMAGE_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Referer": "https://www.xiaohongshu.com/",
+}
+
+# 是否尝试 HTTP/2
+IMAGE_HTTP2 = os.getenv("XHS_IMAGE_HTTP2", "1").strip().lower() in ("1", "true", "yes")
+# 连接池总连接数与保活连接数
+IMAGE_MAX_CONNECTIONS = max(1, int(os.getenv("XHS_IMAGE_MAX_CONNECTIONS", "32")))
+IMAGE_MAX_KEEPALIVE = max(0, int(os.getenv("XHS_IMAGE_MAX_KEEPALIVE", "16")))
+# 每个域名同时进行的请求上限
+IMAGE_MAX_PER_HOST = max(1, int(os.getenv("XHS_IMAGE_MAX_PER_HOST", "8")))
+# 超时（秒）：建立连接 / 读取
+IMAGE_CONNECT_TIMEOUT = float(os.getenv("XHS_IMAGE_CONNECT_TIMEOUT", "5"))
+IMAGE_READ_TIMEOUT = float(os.getenv("XHS_IMAGE_READ_TIMEOUT", "15"))
+# 空闲连接保活时长（秒）
+IMAGE_KEEPALIVE_EXPIRY = float(os.getenv("XHS_IMAGE_KEEPALIVE_EXPIRY", "30"))
+# 图片下载间隔（秒）：ZIP 打包与后台预取时每张图之前随机延迟，降低 CDN 限流
+IMAGE_DOWNLOAD_DELAY_MIN = float(os.getenv("IMAGE_DOWNLOAD_DELAY_MIN", "0.2"))
+IMAGE_DOWNLOAD_DELAY_MAX = float(os.getenv("IMAGE_DOWNLOAD_DELAY_MAX", "0.5"))
+
+
+class ImageClient:
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_sems: Dict[str, asyncio.Semaphore] = {}
+        self.http2 = False
+
+        # 统计
+        self.requests = 0
+        self.new_connections = 0
+        self.errors = 0
+        self.http_versions: Dict[str, int] = {}
+
+    async def start(self):
+        if self._client is not None:
+            return
+        self.http2 = IMAGE_HTTP2 and importlib.util.find_spec("h2") is not None
+        if IMAGE_HTTP2 and not self.http2:
+            print("ℹ️  提示: 未安装 h2，图片下载使用 HTTP/1.1（pip install h2 可启用 HTTP/2）。")
+        self._client = httpx.AsyncClient(
+            headers=IMAGE_HEADERS,
+            follow_redirects=True,
+            verify=False,
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=IMAGE_MAX_CONNECTIONS,
+                max_keepalive_connections=IMAGE_MAX_KEEPALIVE,
+                keepalive_expiry=IMAGE_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(IMAGE_READ_TIMEOUT, connect=IMAGE_CONNECT_TIMEOUT),
+        )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _trace(self, event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            self.new_connections += 1
+
+    def _host_sem(self, url: str) -> asyncio.Semaphore:
+        host = urlparse(url).hostname or ""
+        sem = self._host_sems.get(host)
+        if sem is None:
+            sem = self._host_sems[host] = asyncio.Semaphore(IMAGE_MAX_PER_HOST)
+        return sem
+
+    async def get(self, url: str, headers: Optional[dict] = None) -> httpx.Response:
+        """GET 图片（读完整响应体）；未经 lifespan 启动时懒启动。"""
+        if self._client is None:
+            await self.start()
+        async with self._host_sem(url):
+            self.requests += 1
+            try:
+                resp = await self._client.get(url, headers=headers, extensions={"trace": self._trace})
+            except Exception:
+                self.errors += 1
+                raise
+        self.http_versions[resp.http_version] = self.http_versions.get(resp.http_version, 0) + 1
+        return resp
+
+    async def fetch(self, url: str) -> Optional[dict]:
+        """下载图片原始字节，成功返回 {"mime_type", "data"}，失败返回 None（不抛异常）。"""
+        try:
+            with metrics.stage_timer("image_download"):
+                resp = await self.get(url)
+        except Exception as e:
+            print(f"   - 图片下载出错: {e}")
+            return None
+        if resp.status_code != 200:
+            print(f"   - 图片下载失败 (状态码 {resp.status_code}): {url[:30]}...")
+            return None
+        return {
+            "mime_type": resp.headers.get("content-type", "image/jpeg").lower(),
+            "data": resp.content,
+        }
+
+    def stats(self) -> dict:
+        reused = max(0, self.requests - self.errors - self.new_connections)
+        return {
+            "http2_enabled": self.http2,
+            "requests": self.requests,
+            "errors": self.errors,
+            "new_connections": self.new_connections,
+            "connection_reuse_rate": round(reused / self.requests, 3) if self.requests else 0.0,
+            "http_versions": dict(self.http_versions),
+        }
+
+
+# 进程内共享实例
+image_client = ImageClient()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+解析成功后的后台图片预取：笔记一解析出来就把图片 URL 放进低优先级队列，由少量后台 worker
+下载到本地图片缓存（image_cache 的磁盘层），之后 ZIP 打包 / 落盘 / 图片代理直接读本地，不再冷启动下载。
+
+- 低优先级：worker 数少（XHS_PREFETCH_CONCURRENCY），每张图之间按 IMAGE_DOWNLOAD_DELAY 随机等待，
+  只写磁盘不进内存，队列满时直接丢弃
+- 上限：每个笔记最多预取 XHS_PREFETCH_MAX_IMAGES_PER_NOTE 张；本地图片缓存超过 XHS_PREFETCH_MAX_BYTES 时停止预取
+"""
+import os
+import asyncio
+import random
+from typing import List, Optional
+
+from image_cache import image_cache
+from image_client import image_client, IMAGE_DOWNLOAD_DELAY_MIN, IMAGE_DOWNLOAD_DELAY_MAX
+
+
+# 是否启用预取
+PREFETCH_ENABLED = os.getenv("XHS_IMAGE_PREFETCH", "1").strip().lower() in ("1", "true", "yes")
+# 后台下载 worker 数
+PREFETCH_CONCURRENCY = max(1, int(os.getenv("XHS_PREFETCH_CONCURRENCY", "2")))
+# 每个笔记最多预取的图片数
+PREFETCH_MAX_IMAGES_PER_NOTE = max(0, int(os.getenv("XHS_PREFETCH_MAX_IMAGES_PER_NOTE", "9")))
+# 本地图片缓存达到该字节数后不再预取，默认 512MB
+PREFETCH_MAX_BYTES = max(0, int(os.getenv("XHS_PREFETCH_MAX_BYTES", str(512 * 1024 * 1024))))
+# 待预取队列长度上限
+PREFETCH_QUEUE_SIZE = max(1, int(os.getenv("XHS_PREFETCH_QUEUE_SIZE", "500")))
+
+
+class ImagePrefetcher:
+    def __init__(
+        self,
+        concurrency: int = PREFETCH_CONCURRENCY,
+        max_images_per_note: int = PREFETCH_MAX_IMAGES_PER_NOTE,
+        max_bytes: int = PREFETCH_MAX_BYTES,
+        enabled: bool = PREFETCH_ENABLED,
+    ):
+        self.concurrency = concurrency
+        self.max_images_per_note = max_images_per_note
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=PREFETCH_QUEUE_SIZE)
+        self._workers: List[asyncio.Task] = []
+
+        # 统计
+        self.enqueued = 0
+        self.dropped = 0
+        self.fetched = 0
+        self.already_cached = 0
+        self.failed = 0
+        self.bytes_fetched = 0
+
+    def start(self):
+        if not self.enabled or self._workers:
+            return
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def close(self):
+        for task in self._workers:
+            task.cancel()
+        for task in self._workers:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._workers = []
+
+    def _over_budget(self) -> bool:
+        return image_cache.disk_bytes >= self.max_bytes
+
+    def enqueue_note(self, images: Optional[List[str]]) -> int:
+        """把一个笔记的图片放入预取队列（不等待），返回实际入队数。"""
+        if not self.enabled or not self._workers or not images or self._over_budget():
+            return 0
+        count = 0
+        for url in images[: self.max_images_per_note]:
+            try:
+                self._queue.put_nowait(url)
+            except asyncio.QueueFull:
+                self.dropped += 1
+                continue
+            count += 1
+        self.enqueued += count
+        return count
+
+    async def _worker(self):
+        while True:
+            url = await self._queue.get()
+            try:
+                if self._over_budget():
+                    self.dropped += 1
+                    continue
+                if image_cache.contains_on_disk(url):
+                    self.already_cached += 1
+                    continue
+                await asyncio.sleep(random.uniform(IMAGE_DOWNLOAD_DELAY_MIN, IMAGE_DOWNLOAD_DELAY_MAX))
+                img = await image_cache.get_or_fetch(url, lambda: image_client.fetch(url), promote=False)
+                if img is None:
+                    self.failed += 1
+                else:
+                    self.fetched += 1
+                    self.bytes_fetched += len(img.data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                print(f"   [预取] 图片下载失败: {e}")
+            finally:
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "queued": self._queue.qsize(),
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "fetched": self.fetched,
+            "already_cached": self.already_cached,
+            "failed": self.failed,
+            "bytes_fetched": self.bytes_fetched,
+        }
+
+
+# 进程内共享实例
+image_prefetcher = ImagePrefetcher()
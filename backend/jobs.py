@@ -0,0 +1,486 @@
+# -*- coding: utf-8 -*-
+"""
+持久化、可恢复的批量解析任务（SQLite）：任务状态、每个链接的状态与结果、进度事件都落盘，
+客户端断开、刷新页面或后端重启都不会丢掉进行到一半的批次。
+
+- 每个链接的状态：pending -> running -> done / failed，取消后未完成的链接记为 cancelled
+- 任务运行出错（如数据库异常）时未完成的链接记为 failed，任务以 failed 结束，订阅方收到结束事件
+- 事件按 seq 递增追加保存，客户端可从任意 offset 重新订阅（断线重连不重复抓取）
+- 后端启动时自动恢复未完成的任务：上次中断时 running 的链接重置为 pending 后继续
+- 支持取消任务、只重试失败的链接
+
+实际解析由 main 通过 configure() 注入（避免循环导入），同一笔记的多个链接经 url_canon.NoteDeduper 只抓取一次。
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+from contextlib import aclosing
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from parse_cache import DATA_DIR
+from url_canon import NoteDeduper
+from crawl_scheduler import bounded_map
+
+
+# 任务完成后保留多久（秒），启动时清理更早的任务，默认 7 天
+JOB_RETENTION = float(os.getenv("XHS_JOB_RETENTION", str(7 * 24 * 3600)))
+# 订阅事件时无新事件多久发一次心跳（秒）
+JOB_EVENT_HEARTBEAT = float(os.getenv("XHS_JOB_EVENT_HEARTBEAT", "15"))
+
+# 任务状态
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_CANCELLED = "cancelled"
+JOB_FAILED = "failed"
+_FINISHED = (JOB_DONE, JOB_CANCELLED, JOB_FAILED)
+
+# 解析函数：(批内去重器, 链接, 任务选项) -> (笔记 dict, 失败 dict)
+UrlRunner = Callable[[NoteDeduper, str, Dict], Awaitable[Tuple[Optional[Dict], Optional[Dict]]]]
+
+
+class JobStore:
+    """任务、链接状态与事件的 SQLite 存储（同步调用，JobManager 在事件循环中经 asyncio.to_thread 调用）。"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(DATA_DIR, "jobs.db")
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    options TEXT NOT NULL,
+                    total INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS job_urls (
+                    job_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    url TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    note TEXT,
+                    error TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (job_id, idx)
+                );
+                CREATE TABLE IF NOT EXISTS job_events (
+                    job_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (job_id, seq)
+                );"""
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def create(self, urls: List[str], options: Dict) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT INTO jobs (job_id, status, options, total, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, JOB_PENDING, json.dumps(options), len(urls), now, now),
+            )
+            db.executemany(
+                "INSERT INTO job_urls (job_id, idx, url, state, updated_at) VALUES (?, ?, ?, 'pending', ?)",
+                [(job_id, i, url, now) for i, url in enumerate(urls)],
+            )
+            db.commit()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._db().execute(
+                "SELECT status, options, total, created_at, updated_at FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        status, options, total, created_at, updated_at = row
+        return {
+            "job_id": job_id,
+            "status": status,
+            "options": json.loads(options),
+            "total": total,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    def set_status(self, job_id: str, status: str) -> None:
+        with self._lock:
+            db = self._db()
+            db.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ?", (status, time.time(), job_id))
+            db.commit()
+
+    def unfinished_jobs(self) -> List[str]:
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT job_id FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (JOB_PENDING, JOB_RUNNING)
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def counts(self, job_id: str) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT state, COUNT(*) FROM job_urls WHERE job_id = ? GROUP BY state", (job_id,)
+            ).fetchall()
+        counts = {"pending": 0, "running": 0, "done": 0, "failed": 0, "cancelled": 0}
+        counts.update(dict(rows))
+        return counts
+
+    def urls_in_state(self, job_id: str, *states: str) -> List[Tuple[int, str]]:
+        marks = ",".join("?" * len(states))
+        with self._lock:
+            rows = self._db().execute(
+                f"SELECT idx, url FROM job_urls WHERE job_id = ? AND state IN ({marks}) ORDER BY idx",
+                (job_id, *states),
+            ).fetchall()
+        return [(idx, url) for idx, url in rows]
+
+    def set_url_states(self, job_id: str, from_states: Tuple[str, ...], to_state: str) -> int:
+        marks = ",".join("?" * len(from_states))
+        with self._lock:
+            db = self._db()
+            cur = db.execute(
+                f"UPDATE job_urls SET state = ?, error = NULL, updated_at = ? WHERE job_id = ? AND state IN ({marks})",
+                (to_state, time.time(), job_id, *from_states),
+            )
+            db.commit()
+        return cur.rowcount
+
+    def fail_unfinished(self, job_id: str, error: str) -> int:
+        """把 pending / running 的链接记为失败（任务运行出错时），返回涉及的链接数。"""
+        with self._lock:
+            db = self._db()
+            cur = db.execute(
+                "UPDATE job_urls SET state = 'failed', error = ?, updated_at = ? "
+                "WHERE job_id = ? AND state IN ('pending', 'running')",
+                (error, time.time(), job_id),
+            )
+            db.commit()
+        return cur.rowcount
+
+    def mark_running(self, job_id: str, indices: List[int]) -> None:
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.executemany(
+                "UPDATE job_urls SET state = 'running', updated_at = ? WHERE job_id = ? AND idx = ?",
+                [(now, job_id, i) for i in indices],
+            )
+            db.commit()
+
+    def record_result(self, job_id: str, idx: int, note: Optional[Dict], fail: Optional[Dict]) -> None:
+        state = "done" if note else "failed"
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "UPDATE job_urls SET state = ?, note = ?, error = ?, updated_at = ? WHERE job_id = ? AND idx = ?",
+                (
+                    state,
+                    json.dumps(note, ensure_ascii=False) if note else None,
+                    fail["error"] if fail else None,
+                    time.time(),
+                    job_id,
+                    idx,
+                ),
+            )
+            db.commit()
+
+    def results(self, job_id: str) -> Tuple[List[Dict], List[Dict[str, str]]]:
+        """按链接顺序返回 (成功的笔记列表, 失败列表)。"""
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT url, state, note, error FROM job_urls WHERE job_id = ? AND state IN ('done', 'failed') ORDER BY idx",
+                (job_id,),
+            ).fetchall()
+        notes, failed = [], []
+        for url, state, note, error in rows:
+            if state == "done":
+                notes.append(json.loads(note))
+            else:
+                failed.append({"url": url, "error": error or ""})
+        return notes, failed
+
+    def iter_results(self, job_id: str, batch_size: int = 500) -> Iterator[Tuple[str, Optional[Dict], Optional[str]]]:
+        """按链接顺序分批读取已完成的链接 (url, 笔记, 错误)，供流式导出使用。"""
+        last = -1
+        while True:
+            with self._lock:
+                rows = self._db().execute(
+                    "SELECT idx, url, state, note, error FROM job_urls "
+                    "WHERE job_id = ? AND idx > ? AND state IN ('done', 'failed') ORDER BY idx LIMIT ?",
+                    (job_id, last, batch_size),
+                ).fetchall()
+            for idx, url, state, note, error in rows:
+                yield url, (json.loads(note) if state == "done" else None), error
+            if len(rows) < batch_size:
+                return
+            last = rows[-1][0]
+
+    def append_event(self, job_id: str, event: Dict) -> int:
+        with self._lock:
+            db = self._db()
+            (last,) = db.execute("SELECT COALESCE(MAX(seq), -1) FROM job_events WHERE job_id = ?", (job_id,)).fetchone()
+            seq = last + 1
+            db.execute(
+                "INSERT INTO job_events (job_id, seq, data) VALUES (?, ?, ?)",
+                (job_id, seq, json.dumps({**event, "seq": seq}, ensure_ascii=False)),
+            )
+            db.commit()
+        return seq
+
+    def events(self, job_id: str, offset: int, limit: int = 200) -> List[Dict]:
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT data FROM job_events WHERE job_id = ? AND seq >= ? ORDER BY seq LIMIT ?",
+                (job_id, offset, limit),
+            ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def purge_before(self, cutoff: float) -> int:
+        """删除 cutoff 之前结束的任务及其链接与事件。"""
+        with self._lock:
+            db = self._db()
+            ids = [
+                r[0]
+                for r in db.execute(
+                    "SELECT job_id FROM jobs WHERE status IN (?, ?, ?) AND updated_at < ?", (*_FINISHED, cutoff)
+                ).fetchall()
+            ]
+            for table in ("job_events", "job_urls", "jobs"):
+                db.executemany(f"DELETE FROM {table} WHERE job_id = ?", [(i,) for i in ids])
+            db.commit()
+        return len(ids)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class JobManager:
+    def __init__(self, store: Optional[JobStore] = None):
+        self.store = store or JobStore()
+        self._runner: Optional[UrlRunner] = None
+        self._progress_extra: Callable[[], Dict] = dict
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._conditions: Dict[str, asyncio.Condition] = {}
+        self._cancelling: set = set()
+
+        # 统计
+        self.resumed = 0
+
+    def configure(self, runner: UrlRunner, progress_extra: Optional[Callable[[], Dict]] = None) -> None:
+        """注入解析函数，以及附加到每条 progress 事件的运行状态（如调度器统计）。"""
+        self._runner = runner
+        if progress_extra is not None:
+            self._progress_extra = progress_extra
+
+    def start(self) -> None:
+        """清理过期任务，恢复上次未完成的任务。"""
+        purged = self.store.purge_before(time.time() - JOB_RETENTION)
+        if purged:
+            print(f"🧹 [任务] 清理过期任务 {purged} 个")
+        for job_id in self.store.unfinished_jobs():
+            reset = self.store.set_url_states(job_id, ("running",), "pending")
+            print(f"♻️  [任务] 恢复未完成任务 {job_id}（重置中断的链接 {reset} 个）")
+            self.resumed += 1
+            self._launch(job_id)
+
+    async def close(self) -> None:
+        """停止运行中的任务（不改变其状态，下次启动时恢复）。"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks.clear()
+        self.store.close()
+
+    def _condition(self, job_id: str) -> asyncio.Condition:
+        cond = self._conditions.get(job_id)
+        if cond is None:
+            cond = self._conditions[job_id] = asyncio.Condition()
+        return cond
+
+    async def _emit(self, job_id: str, event: Dict) -> None:
+        await asyncio.to_thread(self.store.append_event, job_id, event)
+        cond = self._condition(job_id)
+        async with cond:
+            cond.notify_all()
+
+    def _launch(self, job_id: str) -> None:
+        task = self._tasks.get(job_id)
+        if task is not None and not task.done():
+            return
+        self._tasks[job_id] = asyncio.create_task(self._run(job_id))
+
+    async def _run(self, job_id: str) -> None:
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is None or self._runner is None:
+            return
+        options = job["options"]
+        if options.get("deadline_seconds"):
+            # 整批时间预算从本次开始运行（含重启后继续）时计起
+            options = {**options, "deadline": time.monotonic() + options["deadline_seconds"]}
+        total = job["total"]
+        deduper = NoteDeduper()
+
+        async def run_url(item: Tuple[str, List[int]]):
+            url, indices = item
+            await asyncio.to_thread(self.store.mark_running, job_id, indices)
+            return indices, await self._runner(deduper, url, options)
+
+        try:
+            pending = await asyncio.to_thread(self.store.urls_in_state, job_id, "pending")
+            await asyncio.to_thread(self.store.set_status, job_id, JOB_RUNNING)
+            counts = await asyncio.to_thread(self.store.counts, job_id)
+            finished = counts["done"] + counts["failed"]
+
+            # 完全相同的链接合并；worker 取到链接时才规范化，同一笔记只抓取一次，并发与速率由全局调度器控制
+            indices_of: Dict[str, List[int]] = {}
+            for idx, url in pending:
+                indices_of.setdefault(url, []).append(idx)
+
+            # aclosing：本协程在 _emit 等处被取消时，确定地取消并等待全部 worker 退出
+            async with aclosing(bounded_map(indices_of.items(), run_url)) as results:
+                async for indices, (note, fail) in results:
+                    for idx in indices:
+                        await asyncio.to_thread(self.store.record_result, job_id, idx, note, fail)
+                        finished += 1
+                        await self._emit(job_id, {
+                            "type": "progress",
+                            "current": finished,
+                            "total": total,
+                            "note": note,
+                            "failed": fail,
+                            **self._progress_extra(),
+                        })
+        except asyncio.CancelledError:
+            if job_id in self._cancelling:
+                await self._finish(job_id, JOB_CANCELLED)
+            raise
+        except Exception as e:
+            print(f"❌ [任务] {job_id} 运行出错: {e!r}")
+            error = f"任务运行出错：{e}"
+            try:
+                await asyncio.to_thread(self.store.fail_unfinished, job_id, error)
+            except Exception as store_err:
+                print(f"❌ [任务] {job_id} 记录失败链接出错: {store_err!r}")
+            await self._finish(job_id, JOB_FAILED, error=error)
+            return
+        await self._finish(job_id, JOB_DONE)
+
+    async def _finish(self, job_id: str, status: str, error: Optional[str] = None) -> None:
+        self._cancelling.discard(job_id)
+        if status == JOB_CANCELLED:
+            await asyncio.to_thread(self.store.set_url_states, job_id, ("pending", "running"), "cancelled")
+        await asyncio.to_thread(self.store.set_status, job_id, status)
+        counts = await asyncio.to_thread(self.store.counts, job_id)
+        print(f"✅ [任务] {job_id} {status}: 成功 {counts['done']} 个，失败 {counts['failed']} 个")
+        # 结束事件只带汇总数与结果接口地址，不重复下发全部笔记
+        event = {"type": status, **counts, "results": f"/api/jobs/{job_id}/results"}
+        if error:
+            event["error"] = error
+        await self._emit(job_id, event)
+
+    async def create(self, urls: List[str], options: Dict) -> str:
+        job_id = await asyncio.to_thread(self.store.create, urls, options)
+        self._launch(job_id)
+        return job_id
+
+    async def status(self, job_id: str) -> Optional[Dict]:
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is None:
+            return None
+        counts = await asyncio.to_thread(self.store.counts, job_id)
+        return {**job, "counts": counts, "finished": counts["done"] + counts["failed"]}
+
+    async def results(self, job_id: str) -> Tuple[List[Dict], List[Dict]]:
+        """已完成部分的解析结果（按链接顺序），读取与 JSON 解码在线程中进行。"""
+        return await asyncio.to_thread(self.store.results, job_id)
+
+    async def cancel(self, job_id: str) -> bool:
+        """取消任务：停止在途抓取，未完成的链接记为 cancelled。已结束的任务返回 False。"""
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is None or job["status"] in _FINISHED:
+            return False
+        task = self._tasks.get(job_id)
+        if task is not None and not task.done():
+            self._cancelling.add(job_id)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        else:
+            await self._finish(job_id, JOB_CANCELLED)
+        return True
+
+    async def retry_failed(self, job_id: str) -> int:
+        """把失败（及已取消）的链接重新置为 pending 并继续运行，返回重试的链接数。"""
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is None:
+            return 0
+        task = self._tasks.get(job_id)
+        if task is not None and not task.done():
+            # 运行中的任务等本轮结束后再重试，避免与在途结果交错
+            return 0
+        count = await asyncio.to_thread(self.store.set_url_states, job_id, ("failed", "cancelled"), "pending")
+        if count:
+            await asyncio.to_thread(self.store.set_status, job_id, JOB_PENDING)
+            self._launch(job_id)
+        return count
+
+    async def events(self, job_id: str, offset: int = 0) -> AsyncIterator[Optional[Dict]]:
+        """
+        从 offset 开始逐条产出事件；任务结束且事件读完后停止。
+        长时间无新事件时产出 None，调用方可据此发送心跳。
+        """
+        cond = self._condition(job_id)
+        while True:
+            # 在条件锁内读取，保证读取之后追加的事件一定能唤醒等待
+            async with cond:
+                batch = await asyncio.to_thread(self.store.events, job_id, offset)
+                if not batch:
+                    job = await asyncio.to_thread(self.store.get, job_id)
+                    if job is None or job["status"] in _FINISHED:
+                        return
+                    try:
+                        await asyncio.wait_for(cond.wait(), timeout=JOB_EVENT_HEARTBEAT)
+                    except asyncio.TimeoutError:
+                        batch = None
+            if batch is None:
+                yield None
+                continue
+            for event in batch:
+                offset = event["seq"] + 1
+                yield event
+
+    def stats(self) -> dict:
+        return {
+            "running": sum(1 for t in self._tasks.values() if not t.done()),
+            "resumed": self.resumed,
+        }
+
+
+# 进程内共享实例
+job_manager = JobManager()
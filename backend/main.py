@@ -6,17 +6,31 @@ import httpx
 import uvicorn
 import hashlib
 import asyncio
-import zipfile
+import time
 import io
+from contextlib import asynccontextmanager
 from urllib.parse import quote
-from fastapi import FastAPI, HTTPException, Response
+from email.utils import parsedate_to_datetime
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import AsyncIterator, List, Dict, Literal, Optional
 from dotenv import load_dotenv
-from scraper import XHSScraper
-from exception import RateLimitError, DataEmptyError, DataFetchError
+from scraper import XHSScraper, SCRAPE_DEADLINE_SECONDS, FETCH_MODE_STATS, STAGE_TIMING_STATS, state_transfer_stats, http_client, close_http_client
+from browser_pool import BrowserPool
+from resource_filter import resource_filter
+from crawl_scheduler import crawl_scheduler, bounded_map
+from parse_cache import parse_cache
+from url_canon import NoteDeduper, canonical_key, link_cache, CANON_STATS
+from image_client import image_client, IMAGE_DOWNLOAD_DELAY_MIN, IMAGE_DOWNLOAD_DELAY_MAX
+from image_cache import image_cache
+from zip_stream import StreamingZipWriter, ordered_prefetch
+from transcode import transcoder
+from image_prefetch import image_prefetcher
+from jobs import job_manager
+import metrics
+from exception import RateLimitError, DataEmptyError, DataFetchError, ScrapeTimeoutError
 
 # 加载环境变量
 load_dotenv()
@@ -39,21 +53,46 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DOWNLOAD_ROOT = os.path.join(BASE_DIR, "downloads")
 os.makedirs(DOWNLOAD_ROOT, exist_ok=True)
 
-# 批量解析并发数（环境变量 BATCH_PARSE_CONCURRENCY，默认 5，限流严时可调小）
-BATCH_PARSE_CONCURRENCY = max(1, min(10, int(os.getenv("BATCH_PARSE_CONCURRENCY", "5"))))
+# 抓取并发与速率由全局调度器 crawl_scheduler 控制（BATCH_PARSE_CONCURRENCY / CRAWL_RATE_* 环境变量）
 
-# 抓取间隔（秒）：每条笔记解析完成后等待再处理下一条，减轻限流
-CRAWL_INTERVAL_MIN = float(os.getenv("CRAWL_INTERVAL_MIN", "2"))
-CRAWL_INTERVAL_MAX = float(os.getenv("CRAWL_INTERVAL_MAX", "5"))
-
-# 图片下载间隔（秒）：ZIP 打包时每张图之间随机延迟，降低 CDN 限流
-IMAGE_DOWNLOAD_DELAY_MIN = float(os.getenv("IMAGE_DOWNLOAD_DELAY_MIN", "0.2"))
-IMAGE_DOWNLOAD_DELAY_MAX = float(os.getenv("IMAGE_DOWNLOAD_DELAY_MAX", "0.5"))
+# 图片下载间隔（IMAGE_DOWNLOAD_DELAY_MIN/MAX）见 image_client
 
 if not GOOGLE_API_KEY:
     print("ℹ️  提示: 未检测到 GEMINI_API_KEY，AI 生成功能将不可用（爬取功能不受影响）。")
 
-app = FastAPI()
+# 应用级共享浏览器池（lifespan 中创建，所有抓取接口从池中租用页面）
+browser_pool: BrowserPool | None = None
+
+# /metrics 中的调度器与浏览器池仪表盘指标在采集时读取
+metrics.bind_scheduler(crawl_scheduler)
+metrics.bind_browser_pool(lambda: browser_pool)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global browser_pool
+    browser_pool = BrowserPool()
+    await browser_pool.start()
+    await image_client.start()
+    http_client()
+    transcoder.start()
+    image_prefetcher.start()
+    job_manager.start()
+    try:
+        yield
+    finally:
+        await job_manager.close()
+        await image_prefetcher.close()
+        transcoder.close()
+        await image_client.close()
+        await close_http_client()
+        await browser_pool.close()
+        browser_pool = None
+        parse_cache.close()
+        link_cache.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # 添加CORS支持
 app.add_middleware(
@@ -64,6 +103,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 图片输出格式：png（默认，公众号兼容性更好）/ jpeg（高质量 JPEG，体积更小）/ passthrough（保持原格式）
+ImageFormat = Literal["png", "jpeg", "passthrough"]
+
+
 class GenerateRequest(BaseModel):
     url: str
 
@@ -95,6 +138,9 @@ class DownloadResponse(BaseModel):
 class BatchParseRequest(BaseModel):
     """批量解析请求"""
     urls: List[str]
+    force_refresh: bool = False  # 为 True 时忽略解析缓存，重新抓取
+    prefetch_images: bool = True  # 解析成功后是否在后台预取图片到本地（需 XHS_IMAGE_PREFETCH 开启）
+    deadline_seconds: float | None = None  # 整批的时间预算（秒），到时未完成的链接记为超时失败；不传表示不限
 
 
 class ParsedNote(BaseModel):
@@ -106,6 +152,13 @@ class ParsedNote(BaseModel):
     tags: List[str]
     images: List[str]
     coverImage: str | None = None  # 封面图（第一张）
+    fetchMode: str | None = None  # 抓取路径：cache（解析缓存）/ http（纯 HTTP 快速路径）/ browser（浏览器）
+
+
+class JobCreateResponse(BaseModel):
+    """创建批量解析任务的响应"""
+    job_id: str
+    total: int
 
 
 class BatchParseResponse(BaseModel):
@@ -120,6 +173,7 @@ class SelectiveDownloadRequest(BaseModel):
     note_data: Dict  # 笔记数据（包含 title, content, tags, images 等）
     selected_image_indices: List[int] | None = None  # 选中的图片索引（None表示全部）
     base_dir: str | None = None
+    image_format: ImageFormat = "png"  # webp 图片的输出格式
 
 
 class SelectiveDownloadResponse(BaseModel):
@@ -156,54 +210,56 @@ class ZipDownloadRequest(BaseModel):
     note_data: Dict  # 笔记数据（包含 title, content, tags, images 等）
     selected_image_indices: List[int] | None = None  # 选中的图片索引（None表示全部）
     include_text: bool = True  # 是否在ZIP中包含文本文件
+    image_format: ImageFormat = "png"  # webp 图片的输出格式
 
 
-async def download_image_as_bytes(url: str, convert_to_png: bool = True):
+class ZipBatchItem(BaseModel):
+    """批量ZIP中的单个笔记"""
+    note_data: Dict  # 笔记数据（包含 title, content, tags, images 等）
+    selected_image_indices: List[int] | None = None  # 选中的图片索引（None表示全部）
+
+
+class ZipBatchDownloadRequest(BaseModel):
+    """批量ZIP下载请求：多个笔记打包为一个ZIP，每个笔记一个子文件夹"""
+    notes: List[ZipBatchItem]
+    include_text: bool = True  # 是否为每个笔记写入文本文件
+    zip_name: str | None = None  # ZIP 文件名（不含扩展名），默认 xhs_notes_<数量>
+    image_format: ImageFormat = "png"  # webp 图片的输出格式
+
+
+async def download_image_as_bytes(url: str, image_format: str = "png"):
     """
-    下载图片并可选转换为PNG格式（公众号兼容性更好）
+    下载图片并可选将 webp 转换为 PNG / JPEG（公众号兼容性更好）
+    原图经共享图片缓存获取（已预取或下载过的直接读本地），未命中时通过共享 image_client 下载；
+    转码在进程池中执行，不阻塞事件循环
     """
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-        "Referer": "https://www.xiaohongshu.com/"
-    }
-    
-    async with httpx.AsyncClient(headers=headers, follow_redirects=True, verify=False) as client:
-        try:
-            resp = await client.get(url, timeout=15.0)
-            if resp.status_code == 200:
-                img_data = resp.content
-                mime_type = resp.headers.get("content-type", "image/jpeg").lower()
-                
-                # 如果是webp且需要转换为PNG，则转换
-                if convert_to_png and "webp" in mime_type:
-                    try:
-                        img = Image.open(io.BytesIO(img_data))
-                        # 如果是RGBA模式，保持透明度；否则转换为RGB
-                        if img.mode == 'RGBA':
-                            img = img.convert('RGBA')
-                        else:
-                            img = img.convert('RGB')
-                        
-                        # 转换为PNG格式
-                        png_buffer = io.BytesIO()
-                        img.save(png_buffer, format='PNG', quality=95, optimize=True)
-                        img_data = png_buffer.getvalue()
-                        mime_type = "image/png"
-                        print(f"   - 图片转换成功 (webp -> png): {url[:30]}...")
-                    except Exception as e:
-                        print(f"   - 图片转换失败，使用原格式: {e}")
-                
-                print(f"   - 图片下载成功: {url[:30]}...")
-                return {
-                    "mime_type": mime_type,
-                    "data": img_data
-                }
-            else:
-                print(f"   - 图片下载失败 (状态码 {resp.status_code}): {url[:30]}...")
-        except Exception as e:
-            print(f"   - 图片下载出错: {e}")
+    try:
+        img = await image_cache.get_or_fetch(url, lambda: image_client.fetch(url))
+        if not img:
+            return None
+        img_data, mime_type = img.data, img.mime_type
+
+        # 如果是webp且需要转换，则在进程池中转换（转换失败时使用原格式）
+        if image_format != "passthrough" and "webp" in mime_type:
+            img_data, mime_type = await transcoder.transcode(img_data, mime_type, image_format)
+            if "webp" not in mime_type:
+                print(f"   - 图片转换成功 (webp -> {image_format}): {url[:30]}...")
+
+        print(f"   - 图片下载成功: {url[:30]}...")
+        return {
+            "mime_type": mime_type,
+            "data": img_data
+        }
+    except Exception as e:
+        print(f"   - 图片下载出错: {e}")
     return None
 
+async def _image_download_delay(url: str) -> None:
+    """下载图片前随机等待，减轻 CDN 限流；图片已在本地缓存（如已预取）时不等待"""
+    if not image_cache.contains_on_disk(url):
+        await asyncio.sleep(random.uniform(IMAGE_DOWNLOAD_DELAY_MIN, IMAGE_DOWNLOAD_DELAY_MAX))
+
+
 async def call_gemini_via_proxy(prompt: str, image_parts: list):
     """
     通过 Cloudflare的Worker 调用 Gemini
@@ -232,7 +288,8 @@ async def call_gemini_via_proxy(prompt: str, image_parts: list):
     # verify=False 是为了防止某些 SSL 握手报错，加上更稳
     async with httpx.AsyncClient(timeout=60.0, verify=False) as client:
         try:
-            resp = await client.post(api_url, json=payload)
+            with metrics.stage_timer("gemini"):
+                resp = await client.post(api_url, json=payload)
             
             if resp.status_code != 200:
                 print(f"❌ 请求失败: {resp.status_code} - {resp.text}")
@@ -279,7 +336,9 @@ def _is_note_empty(data: Dict) -> bool:
     return not title and not content and not images
 
 
-async def _save_note_to_disk(data: Dict, selected_indices: List[int] | None = None) -> Dict:
+async def _save_note_to_disk(
+    data: Dict, selected_indices: List[int] | None = None, image_format: str = "png"
+) -> Dict:
     """
     根据爬虫返回的数据，将图片和文字保存到本地
     目录结构示例:
@@ -325,10 +384,8 @@ async def _save_note_to_disk(data: Dict, selected_indices: List[int] | None = No
         images_to_download = [images[i] for i in selected_indices if 0 <= i < len(images)]
     
     for idx, img_url in enumerate(images_to_download, start=1):
-        await asyncio.sleep(
-            random.uniform(IMAGE_DOWNLOAD_DELAY_MIN, IMAGE_DOWNLOAD_DELAY_MAX)
-        )
-        img_data = await download_image_as_bytes(img_url)
+        await _image_download_delay(img_url)
+        img_data = await download_image_as_bytes(img_url, image_format=image_format)
         if not img_data:
             continue
         mime = img_data.get("mime_type", "image/jpeg").lower()
@@ -356,17 +413,136 @@ async def _save_note_to_disk(data: Dict, selected_indices: List[int] | None = No
         "image_files": image_files,
     }
 
+def _batch_deadline(seconds: float | None) -> float | None:
+    """整批的截止时刻（time.monotonic()），seconds 为空或 <= 0 时不限。"""
+    return time.monotonic() + seconds if seconds and seconds > 0 else None
+
+
+async def _scrape(
+    url: str, force_refresh: bool = False, cache_key: str | None = None, deadline: float | None = None
+) -> Dict:
+    """
+    抓取单条笔记：先查解析缓存（force_refresh 时跳过），未命中再经全局调度器抓取
+    （共享浏览器池 + 统一并发/速率控制），成功后写入缓存。
+    cache_key 为规范化后的笔记键（见 url_canon），不传时现场计算。
+    deadline 为整批的截止时刻（time.monotonic()），排队等熔断 / 调度器期间也在计时，到时抛出 ScrapeTimeoutError；
+    单条链接自身的 SCRAPE_DEADLINE_SECONDS 预算由调度器在拿到名额后才开始计时，熔断冷却不会耗尽它。
+    """
+    key = cache_key or await canonical_key(url)
+    if not force_refresh:
+        cached = await asyncio.to_thread(parse_cache.get, key)
+        if cached:
+            cached["origin_url"] = url
+            cached["fetch_mode"] = "cache"
+            return cached
+
+    if deadline is not None and deadline <= time.monotonic():
+        raise ScrapeTimeoutError("抓取超时：截止时间已到，未开始抓取该链接，可稍后重试。")
+    scraper = XHSScraper(pool=browser_pool)
+    try:
+        async with asyncio.timeout_at(deadline):
+            data = await crawl_scheduler.run(
+                scraper.scrape_note, url, deadline=deadline, budget=SCRAPE_DEADLINE_SECONDS or None
+            )
+    except TimeoutError as e:
+        raise ScrapeTimeoutError("抓取超时：排队或抓取超出时间预算，已放弃该链接，可稍后重试。") from e
+    finally:
+        await scraper.close()
+    if data and not _is_note_empty(data):
+        await asyncio.to_thread(parse_cache.put, key, data)
+    return data
+
+
+def _build_parsed_note(url: str, data: Dict) -> ParsedNote:
+    """将爬虫返回的数据转换为返回给前端的 ParsedNote"""
+    return ParsedNote(
+        id=_generate_note_id(url),
+        url=url,
+        title=data.get("title", ""),
+        content=data.get("content", ""),
+        tags=data.get("tags", []),
+        images=data.get("images", []),
+        coverImage=data["images"][0] if data.get("images") else None,
+        fetchMode=data.get("fetch_mode"),
+    )
+
+
+async def _parse_one(
+    url: str, force_refresh: bool = False, cache_key: str | None = None, deadline: float | None = None
+) -> tuple[ParsedNote | None, Dict[str, str] | None]:
+    """
+    解析单条链接，返回 (笔记, None) 或 (None, {"url", "error"})，不抛出异常。
+    批量解析与流式批量解析共用。
+    """
+    try:
+        data = await _scrape(url, force_refresh=force_refresh, cache_key=cache_key, deadline=deadline)
+        if not data:
+            err_msg = "抓取失败（未返回数据）"
+        elif _is_note_empty(data):
+            err_msg = "笔记内容为空：未解析到标题、正文或图片"
+        else:
+            print(f"✅ [批量解析] 成功({data.get('fetch_mode')}): {data.get('title', '')[:30]}")
+            metrics.FETCH_MODE.labels(data.get("fetch_mode") or "unknown").inc()
+            return _build_parsed_note(url, data), None
+    except (RateLimitError, DataEmptyError, DataFetchError, ScrapeTimeoutError) as e:
+        metrics.record_error(e)
+        err_msg = e.message if getattr(e, "message", None) else str(e)
+    except Exception as e:
+        metrics.record_error(e)
+        err_msg = str(e)
+    print(f"❌ [批量解析] 失败 url={url} error={err_msg}")
+    return None, {"url": url, "error": err_msg}
+
+
+async def _parse_url(
+    deduper: NoteDeduper,
+    url: str,
+    force_refresh: bool = False,
+    prefetch_images: bool = True,
+    deadline: float | None = None,
+) -> tuple[ParsedNote | None, Dict[str, str] | None]:
+    """
+    批内解析一条链接：worker 取到链接时才规范化（短链此时才解析），同一笔记在途时只抓取一次、之后的重复链接读解析缓存
+    （见 url_canon.NoteDeduper），结果改写为本链接自己的 (笔记, 失败)。新抓取成功后可把图片放入后台预取队列，后续下载直接读本地。
+    deadline 为整批的截止时刻；单链接的时间预算在调度器放行抓取时才起算（见 _scrape）。
+    """
+    async def parse(key: str, first_url: str):
+        # 本批内已解析过的笔记不再强制刷新，直接读刚写入的解析缓存
+        refresh = force_refresh and not deduper.completed(key)
+        note, fail = await _parse_one(first_url, force_refresh=refresh, cache_key=key, deadline=deadline)
+        # 命中解析缓存的笔记首次解析时已预取过图片，不再重复入队
+        if note and prefetch_images and note.fetchMode != "cache":
+            image_prefetcher.enqueue_note(note.images)
+        return note, fail
+
+    note, fail = await deduper.run(url, parse)
+    if note:
+        return note.model_copy(update={"id": _generate_note_id(url), "url": url}), None
+    return None, {"url": url, "error": fail["error"]}
+
+
+async def _run_job_url(deduper: NoteDeduper, url: str, options: Dict) -> tuple[Dict | None, Dict | None]:
+    """供持久化任务（jobs）调用的解析函数，笔记转为 dict 以便落盘。"""
+    note, fail = await _parse_url(
+        deduper,
+        url,
+        force_refresh=options.get("force_refresh", False),
+        prefetch_images=options.get("prefetch_images", True),
+        deadline=options.get("deadline"),
+    )
+    return (note.model_dump() if note else None), fail
+
+
+job_manager.configure(_run_job_url, progress_extra=lambda: {"scheduler": crawl_scheduler.stats()})
+
+
 @app.post("/api/generate", response_model=GeneratedContent)
 async def generate_content(request: GenerateRequest):
     print(f"\n🚀 [1/3] 开始爬取: {request.url}")
     
-    scraper = XHSScraper()
-    try:
-        data = await scraper.scrape_note(request.url)
-        if not data:
-            raise HTTPException(status_code=400, detail="抓取失败")
-    finally:
-        await scraper.close()
+    data = await _scrape(request.url)
+    if not data:
+        raise HTTPException(status_code=400, detail="抓取失败")
 
     print(f"✅ [2/3] 抓取完成: {data['title']}")
 
@@ -412,13 +588,9 @@ async def download_note(request: DownloadRequest):
     """
     print(f"\n📥 [下载] 开始爬取并保存: {request.url}")
 
-    scraper = XHSScraper()
-    try:
-        data = await scraper.scrape_note(request.url)
-        if not data:
-            raise HTTPException(status_code=400, detail="抓取失败")
-    finally:
-        await scraper.close()
+    data = await _scrape(request.url)
+    if not data:
+        raise HTTPException(status_code=400, detail="抓取失败")
 
     # 如果前端传了自定义 base_dir，则覆盖默认 DOWNLOAD_ROOT
     global DOWNLOAD_ROOT
@@ -452,128 +624,208 @@ async def batch_parse(request: BatchParseRequest):
     notes: List[ParsedNote] = []
     failed: List[Dict[str, str]] = []
     
-    # 并发解析（限制并发数避免过载，由环境变量 BATCH_PARSE_CONCURRENCY 控制）
-    semaphore = asyncio.Semaphore(BATCH_PARSE_CONCURRENCY)
-    
-    async def parse_single(url: str):
-        async with semaphore:
-            scraper = XHSScraper()
-            try:
-                data = await scraper.scrape_note(url)
-                if not data:
-                    failed.append({"url": url, "error": "抓取失败"})
-                    return
-                if _is_note_empty(data):
-                    err_msg = "笔记内容为空：未解析到标题、正文或图片"
-                    failed.append({"url": url, "error": err_msg})
-                    print(f"❌ [批量解析] 空笔记 {url}: {err_msg}")
-                    return
-
-                note_id = _generate_note_id(url)
-                cover_image = data['images'][0] if data.get('images') else None
-
-                notes.append(ParsedNote(
-                    id=note_id,
-                    url=url,
-                    title=data.get('title', ''),
-                    content=data.get('content', ''),
-                    tags=data.get('tags', []),
-                    images=data.get('images', []),
-                    coverImage=cover_image
-                ))
-                print(f"✅ [批量解析] 成功: {data.get('title', '')[:30]}")
-            except (RateLimitError, DataEmptyError, DataFetchError) as e:
-                err_msg = e.message if getattr(e, "message", None) else str(e)
-                print(f"❌ [批量解析] 失败 {url}: {err_msg}")
-                failed.append({"url": url, "error": err_msg})
-            except Exception as e:
-                print(f"❌ [批量解析] 失败 {url}: {e}")
-                failed.append({"url": url, "error": str(e)})
-            finally:
-                await scraper.close()
-                # 抓取间隔：每条（成功或失败）后随机等待，减轻限流
-                delay = random.uniform(CRAWL_INTERVAL_MIN, CRAWL_INTERVAL_MAX)
-                await asyncio.sleep(delay)
-    
-    # 并发执行所有解析任务
-    await asyncio.gather(*[parse_single(url) for url in request.urls])
+    # 同一笔记的多个链接只抓取一次；固定数量的 worker 依次取链接，并发与速率由全局调度器控制
+    deadline = _batch_deadline(request.deadline_seconds)
+    deduper = NoteDeduper()
+
+    async def parse(url: str):
+        return await _parse_url(
+            deduper,
+            url,
+            force_refresh=request.force_refresh,
+            prefetch_images=request.prefetch_images,
+            deadline=deadline,
+        )
+
+    async for note, fail in bounded_map(request.urls, parse):
+        if note:
+            notes.append(note)
+        else:
+            failed.append(fail)
     
     print(f"✅ [批量解析] 完成: 成功 {len(notes)} 个，失败 {len(failed)} 个")
     return BatchParseResponse(notes=notes, failed=failed)
 
 
 # === 流式批量解析（SSE，实时进度） ===
+# 等待进度事件时每隔多久检查一次客户端是否已断开（秒）
+_STREAM_DISCONNECT_POLL = float(os.getenv("STREAM_DISCONNECT_POLL", "1"))
+# 客户端断开而中止的批次统计
+STREAM_ABORT_STATS = {"batches": 0, "urls_aborted": 0, "tasks_cancelled": 0}
+
+
+def _log_stream_abort(finished: int, total: int, in_flight: int) -> None:
+    """记录客户端断开导致中止的批次：剩余链接数与被取消的在途笔记数。"""
+    aborted = total - finished
+    STREAM_ABORT_STATS["batches"] += 1
+    STREAM_ABORT_STATS["urls_aborted"] += aborted
+    STREAM_ABORT_STATS["tasks_cancelled"] += in_flight
+    print(
+        f"⛔ [批量解析] 客户端已断开，中止剩余 {aborted}/{total} 个链接"
+        f"（取消 {in_flight} 个进行中的笔记，已完成 {finished} 个）"
+    )
+
+
 @app.post("/api/batch_parse_stream")
-async def batch_parse_stream(request: BatchParseRequest):
+async def batch_parse_stream(request: BatchParseRequest, http_request: Request):
     """
     批量解析小红书链接，通过 SSE 流式返回进度。
-    事件类型：progress（每解析完一条） -> done（全部完成，带 notes/failed）。
+    事件类型：progress（每解析完一条，带该条的 note/failed） -> done（全部完成，只带汇总数）；
+    限流熔断状态变化时另推送 breaker 事件（熔断期间批次暂停等待恢复，被限流的链接会重新排队）。
+    固定数量的 worker 依次取链接解析（短链在取到时才解析，首条结果无需等整批规范化），结果逐条下发；
+    同一笔记的多个链接只抓取一次。
+    客户端中途断开时取消本批次剩余的解析任务。
     """
     urls = request.urls
     if not urls:
         raise HTTPException(status_code=400, detail="urls 不能为空")
 
     total = len(urls)
-    notes: List[ParsedNote] = []
-    failed: List[Dict[str, str]] = []
-    queue: asyncio.Queue = asyncio.Queue()
-    semaphore = asyncio.Semaphore(BATCH_PARSE_CONCURRENCY)
+    counts = {"succeeded": 0, "failed": 0}
+    in_flight = 0
+    deadline = _batch_deadline(request.deadline_seconds)
+    deduper = NoteDeduper()
+
+    async def parse(url: str):
+        nonlocal in_flight
+        in_flight += 1
+        try:
+            return await _parse_url(
+                deduper,
+                url,
+                force_refresh=request.force_refresh,
+                prefetch_images=request.prefetch_images,
+                deadline=deadline,
+            )
+        finally:
+            in_flight -= 1
+
+    breaker = crawl_scheduler.breaker
+
+    def breaker_event() -> str:
+        event = {
+            "type": "breaker",
+            "current": counts["succeeded"] + counts["failed"],
+            "total": total,
+            "breaker": breaker.stats(),
+        }
+        return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
 
-    async def parse_single(url: str) -> None:
-        async with semaphore:
-            scraper = None
-            try:
-                scraper = XHSScraper()
-                data = await scraper.scrape_note(url)
-                if not data:
-                    err_msg = "抓取失败（未返回数据）"
-                    failed.append({"url": url, "error": err_msg})
-                    print(f"❌ [批量解析-流] 失败 url={url} error={err_msg}")
-                    await queue.put({"type": "progress", "current": len(notes) + len(failed), "total": total, "note": None, "failed": {"url": url, "error": err_msg}})
-                    return
-                if _is_note_empty(data):
-                    err_msg = "笔记内容为空：未解析到标题、正文或图片"
-                    failed.append({"url": url, "error": err_msg})
-                    print(f"❌ [批量解析-流] 空笔记 url={url} error={err_msg}")
-                    await queue.put({"type": "progress", "current": len(notes) + len(failed), "total": total, "note": None, "failed": {"url": url, "error": err_msg}})
-                    return
-                note_id = _generate_note_id(url)
-                cover_image = data["images"][0] if data.get("images") else None
-                note = ParsedNote(
-                    id=note_id,
-                    url=url,
-                    title=data.get("title", ""),
-                    content=data.get("content", ""),
-                    tags=data.get("tags", []),
-                    images=data.get("images", []),
-                    coverImage=cover_image,
-                )
-                notes.append(note)
-                await queue.put({"type": "progress", "current": len(notes) + len(failed), "total": total, "note": note.model_dump(), "failed": None})
-            except (RateLimitError, DataEmptyError, DataFetchError) as e:
-                err_msg = e.message if getattr(e, "message", None) else str(e)
-                failed.append({"url": url, "error": err_msg})
-                print(f"❌ [批量解析-流] 失败 url={url} error={err_msg}")
-                await queue.put({"type": "progress", "current": len(notes) + len(failed), "total": total, "note": None, "failed": {"url": url, "error": err_msg}})
-            except Exception as e:
-                err_msg = str(e)
-                failed.append({"url": url, "error": err_msg})
-                print(f"❌ [批量解析-流] 失败 url={url} error={err_msg}")
-                await queue.put({"type": "progress", "current": len(notes) + len(failed), "total": total, "note": None, "failed": {"url": url, "error": err_msg}})
-            finally:
-                if scraper:
-                    await scraper.close()
-                # 抓取间隔：每条（成功或失败）后随机等待，减轻限流
-                delay = random.uniform(CRAWL_INTERVAL_MIN, CRAWL_INTERVAL_MAX)
-                await asyncio.sleep(delay)
+    async def event_stream():
+        results = bounded_map(urls, parse)
+        breaker_version = breaker.version
+        pending = None
+        completed = False
+        try:
+            if breaker.blocking:
+                yield breaker_event()
+            while True:
+                # 等待下一条结果，期间定期检查客户端是否已断开、熔断状态是否变化
+                if pending is None:
+                    pending = asyncio.ensure_future(results.__anext__())
+                done, _ = await asyncio.wait({pending}, timeout=_STREAM_DISCONNECT_POLL)
+                if breaker.version != breaker_version:
+                    # 熔断触发 / 半开试探 / 恢复时推送，前端据此提示批次在等待而不是失败
+                    breaker_version = breaker.version
+                    yield breaker_event()
+                if not done:
+                    if await http_request.is_disconnected():
+                        return
+                    continue
+                try:
+                    note, fail = pending.result()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    pending = None
+                counts["succeeded" if note else "failed"] += 1
+                event = {
+                    "type": "progress",
+                    "current": counts["succeeded"] + counts["failed"],
+                    "total": total,
+                    "note": note.model_dump() if note else None,
+                    "failed": fail,
+                    "scheduler": crawl_scheduler.stats(),
+                }
+                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+            completed = True
+            yield f"data: {json.dumps({'type': 'done', 'total': total, **counts}, ensure_ascii=False)}\n\n"
+        finally:
+            if pending is not None:
+                pending.cancel()
+            # 断开（轮询发现或生成器被取消/关闭）时停止 worker，剩余链接不再抓取
+            if not completed:
+                _log_stream_abort(counts["succeeded"] + counts["failed"], total, in_flight)
+            # 等待中的 __anext__ 被取消时生成器会自行结束（同样取消 worker），否则在这里关闭
+            if not results.ag_running:
+                await results.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# === 持久化批量解析任务（断线、刷新、重启后可继续） ===
+@app.post("/api/jobs", response_model=JobCreateResponse)
+async def create_job(request: BatchParseRequest):
+    """
+    创建批量解析任务，立即返回 job_id，解析在后台进行。
+    进度通过 /api/jobs/{job_id}/events 订阅，后端重启后未完成的任务自动继续。
+    """
+    if not request.urls:
+        raise HTTPException(status_code=400, detail="urls 不能为空")
+    job_id = await job_manager.create(
+        request.urls,
+        {
+            "force_refresh": request.force_refresh,
+            "prefetch_images": request.prefetch_images,
+            "deadline_seconds": request.deadline_seconds,
+        },
+    )
+    print(f"\n📥 [任务] 创建任务 {job_id}: {len(request.urls)} 个链接")
+    return JobCreateResponse(job_id=job_id, total=len(request.urls))
+
+
+async def _get_job_or_404(job_id: str) -> Dict:
+    job = await job_manager.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """任务状态：pending / running / done / cancelled / failed（运行出错），以及各状态的链接数"""
+    return await _get_job_or_404(job_id)
+
+
+@app.get("/api/jobs/{job_id}/results", response_model=BatchParseResponse)
+async def get_job_results(job_id: str):
+    """已完成部分的解析结果（按链接顺序）"""
+    await _get_job_or_404(job_id)
+    notes, failed = await job_manager.results(job_id)
+    return BatchParseResponse(notes=[ParsedNote(**n) for n in notes], failed=failed)
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request, offset: int = 0):
+    """
+    通过 SSE 订阅任务事件，从第 offset 条开始（断线重连时传上次收到的 seq + 1，
+    也支持标准的 Last-Event-ID 请求头）。事件类型：progress -> done / cancelled / failed（运行出错，带 error）。
+    """
+    await _get_job_or_404(job_id)
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        offset = max(offset, int(last_event_id) + 1)
 
     async def event_stream():
-        tasks = [asyncio.create_task(parse_single(u)) for u in urls]
-        for _ in range(total):
-            event = await queue.get()
-            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
-        await asyncio.gather(*tasks)
-        yield f"data: {json.dumps({'type': 'done', 'notes': [n.model_dump() for n in notes], 'failed': failed}, ensure_ascii=False)}\n\n"
+        async for event in job_manager.events(job_id, offset):
+            if event is None:
+                yield ": keepalive\n\n"
+                continue
+            yield f"id: {event['seq']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
 
     return StreamingResponse(
         event_stream(),
@@ -582,137 +834,445 @@ async def batch_parse_stream(request: BatchParseRequest):
     )
 
 
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """取消任务：停止在途抓取，未完成的链接记为 cancelled"""
+    await _get_job_or_404(job_id)
+    cancelled = await job_manager.cancel(job_id)
+    return {"job_id": job_id, "cancelled": cancelled}
+
+
+@app.post("/api/jobs/{job_id}/retry_failed")
+async def retry_failed_job(job_id: str):
+    """重新解析失败（及已取消）的链接；任务仍在运行时不重试，返回 retried=0"""
+    await _get_job_or_404(job_id)
+    retried = await job_manager.retry_failed(job_id)
+    return {"job_id": job_id, "retried": retried}
+
+
+@app.get("/api/jobs/{job_id}/results.jsonl")
+async def export_job_results(job_id: str):
+    """按链接顺序以 JSONL 流式导出任务结果（从任务库分批读取，不整体加载到内存）"""
+    await _get_job_or_404(job_id)
+
+    def lines():
+        for url, note, error in job_manager.store.iter_results(job_id):
+            item = {"type": "note", "note": note} if note else {"type": "failed", "url": url, "error": error or ""}
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+# === NDJSON 流式导入 / JSONL 导出 ===
+# 单行最大长度（字节），超长的行记为失败
+_NDJSON_MAX_LINE = 64 * 1024
+
+
+class _DuplexStreamingResponse(StreamingResponse):
+    """
+    边读请求体边输出的流式响应。StreamingResponse 默认在输出期间监听客户端断开，
+    会与读取请求体争抢 receive 消息（吞掉尚未读取的请求体），这里只输出不监听；
+    客户端断开时读取请求体会抛出 ClientDisconnect，输出生成器随之结束。
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+
+def _parse_ndjson_line(line: bytes) -> tuple[str, str | None]:
+    """解析一行输入，返回 (链接, 错误)。每行可以是 JSON 字符串、{"url": ...} 对象或纯文本链接。"""
+    text = line.decode("utf-8", errors="replace").strip()
+    if len(line) > _NDJSON_MAX_LINE:
+        return text[:200], "行过长"
+    if text.startswith(("{", '"')):
+        try:
+            value = json.loads(text)
+        except ValueError:
+            return text[:200], "JSON 格式错误"
+        if isinstance(value, dict):
+            value = value.get("url")
+        if not isinstance(value, str) or not value.strip():
+            return text[:200], "缺少 url"
+        text = value.strip()
+    return text, None
+
+
+async def _iter_ndjson_lines(http_request: Request) -> AsyncIterator[tuple[str, str | None]]:
+    """随请求体到达逐行产出 (链接, 错误)，空行跳过。"""
+    buffer = b""
+    skipping = False  # 正在跳过一行超长内容，直到下一个换行
+    async for chunk in http_request.stream():
+        if skipping:
+            if b"\n" not in chunk:
+                continue
+            chunk = chunk.split(b"\n", 1)[1]
+            skipping = False
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield _parse_ndjson_line(line)
+        if len(buffer) > _NDJSON_MAX_LINE:
+            yield _parse_ndjson_line(buffer)
+            buffer = b""
+            skipping = True
+    if buffer.strip():
+        yield _parse_ndjson_line(buffer)
+
+
+@app.post("/api/batch_parse_ndjson")
+async def batch_parse_ndjson(
+    http_request: Request,
+    force_refresh: bool = False,
+    prefetch_images: bool = True,
+    deadline_seconds: float | None = None,
+):
+    """
+    NDJSON 流式导入：请求体每行一个链接，边接收边解析，结果以 NDJSON 逐行返回：
+    {"type": "note", "note": {...}} / {"type": "failed", "url", "error"}，最后一行 {"type": "done", 汇总数}。
+    固定数量的 worker 从请求体逐行取链接，两端都不整体缓冲；同一笔记的链接在途时合并为一次抓取，
+    之后的重复链接命中解析缓存。客户端需边发送边读取响应。
+    deadline_seconds 为整批的时间预算（从请求开始计），到时仍未抓取的链接记为超时失败。
+    """
+    counts = {"succeeded": 0, "failed": 0}
+    deadline = _batch_deadline(deadline_seconds)
+    # 请求体长度不限，只合并正在进行的同一笔记，不记已完成的笔记键，之后的重复链接命中解析缓存
+    deduper = NoteDeduper(remember_keys=False)
+
+    async def parse(item: tuple[str, str | None]):
+        url, error = item
+        if error:
+            return None, {"url": url, "error": error}
+        return await _parse_url(
+            deduper, url, force_refresh=force_refresh, prefetch_images=prefetch_images, deadline=deadline
+        )
+
+    async def lines():
+        results = bounded_map(_iter_ndjson_lines(http_request), parse)
+        try:
+            async for note, fail in results:
+                counts["succeeded" if note else "failed"] += 1
+                item = {"type": "note", "note": note.model_dump()} if note else {"type": "failed", **fail}
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+            total = counts["succeeded"] + counts["failed"]
+            print(f"✅ [NDJSON 导入] 完成: 成功 {counts['succeeded']} 个，失败 {counts['failed']} 个")
+            yield json.dumps({"type": "done", "total": total, **counts}, ensure_ascii=False) + "\n"
+        finally:
+            await results.aclose()
+
+    return _DuplexStreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.get("/api/notes/export.jsonl")
+async def export_notes(since: float = 0.0):
+    """
+    以 JSONL 流式导出解析缓存中的笔记（按解析时间顺序，从 SQLite 分批读取）。
+    since 为 Unix 时间戳，只导出此后解析的笔记，便于增量同步。
+    """
+
+    def lines():
+        for note_id, data, created_at in parse_cache.iter_entries(since=since):
+            yield json.dumps({"note_id": note_id, **data, "parsed_at": created_at}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+# === 运行状态统计 ===
+@app.get("/api/stats")
+async def stats():
+    """
+    返回后端运行状态（浏览器池使用情况等），便于观察负载
+    """
+    return {
+        "browser_pool": browser_pool.stats() if browser_pool else None,
+        "scheduler": crawl_scheduler.stats(),
+        "parse_cache": parse_cache.stats(),
+        "canonicalization": dict(CANON_STATS),
+        "image_client": image_client.stats(),
+        "image_cache": image_cache.stats(),
+        "transcoder": transcoder.stats(),
+        "image_prefetch": image_prefetcher.stats(),
+        "jobs": job_manager.stats(),
+        "stream_aborts": dict(STREAM_ABORT_STATS),
+        "fetch_mode": {
+            **FETCH_MODE_STATS,
+            "http_hit_rate": round(
+                FETCH_MODE_STATS["http"] / max(1, FETCH_MODE_STATS["http"] + FETCH_MODE_STATS["http_miss"]), 3
+            ),
+        },
+        "resource_filter": resource_filter.stats(),
+        "state_transfer": state_transfer_stats(),
+        "stage_timings": {
+            stage: {
+                "count": int(v["count"]),
+                "avg_seconds": round(v["total_seconds"] / max(1, v["count"]), 6),
+            }
+            for stage, v in STAGE_TIMING_STATS.items()
+        },
+    }
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus 指标（各阶段耗时直方图、异常计数、在途抓取与浏览器池占用）"""
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+
 # === 新增：图片代理接口（解决CORS问题） ===
 @app.get("/api/proxy_image")
-async def proxy_image(url: str):
+async def proxy_image(url: str, request: Request):
     """
     代理图片请求，解决前端CORS问题
+    经两级图片缓存（内存 LRU + 磁盘内容寻址）返回，支持 ETag / Last-Modified 协商缓存
     """
     try:
-        img_data = await download_image_as_bytes(url, convert_to_png=False)  # 代理图片不需要转换
-        if not img_data:
+        img = await image_cache.get_or_fetch(url, lambda: image_client.fetch(url))  # 代理图片不需要转换
+        if not img:
             raise HTTPException(status_code=404, detail="图片下载失败")
-        
+
+        headers = {
+            "Cache-Control": "public, max-age=3600",
+            "Access-Control-Allow-Origin": "*",
+            "ETag": img.etag,
+            "Last-Modified": img.last_modified,
+        }
+        if _is_not_modified(request, img.etag, img.fetched_at):
+            return Response(status_code=304, headers=headers)
         return Response(
-            content=img_data["data"],
-            media_type=img_data.get("mime_type", "image/jpeg"),
-            headers={
-                "Cache-Control": "public, max-age=3600",
-                "Access-Control-Allow-Origin": "*"
-            }
+            content=img.data,
+            media_type=img.mime_type,
+            headers=headers,
         )
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ [图片代理] 失败: {e}")
         raise HTTPException(status_code=500, detail=f"图片代理失败: {str(e)}")
 
+
+def _is_not_modified(request: Request, etag: str, modified_at: float) -> bool:
+    """按 If-None-Match（优先）或 If-Modified-Since 判断浏览器缓存是否仍有效"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # HTTP 日期精确到秒
+        return int(modified_at) <= since
+    return False
+
 # === 新增：ZIP下载接口（推荐，直接下载到用户本地） ===
+# 单个 ZIP 内同时下载的图片数（也是流式打包时内存中最多暂存的图片数）
+_ZIP_IMG_CONCURRENCY = 5
+
+
+def _image_ext(mime: str) -> str:
+    """根据 MIME 类型确定 ZIP 内图片扩展名"""
+    mime = (mime or "image/jpeg").lower()
+    if "png" in mime:
+        return "png"
+    if "jpg" in mime or "jpeg" in mime:
+        return "jpg"
+    if "gif" in mime:
+        return "gif"
+    return "png"
+
+
+def _zip_content_disposition(zip_filename: str) -> str:
+    """
+    构造 ZIP 下载的 Content-Disposition 头
+    使用RFC 5987格式编码文件名，支持中文
+    格式: attachment; filename="fallback.zip"; filename*=UTF-8''encoded.zip
+    注意：filename 参数必须只包含 ASCII 字符，否则 FastAPI 会尝试用 latin-1 编码导致错误
+    """
+    # 生成 ASCII 安全的 fallback 文件名（只保留 ASCII 字符，非 ASCII 字符替换为下划线）
+    ascii_safe_filename = "".join(c if ord(c) < 128 and c.isprintable() else "_" for c in zip_filename)
+    if not ascii_safe_filename or ascii_safe_filename == ".zip" or ascii_safe_filename.strip() == "":
+        ascii_safe_filename = "xhs_note.zip"
+    
+    # 编码 UTF-8 文件名（用于 filename* 参数）
+    encoded_filename = quote(zip_filename.encode('utf-8'))
+    
+    # 构建 Content-Disposition 头（filename 使用 ASCII 安全名称，filename* 使用 UTF-8 编码）
+    # 确保整个字符串都是 ASCII 安全的
+    content_disposition = f'attachment; filename="{ascii_safe_filename}"; filename*=UTF-8\'\'{encoded_filename}'
+    
+    # 验证 content_disposition 字符串是否只包含 ASCII 字符
+    try:
+        content_disposition.encode('ascii')
+    except UnicodeEncodeError:
+        # 如果包含非 ASCII 字符，只使用 filename* 参数
+        content_disposition = f'attachment; filename*=UTF-8\'\'{encoded_filename}'
+    return content_disposition
+
+
+def _note_text(title: str, content: str, tags: List[str], origin_url: str) -> str:
+    """ZIP 内文本文件内容（标题+内容+标签+链接）"""
+    text_content = f"{title}\n\n{content}\n\n"
+    if tags:
+        text_content += f"标签: {', '.join(tags)}\n"
+    if origin_url:
+        text_content += f"来源链接: {origin_url}\n"
+    return text_content
+
+
 @app.post("/api/download_zip")
 async def download_zip(request: ZipDownloadRequest):
     """
-    将笔记打包成ZIP并返回给前端下载
+    将笔记打包成ZIP并流式返回给前端下载
+    图片按顺序边下载边写入 ZIP（图片 ZIP_STORED、文本 ZIP_DEFLATED），内存中最多暂存几张图片
     """
     print(f"\n📦 [ZIP下载] 开始打包: {request.note_data.get('title', '')}")
     
-    try:
-        title = request.note_data.get('title', 'xhs_note')
-        content = request.note_data.get('content', '')
-        tags = request.note_data.get('tags', [])
-        origin_url = request.note_data.get('origin_url', '')
-        images = request.note_data.get('images', [])
-        
-        # 确定要下载的图片
-        images_to_download = images
-        if request.selected_image_indices is not None:
-            images_to_download = [images[i] for i in request.selected_image_indices if 0 <= i < len(images)]
-        
-        # 创建内存中的ZIP文件
-        zip_buffer = io.BytesIO()
-        folder_name = _sanitize_filename(title)
-        
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+    title = request.note_data.get('title', 'xhs_note')
+    content = request.note_data.get('content', '')
+    tags = request.note_data.get('tags', [])
+    origin_url = request.note_data.get('origin_url', '')
+    images = request.note_data.get('images', [])
+    
+    # 确定要下载的图片
+    images_to_download = images
+    if request.selected_image_indices is not None:
+        images_to_download = [images[i] for i in request.selected_image_indices if 0 <= i < len(images)]
+    
+    folder_name = _sanitize_filename(title)
+    zip_filename = f"{folder_name}.zip"
+
+    # 每张图前加随机延迟，减轻 CDN 限流
+    async def fetch_one(idx_url: tuple) -> tuple[int, dict | None]:
+        idx, img_url = idx_url
+        await _image_download_delay(img_url)
+        data = await download_image_as_bytes(img_url, image_format=request.image_format)
+        return (idx, data)
+
+    async def zip_stream():
+        writer = StreamingZipWriter()
+        try:
             # 1. 添加文本文件（可选）
             if request.include_text:
                 text_filename = f"{folder_name}.txt"
-                text_content = f"{title}\n\n{content}\n\n"
-                if tags:
-                    text_content += f"标签: {', '.join(tags)}\n"
-                if origin_url:
-                    text_content += f"来源链接: {origin_url}\n"
-                zip_file.writestr(text_filename, text_content.encode('utf-8'))
-
-            # 2. 并发下载图片并添加（限制并发数；每张图前加随机延迟，减轻 CDN 限流）
-            _IMG_CONCURRENCY = 5
-
-            async def fetch_one(idx_url: tuple) -> tuple[int, dict | None]:
-                idx, img_url = idx_url
-                await asyncio.sleep(
-                    random.uniform(IMAGE_DOWNLOAD_DELAY_MIN, IMAGE_DOWNLOAD_DELAY_MAX)
-                )
-                data = await download_image_as_bytes(img_url, convert_to_png=True)
-                return (idx, data)
-
-            sem = asyncio.Semaphore(_IMG_CONCURRENCY)
-            async def limited_fetch(idx_url: tuple) -> tuple[int, dict | None]:
-                async with sem:
-                    return await fetch_one(idx_url)
+                yield writer.add(text_filename, _note_text(title, content, tags, origin_url).encode('utf-8'), compress=True)
 
+            # 2. 滑动窗口并发下载图片，按序号写入
             indexed = list(enumerate(images_to_download, start=1))
-            results = await asyncio.gather(*[limited_fetch((i, u)) for i, u in indexed])
-            for idx, img_data in sorted(results, key=lambda x: x[0]):
+            async for idx, img_data in ordered_prefetch(indexed, fetch_one, _ZIP_IMG_CONCURRENCY):
                 if not img_data:
                     continue
-                mime = img_data.get("mime_type", "image/jpeg").lower()
-                ext = "png"
-                if "png" in mime:
-                    ext = "png"
-                elif "jpg" in mime or "jpeg" in mime:
-                    ext = "jpg"
-                elif "gif" in mime:
-                    ext = "gif"
-                img_filename = f"image_{idx}.{ext}"
-                zip_file.writestr(img_filename, img_data["data"])
+                img_filename = f"image_{idx}.{_image_ext(img_data.get('mime_type'))}"
+                yield writer.add(img_filename, img_data["data"])
                 print(f"   - 已添加图片: {img_filename}")
-        
-        zip_buffer.seek(0)
-        zip_filename = f"{folder_name}.zip"
-        
-        print(f"✅ [ZIP下载] 打包完成: {zip_filename} ({len(zip_buffer.getvalue())} bytes)")
-        
-        # 使用RFC 5987格式编码文件名，支持中文
-        # 格式: attachment; filename="fallback.zip"; filename*=UTF-8''encoded.zip
-        # 注意：filename 参数必须只包含 ASCII 字符，否则 FastAPI 会尝试用 latin-1 编码导致错误
-        # 生成 ASCII 安全的 fallback 文件名（只保留 ASCII 字符，非 ASCII 字符替换为下划线）
-        ascii_safe_filename = "".join(c if ord(c) < 128 and c.isprintable() else "_" for c in zip_filename)
-        if not ascii_safe_filename or ascii_safe_filename == ".zip" or ascii_safe_filename.strip() == "":
-            ascii_safe_filename = "xhs_note.zip"
-        
-        # 编码 UTF-8 文件名（用于 filename* 参数）
-        encoded_filename = quote(zip_filename.encode('utf-8'))
-        
-        # 构建 Content-Disposition 头（filename 使用 ASCII 安全名称，filename* 使用 UTF-8 编码）
-        # 确保整个字符串都是 ASCII 安全的
-        content_disposition = f'attachment; filename="{ascii_safe_filename}"; filename*=UTF-8\'\'{encoded_filename}'
-        
-        # 验证 content_disposition 字符串是否只包含 ASCII 字符
-        try:
-            content_disposition.encode('ascii')
-        except UnicodeEncodeError:
-            # 如果包含非 ASCII 字符，只使用 filename* 参数
-            content_disposition = f'attachment; filename*=UTF-8\'\'{encoded_filename}'
-        
-        # 返回ZIP文件
-        return Response(
-            content=zip_buffer.getvalue(),
-            media_type="application/zip",
-            headers={
-                "Content-Disposition": content_disposition,
-                "Content-Length": str(len(zip_buffer.getvalue()))
+
+            yield writer.close()
+            print(f"✅ [ZIP下载] 打包完成: {zip_filename} ({writer.bytes_written} bytes)")
+        except Exception as e:
+            # 响应已开始发送，无法再改状态码，只能中断流
+            print(f"❌ [ZIP下载] 失败: {e}")
+            raise
+
+    return StreamingResponse(
+        zip_stream(),
+        media_type="application/zip",
+        headers={"Content-Disposition": _zip_content_disposition(zip_filename)},
+    )
+
+
+# 批量 ZIP 全部笔记共用的图片下载并发数
+_ZIP_BATCH_IMG_CONCURRENCY = max(1, int(os.getenv("ZIP_BATCH_IMG_CONCURRENCY", "8")))
+
+
+def _unique_folder_name(title: str, used: set) -> str:
+    """基于 _sanitize_filename 生成文件夹名，同名时追加 (2)、(3)… 避免冲突"""
+    base = _sanitize_filename(title)
+    name = base
+    n = 2
+    while name.lower() in used:
+        name = f"{base} ({n})"
+        n += 1
+    used.add(name.lower())
+    return name
+
+
+@app.post("/api/download_zip_batch")
+async def download_zip_batch(request: ZipBatchDownloadRequest):
+    """
+    将多个笔记打包成一个ZIP并流式返回：每个笔记一个子文件夹，
+    所有笔记的图片经同一个有界下载窗口按顺序写入，最后写入 manifest.json 列出每个笔记的结果与失败图片
+    """
+    if not request.notes:
+        raise HTTPException(status_code=400, detail="notes 不能为空")
+    print(f"\n📦 [批量ZIP] 开始打包 {len(request.notes)} 个笔记")
+
+    used_names: set = set()
+    entries = []  # 每个笔记的文件夹与待下载图片
+    for item in request.notes:
+        note = item.note_data
+        images = note.get("images", []) or []
+        indices = item.selected_image_indices
+        if indices is None:
+            indices = list(range(len(images)))
+        entries.append({
+            "folder": _unique_folder_name(note.get("title") or "xhs_note", used_names),
+            "note": note,
+            "images": [(i + 1, images[i]) for i in indices if 0 <= i < len(images)],
+        })
+
+    # 展开为 (笔记序号, 图片序号, 图片URL)，全部笔记共用一个下载窗口
+    jobs = [(n, idx, url) for n, e in enumerate(entries) for idx, url in e["images"]]
+
+    async def fetch_one(job: tuple) -> tuple[tuple, dict | None]:
+        await _image_download_delay(job[2])
+        return job, await download_image_as_bytes(job[2], image_format=request.image_format)
+
+    zip_name = _sanitize_filename(request.zip_name or f"xhs_notes_{len(entries)}")
+    zip_filename = f"{zip_name}.zip"
+
+    async def zip_stream():
+        writer = StreamingZipWriter()
+        manifest = [
+            {
+                "folder": e["folder"],
+                "title": e["note"].get("title", ""),
+                "origin_url": e["note"].get("origin_url", ""),
+                "images_requested": len(e["images"]),
+                "images_written": 0,
+                "failed_images": [],
             }
-        )
-        
-    except Exception as e:
-        print(f"❌ [ZIP下载] 失败: {e}")
-        raise HTTPException(status_code=500, detail=f"打包ZIP失败: {str(e)}")
+            for e in entries
+        ]
+        if request.include_text:
+            for e in entries:
+                note = e["note"]
+                text = _note_text(
+                    note.get("title", "xhs_note"), note.get("content", ""),
+                    note.get("tags", []), note.get("origin_url", ""),
+                )
+                yield writer.add(f"{e['folder']}/{e['folder']}.txt", text.encode("utf-8"), compress=True)
+
+        async for (n, idx, url), img_data in ordered_prefetch(jobs, fetch_one, _ZIP_BATCH_IMG_CONCURRENCY):
+            if not img_data:
+                manifest[n]["failed_images"].append({"index": idx, "url": url})
+                continue
+            img_filename = f"{entries[n]['folder']}/image_{idx}.{_image_ext(img_data.get('mime_type'))}"
+            yield writer.add(img_filename, img_data["data"])
+            manifest[n]["images_written"] += 1
+
+        failed_total = sum(len(m["failed_images"]) for m in manifest)
+        summary = {"notes": manifest, "failed_images_total": failed_total}
+        yield writer.add("manifest.json", json.dumps(summary, ensure_ascii=False, indent=2).encode("utf-8"), compress=True)
+        yield writer.close()
+        print(f"✅ [批量ZIP] 打包完成: {zip_filename} ({writer.bytes_written} bytes，失败图片 {failed_total} 张)")
+
+    return StreamingResponse(
+        zip_stream(),
+        media_type="application/zip",
+        headers={"Content-Disposition": _zip_content_disposition(zip_filename)},
+    )
 
 
 # === 旧版：选择性下载接口（保存到服务器，保留用于兼容） ===
@@ -737,7 +1297,8 @@ async def selective_download(request: SelectiveDownloadRequest):
         
         saved = await _save_note_to_disk(
             request.note_data, 
-            selected_indices=request.selected_image_indices
+            selected_indices=request.selected_image_indices,
+            image_format=request.image_format,
         )
     finally:
         DOWNLOAD_ROOT = original_root
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Prometheus 指标：各阶段耗时直方图、抓取异常计数、在途抓取与浏览器池利用率，由 GET /metrics 暴露。
+
+- xhs_stage_seconds{stage}：browser_acquire / goto / readiness / evaluate / extract / http（快速路径）/
+  image_download / transcode / zip_write / gemini
+- xhs_scrape_errors_total{error}：RateLimitError / DataEmptyError / DataFetchError / ScrapeTimeoutError / other
+- xhs_fetch_mode_total{mode}：http / browser / cache
+- xhs_page_pool_leases_total{result}：hit / miss（页面池命中率）
+- xhs_browser_recycles_total{reason}：pages_served / unhealthy / memory
+- xhs_state_transfer_bytes{mode}：slim / full / full_measured（精简提取前后的传输字节数）
+- 仪表盘类指标（在途抓取、调度器排队、浏览器池占用）在采集时通过 bind_* 注册的回调读取
+"""
+import time
+from contextlib import contextmanager
+from typing import Callable, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+
+# 阶段耗时分桶（秒）：覆盖亚毫秒级的解析、毫秒级的 ZIP 写入到数十秒的页面加载与 AI 调用
+_STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+STAGE_SECONDS = Histogram("xhs_stage_seconds", "各阶段耗时（秒）", ["stage"], buckets=_STAGE_BUCKETS)
+SCRAPE_ERRORS = Counter("xhs_scrape_errors_total", "抓取失败次数（按异常类型）", ["error"])
+FETCH_MODE = Counter("xhs_fetch_mode_total", "成功抓取的笔记数（按抓取路径）", ["mode"])
+BROWSER_RECYCLES = Counter("xhs_browser_recycles_total", "浏览器回收次数（按原因）", ["reason"])
+STATE_TRANSFER_BYTES = Histogram(
+    "xhs_state_transfer_bytes",
+    "浏览器路径每条笔记经 page.evaluate 传回的 state 字节数",
+    ["mode"],
+    buckets=(1_000, 2_000, 5_000, 10_000, 25_000, 50_000, 100_000, 250_000, 500_000, 1_000_000),
+)
+PAGE_POOL_LEASES = Counter("xhs_page_pool_leases_total", "页面池租用次数（hit=复用空闲页面，miss=新建页面）", ["result"])
+
+SCRAPES_IN_FLIGHT = Gauge("xhs_scrapes_in_flight", "正在执行的抓取数")
+SCRAPES_WAITING = Gauge("xhs_scrapes_waiting", "等待调度器名额的抓取数")
+CRAWL_RATE = Gauge("xhs_crawl_rate_per_second", "调度器当前令牌速率（条/秒）")
+POOL_PAGES_IN_USE = Gauge("xhs_browser_pool_pages_in_use", "浏览器池已租出的页面数")
+POOL_CAPACITY = Gauge("xhs_browser_pool_capacity", "浏览器池可同时租用的页面数")
+POOL_UTILIZATION = Gauge("xhs_browser_pool_utilization", "浏览器池占用率（0～1）")
+POOL_RSS = Gauge("xhs_browser_pool_rss_bytes", "浏览器池全部 Chromium 进程的 RSS（最近一次采样，字节）")
+
+_KNOWN_ERRORS = ("RateLimitError", "DataEmptyError", "DataFetchError", "ScrapeTimeoutError")
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """计时一个阶段（异常时同样记录）。"""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - t0)
+
+
+def record_error(error: BaseException) -> None:
+    name = type(error).__name__
+    SCRAPE_ERRORS.labels(name if name in _KNOWN_ERRORS else "other").inc()
+
+
+def bind_scheduler(scheduler) -> None:
+    SCRAPES_IN_FLIGHT.set_function(lambda: scheduler.in_flight)
+    SCRAPES_WAITING.set_function(lambda: scheduler.waiting)
+    CRAWL_RATE.set_function(lambda: scheduler.rate)
+
+
+def bind_browser_pool(get_pool: Callable[[], object]) -> None:
+    """get_pool 返回当前浏览器池（可能为 None，如 lifespan 之外）。"""
+
+    def in_use() -> float:
+        pool = get_pool()
+        return pool.in_use if pool else 0
+
+    def capacity() -> float:
+        pool = get_pool()
+        return pool.capacity if pool else 0
+
+    POOL_PAGES_IN_USE.set_function(in_use)
+    POOL_CAPACITY.set_function(capacity)
+    POOL_UTILIZATION.set_function(lambda: in_use() / capacity() if capacity() else 0.0)
+
+    def rss() -> float:
+        pool = get_pool()
+        return pool.rss_bytes if pool else 0
+
+    POOL_RSS.set_function(rss)
+
+
+def render() -> Tuple[bytes, str]:
+    """返回 (Prometheus 文本格式内容, Content-Type)。"""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+context 上的可复用页面池：抓取时租用预先创建好的页面，用完后跳到 about:blank 清空页面 JS 状态再放回，
+省掉每条笔记 new_page / close 的开销。
+
+- 租用时优先取空闲页面（命中），没有再新建（未命中）；命中率供 /api/stats 与 /metrics 观察
+- 抓取出错的页面、累计使用达到 BROWSER_PAGE_MAX_USES 次的页面、重置失败的页面直接关闭，不再放回
+- 空闲页面数不超过 max_idle（浏览器池为每个 context 的并发页面上限）
+"""
+import os
+import asyncio
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+import metrics
+
+
+# 是否复用页面（关闭后每次租用都新建页面、用完即关，与旧行为一致）
+PAGE_POOL_ENABLED = os.getenv("XHS_PAGE_POOL", "1").strip().lower() in ("1", "true", "yes")
+# 每个页面最多服务多少条笔记后关闭重建（0 表示不限）
+BROWSER_PAGE_MAX_USES = max(0, int(os.getenv("BROWSER_PAGE_MAX_USES", "50")))
+# 每个 context 启动时预先创建的空闲页面数
+BROWSER_PAGE_PREWARM = max(0, int(os.getenv("BROWSER_PAGE_PREWARM", "1")))
+# 归还页面时跳转 about:blank 的超时（毫秒）
+PAGE_RESET_TIMEOUT_MS = 5000
+
+
+async def reset_page(page) -> bool:
+    """跳转到 about:blank，丢弃上一条笔记的 JS 状态、定时器与未完成的请求；失败返回 False。"""
+    try:
+        await page.goto("about:blank", timeout=PAGE_RESET_TIMEOUT_MS)
+        return True
+    except Exception:
+        return False
+
+
+async def _close_page(page) -> None:
+    try:
+        await page.close()
+    except Exception:
+        pass
+
+
+class PagePool:
+    def __init__(
+        self,
+        context,
+        max_idle: int,
+        max_uses: int = BROWSER_PAGE_MAX_USES,
+        enabled: bool = PAGE_POOL_ENABLED,
+        counters: Optional[Counter] = None,
+    ):
+        """counters：统计计数，可由多个页面池共享（如浏览器池汇总各 context 的命中率）。"""
+        self.context = context
+        self.max_idle = max_idle
+        self.max_uses = max_uses
+        self.enabled = enabled
+        self.counters = counters if counters is not None else Counter()
+        self._idle: List = []
+        self._uses: Dict[int, int] = {}
+        self._closed = False
+
+    @property
+    def idle(self) -> int:
+        return len(self._idle)
+
+    async def _new_page(self):
+        page = await self.context.new_page()
+        self._uses[id(page)] = 0
+        self.counters["created"] += 1
+        return page
+
+    async def prewarm(self, count: int = BROWSER_PAGE_PREWARM) -> None:
+        """预先创建空闲页面（不超过 max_idle）。"""
+        if not self.enabled:
+            return
+        while not self._closed and len(self._idle) < min(count, self.max_idle):
+            self._idle.append(await self._new_page())
+
+    async def acquire(self):
+        while self._idle:
+            page = self._idle.pop()
+            if not page.is_closed():
+                self.counters["hits"] += 1
+                metrics.PAGE_POOL_LEASES.labels("hit").inc()
+                return page
+            self._uses.pop(id(page), None)
+        self.counters["misses"] += 1
+        metrics.PAGE_POOL_LEASES.labels("miss").inc()
+        return await self._new_page()
+
+    async def release(self, page, reusable: bool = True) -> None:
+        """归还页面：可复用时重置后放回空闲列表，否则关闭。"""
+        uses = self._uses.get(id(page), 0) + 1
+        self._uses[id(page)] = uses
+        if not reusable:
+            reason = "discarded_error"
+        elif self.max_uses and uses >= self.max_uses:
+            reason = "discarded_max_uses"
+        elif not self.enabled or self._closed or len(self._idle) >= self.max_idle or page.is_closed():
+            reason = "closed"
+        elif not await reset_page(page):
+            reason = "discarded_reset_failed"
+        elif self._closed:
+            reason = "closed"
+        else:
+            self._idle.append(page)
+            return
+        self.counters[reason] += 1
+        self._uses.pop(id(page), None)
+        await _close_page(page)
+
+    @asynccontextmanager
+    async def lease(self):
+        """租用一个页面；代码块抛出异常（含取消）时页面视为已污染，直接关闭。"""
+        page = await self.acquire()
+        ok = False
+        try:
+            yield page
+            ok = True
+        finally:
+            await self.release(page, reusable=ok)
+
+    async def close(self) -> None:
+        """关闭全部空闲页面，之后归还的页面也直接关闭（租出中的页面不受影响）。"""
+        self._closed = True
+        idle, self._idle = self._idle, []
+        for page in idle:
+            self._uses.pop(id(page), None)
+            await _close_page(page)
+
+    def stats(self) -> dict:
+        return page_pool_stats(self.counters, self.idle)
+
+
+def page_pool_stats(counters: Counter, idle: int) -> dict:
+    lookups = counters["hits"] + counters["misses"]
+    return {
+        "enabled": PAGE_POOL_ENABLED,
+        "idle": idle,
+        "created": counters["created"],
+        "hits": counters["hits"],
+        "misses": counters["misses"],
+        "hit_rate": round(counters["hits"] / lookups, 3) if lookups else 0.0,
+        "discarded_error": counters["discarded_error"],
+        "discarded_max_uses": counters["discarded_max_uses"],
+        "discarded_reset_failed": counters["discarded_reset_failed"],
+    }
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+笔记解析结果的本地持久化缓存（SQLite），按规范化笔记 ID 存储 extract_note_from_state 的结果。
+
+- TTL：超过 XHS_PARSE_CACHE_TTL 秒的条目视为过期，读取时删除
+- 容量：条目数超过 XHS_PARSE_CACHE_MAX_ENTRIES 时按最近访问时间淘汰（LRU）
+- 统计命中/未命中次数，供 /api/stats 观察
+
+get / put 是同步的 sqlite3 调用（每次 get 还要提交访问时间），异步代码中经 asyncio.to_thread 调用，不阻塞事件循环。
+"""
+import os
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+
+# 本地数据目录（缓存、任务等持久化文件），可用 XHS_DATA_DIR 覆盖
+DATA_DIR = os.getenv("XHS_DATA_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# 是否启用解析缓存
+PARSE_CACHE_ENABLED = os.getenv("XHS_PARSE_CACHE", "1").strip().lower() in ("1", "true", "yes")
+# 缓存有效期（秒），默认 7 天
+PARSE_CACHE_TTL = float(os.getenv("XHS_PARSE_CACHE_TTL", str(7 * 24 * 3600)))
+# 最多缓存多少条笔记
+PARSE_CACHE_MAX_ENTRIES = max(1, int(os.getenv("XHS_PARSE_CACHE_MAX_ENTRIES", "5000")))
+
+# 只缓存解析出的笔记内容，抓取过程信息（路径、耗时）不入缓存
+_CACHED_FIELDS = ("title", "content", "tags", "images", "origin_url")
+
+
+class ParseCache:
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl: float = PARSE_CACHE_TTL,
+        max_entries: int = PARSE_CACHE_MAX_ENTRIES,
+        enabled: bool = PARSE_CACHE_ENABLED,
+    ):
+        self.path = path or os.path.join(DATA_DIR, "parse_cache.db")
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS notes (
+                    note_id TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_notes_last_access ON notes(last_access)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_notes_created_at ON notes(created_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, note_id: str) -> Optional[Dict]:
+        """命中且未过期时返回笔记数据，否则返回 None。"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT data, created_at FROM notes WHERE note_id = ?", (note_id,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            data, created_at = row
+            if now - created_at > self.ttl:
+                db.execute("DELETE FROM notes WHERE note_id = ?", (note_id,))
+                db.commit()
+                self.misses += 1
+                return None
+            db.execute("UPDATE notes SET last_access = ? WHERE note_id = ?", (now, note_id))
+            db.commit()
+            self.hits += 1
+        return json.loads(data)
+
+    def put(self, note_id: str, note: Dict) -> None:
+        """写入（覆盖）一条解析结果，超出容量时淘汰最久未访问的条目。"""
+        if not self.enabled:
+            return
+        now = time.time()
+        data = json.dumps({k: note.get(k) for k in _CACHED_FIELDS}, ensure_ascii=False)
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO notes (note_id, data, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (note_id, data, now, now),
+            )
+            (count,) = db.execute("SELECT COUNT(*) FROM notes").fetchone()
+            overflow = count - self.max_entries
+            if overflow > 0:
+                db.execute(
+                    "DELETE FROM notes WHERE note_id IN (SELECT note_id FROM notes ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,),
+                )
+                self.evictions += overflow
+            db.commit()
+
+    def iter_entries(self, since: float = 0.0, batch_size: int = 500) -> Iterator[Tuple[str, Dict, float]]:
+        """
+        按写入时间顺序分批读取未过期的条目 (笔记 ID, 数据, 写入时间)，不更新访问时间，供流式导出使用。
+        每批单独加锁查询，导出过程中不长时间占用连接。
+        """
+        if not self.enabled:
+            return
+        last = (max(since, time.time() - self.ttl), "")
+        while True:
+            with self._lock:
+                rows = self._db().execute(
+                    "SELECT note_id, data, created_at FROM notes WHERE (created_at, note_id) > (?, ?) "
+                    "ORDER BY created_at, note_id LIMIT ?",
+                    (*last, batch_size),
+                ).fetchall()
+            for note_id, data, created_at in rows:
+                yield note_id, json.loads(data), created_at
+            if len(rows) < batch_size:
+                return
+            last = (rows[-1][2], rows[-1][0])
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> dict:
+        entries = 0
+        if self.enabled:
+            with self._lock:
+                (entries,) = self._db().execute("SELECT COUNT(*) FROM notes").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+# 进程内共享实例
+parse_cache = ParseCache()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+抓取笔记页时的请求拦截：只需要 __INITIAL_STATE__，图片由 imageList 单独下载，
+因此在浏览器 context 上按资源类型与域名拦截图片、字体、媒体与埋点上报，让页面更快加载完成、少占带宽。
+
+被拦截的请求没有响应体、无从得知原本的大小，因此只统计拦截次数（按原因与资源类型），不估算节省的字节数。
+"""
+import os
+from typing import Dict, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+
+def _env_set(name: str, default: str) -> Set[str]:
+    return {x.strip().lower() for x in os.getenv(name, default).split(",") if x.strip()}
+
+
+# 是否启用请求拦截
+RESOURCE_FILTER_ENABLED = os.getenv("XHS_RESOURCE_FILTER", "1").strip().lower() in ("1", "true", "yes")
+# 按 Playwright resource_type 拦截（document/script/xhr/fetch 不可拦，否则拿不到 state）
+BLOCKED_RESOURCE_TYPES = _env_set("XHS_BLOCK_RESOURCE_TYPES", "image,media,font")
+# 域名黑名单（含子域名）：埋点、监控上报与第三方统计
+BLOCKED_HOSTS = _env_set(
+    "XHS_BLOCK_HOSTS",
+    "apm-fe.xiaohongshu.com,t2.xiaohongshu.com,t2-test.xiaohongshu.com,lng.xiaohongshu.com,"
+    "google-analytics.com,googletagmanager.com,doubleclick.net,hm.baidu.com",
+)
+# 域名白名单（含子域名）：非空时只放行名单内域名
+ALLOWED_HOSTS = _env_set("XHS_ALLOW_HOSTS", "")
+
+
+def _host_matches(host: str, patterns: Set[str]) -> bool:
+    return any(host == p or host.endswith("." + p) for p in patterns)
+
+
+class ResourceFilter:
+    def __init__(
+        self,
+        blocked_types: Optional[Set[str]] = None,
+        blocked_hosts: Optional[Set[str]] = None,
+        allowed_hosts: Optional[Set[str]] = None,
+    ):
+        self.blocked_types = BLOCKED_RESOURCE_TYPES if blocked_types is None else blocked_types
+        self.blocked_hosts = BLOCKED_HOSTS if blocked_hosts is None else blocked_hosts
+        self.allowed_hosts = ALLOWED_HOSTS if allowed_hosts is None else allowed_hosts
+
+        self.allowed = 0
+        self.blocked = 0
+        self.blocked_by_reason: Dict[str, int] = {}
+        self.blocked_by_type: Dict[str, int] = {}
+
+    def decide(self, resource_type: str, url: str) -> Tuple[bool, str]:
+        """返回 (是否拦截, 原因)。"""
+        if resource_type == "document":
+            return False, ""
+        host = (urlparse(url).hostname or "").lower()
+        if self.allowed_hosts and host and not _host_matches(host, self.allowed_hosts):
+            return True, "host_not_allowed"
+        if host and _host_matches(host, self.blocked_hosts):
+            return True, "host_blocked"
+        if resource_type in self.blocked_types:
+            return True, f"type:{resource_type}"
+        return False, ""
+
+    async def handle(self, route):
+        request = route.request
+        blocked, reason = self.decide(request.resource_type, request.url)
+        if not blocked:
+            self.allowed += 1
+            await route.continue_()
+            return
+        self.blocked += 1
+        self.blocked_by_reason[reason] = self.blocked_by_reason.get(reason, 0) + 1
+        self.blocked_by_type[request.resource_type] = self.blocked_by_type.get(request.resource_type, 0) + 1
+        await route.abort("blockedbyclient")
+
+    async def install(self, context):
+        """在浏览器 context 上安装拦截（未启用时不做任何事）。"""
+        if RESOURCE_FILTER_ENABLED:
+            await context.route("**/*", self.handle)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": RESOURCE_FILTER_ENABLED,
+            "allowed": self.allowed,
+            "blocked": self.blocked,
+            "blocked_by_reason": dict(self.blocked_by_reason),
+            "blocked_by_type": dict(self.blocked_by_type),
+        }
+
+
+# 进程内共享实例：独立模式的 XHSScraper 与共享浏览器池的所有 context 都装这一份，统计汇总在一起
+resource_filter = ResourceFilter()
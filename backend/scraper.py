@@ -9,7 +9,10 @@ from typing import Optional, List, Dict
 import httpx
 from playwright.async_api import async_playwright
 
-from exception import RateLimitError, DataEmptyError, DataFetchError
+from exception import RateLimitError, DataEmptyError, DataFetchError, ScrapeTimeoutError
+import metrics
+from resource_filter import resource_filter
+from page_pool import PagePool, reset_page
 
 
 # 单条抓取失败时重试次数（不含首次），默认 1 即最多共 2 次尝试
@@ -25,30 +28,337 @@ def _log(msg: str, always: bool = False) -> None:
 # 重试间隔（秒）
 PARSE_RETRY_DELAY_MIN = float(os.getenv("PARSE_RETRY_DELAY_MIN", "1"))
 PARSE_RETRY_DELAY_MAX = float(os.getenv("PARSE_RETRY_DELAY_MAX", "2"))
+# 是否先用纯 HTTP 读取服务端渲染页中的 __INITIAL_STATE__（拿不到或不完整再走浏览器）
+HTTP_FAST_PATH = os.getenv("XHS_HTTP_FAST_PATH", "1").strip().lower() in ("1", "true", "yes")
+HTTP_FAST_PATH_TIMEOUT = float(os.getenv("XHS_HTTP_FAST_PATH_TIMEOUT", "10"))
+# 快速路径响应中出现这些标记（且页面没有内嵌 state）视为限流 / 验证码页，与 READINESS_JS 的 ratelimit 判定一致
+_RATE_LIMIT_MARKERS = ("安全限制", "Too many requests", "300013")
+# 单条链接抓取的总时间预算（秒）：HTTP 快速路径、等待浏览器页面、goto、页面判定、重试及重试间隔共用，
+# 各阶段只能用剩余预算，用完即放弃并抛出 ScrapeTimeoutError（0 表示不限）
+SCRAPE_DEADLINE_SECONDS = max(0.0, float(os.getenv("SCRAPE_DEADLINE_SECONDS", "60")))
+# 剩余预算少于该秒数时不再开始新的阶段（开始了也来不及完成）
+_MIN_STAGE_SECONDS = 1.0
+# 浏览器路径是否在页面内只取解析需要的字段（关闭后取完整 noteDetailMap，便于排查结构变化）
+SLIM_STATE = os.getenv("XHS_SLIM_STATE", "1").strip().lower() in ("1", "true", "yes")
+# 页面就绪判定的轮询间隔（毫秒）：默认每帧轮询会让正文扫描在页面注水期间反复触发排版，这里改为定时轮询
+READINESS_POLL_MS = max(16, int(os.getenv("XHS_READINESS_POLL_MS", "100")))
+# 精简提取时是否同时在页面内计算完整 noteDetailMap 的序列化大小，用于对比传输字节数（有额外开销，默认关闭）
+STATE_TRANSFER_MEASURE = os.getenv("XHS_STATE_TRANSFER_MEASURE", "").strip().lower() in ("1", "true", "yes")
+
+# 各抓取路径命中次数：http=纯 HTTP 成功，http_miss=HTTP 未拿到完整数据后回退，browser=浏览器抓取成功
+FETCH_MODE_STATS: Dict[str, int] = {"http": 0, "http_miss": 0, "browser": 0}
+
+_INITIAL_STATE_RE = re.compile(r"window\.__INITIAL_STATE__\s*=\s*(\{.*?\})\s*;?\s*</script>", re.S)
+_INITIAL_STATE_START_RE = re.compile(r"window\.__INITIAL_STATE__\s*=\s*")
+# SSR 输出的是 JS 对象字面量，值里可能出现 undefined，需要替换为 null 才能按 JSON 解析
+# （分隔符放进分组而不用后行断言：正则可按首字符快速定位，整页 state 上约快一倍）
+_JS_UNDEFINED_RE = re.compile(r"([:\[,])\s*undefined(?=\s*[,}\]])")
+
+
+def _undefined_to_null(m: re.Match) -> str:
+    # 用函数而不是 r"\1null" 模板：模板每次替换都要展开，小页面上反而比旧正则慢
+    return m.group(1) + "null"
+
+
+# 页面就绪判定（在页面内每 READINESS_POLL_MS 毫秒轮询一次，三个检测器竞争）：
+# - ratelimit: 正文出现安全限制 / 300013 / Too many requests（innerText 会触发排版，所以不按帧轮询）
+# - login: 被重定向到登录页
+# - ready: 第一条笔记的 title/desc/imageList 至少有一个已注入
+# 未判定时返回 false 继续轮询。
+READINESS_JS = """() => {
+    const s = window.__INITIAL_STATE__;
+    const map = s?.note?.noteDetailMap;
+    if (map && typeof map === 'object') {
+        const keys = Object.keys(map);
+        if (keys.length > 0) {
+            let note = map[keys[0]]?.note || map[keys[0]];
+            while (note && typeof note === 'object' && note.note && typeof note.note === 'object') { note = note.note; }
+            if (note && typeof note === 'object') {
+                const hasTitle = (note.title || note.note_title || '').trim().length > 0;
+                const hasDesc = (note.desc || note.description || '').trim().length > 0;
+                const imgs = note.imageList || note.image_list;
+                const hasImages = Array.isArray(imgs) && imgs.length > 0;
+                if (hasTitle || hasDesc || hasImages) return 'ready';
+            }
+        }
+    }
+    if (location.href.includes('/login')) return 'login';
+    const text = document.body ? document.body.innerText : '';
+    if (text.includes('安全限制') || text.includes('Too many requests') || text.includes('300013')) return 'ratelimit';
+    return false;
+}"""
+
+# 浏览器路径取 state 的两种方式（page.evaluate 的返回值都要序列化后经 Playwright 传回 Python）：
+# - FULL_STATE_JS：返回完整 noteDetailMap（评论、互动信息、每张图的全部清晰度等）
+# - SLIM_STATE_JS：在页面内按 extract_note_from_state 的规则定位笔记对象、选出图片链接，只返回 title / desc /
+#   tagList / 选中的图片，结构仍是 { note: { noteDetailMap: { id: { note } } } }，解析逻辑不变。
+#   判断真值时按 Python 语义（空对象、空数组为假），遇到需要 Python 抛异常的非常规结构时返回 { fallback: true }，
+#   由调用方改取完整 map，保证与完整路径结果一致；measure 为真时附带完整 map 的 UTF-8 字节数 fullBytes。
+FULL_STATE_JS = """() => {
+    const s = window.__INITIAL_STATE__;
+    if (!s?.note?.noteDetailMap || typeof s.note.noteDetailMap !== 'object') return null;
+    const keys = Object.keys(s.note.noteDetailMap);
+    if (keys.length === 0) return null;
+    return { note: { noteDetailMap: s.note.noteDetailMap } };
+}"""
+
+SLIM_STATE_JS = r"""(measure) => {
+    const s = window.__INITIAL_STATE__;
+    if (!s?.note?.noteDetailMap || typeof s.note.noteDetailMap !== 'object') return null;
+    const map = s.note.noteDetailMap;
+    const keys = Object.keys(map);
+    if (keys.length === 0) return null;
+    const FALLBACK = { fallback: true };
+    const isDict = (v) => v !== null && typeof v === 'object' && !Array.isArray(v);
+    const truthy = (v) => Array.isArray(v) ? v.length > 0 : isDict(v) ? Object.keys(v).length > 0 : !!v;
+    // Python 的 a or b or c
+    const or = (...vals) => vals.find(truthy) ?? vals[vals.length - 1];
+    // Python str.strip() 后非空（Python 的空白字符集与 JS trim 不同）
+    const PY_NON_WS = /[^\t\n\x0b\x0c\r\x1c-\x1f \x85\xa0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000]/;
+    const hasText = (v) => { if (typeof v !== 'string') throw FALLBACK; return PY_NON_WS.test(v); };
+    const pyLen = (v) => {
+        if (Array.isArray(v) || typeof v === 'string') return v.length;
+        if (isDict(v)) return Object.keys(v).length;
+        throw FALLBACK;
+    };
+    try {
+        const wrapper = isDict(map[keys[0]]) ? map[keys[0]] : {};
+        let item = or(wrapper.note, wrapper.noteDetail, wrapper);
+        if (!isDict(item)) item = {};
+        let inner = item.note;
+        while (truthy(inner) && isDict(inner)) {
+            item = inner;
+            if (hasText(or(inner.title, inner.note_title, '')) || hasText(or(inner.desc, inner.description, ''))
+                || pyLen(or(inner.imageList, inner.image_list, [])) > 0) break;
+            inner = inner.note;
+        }
+        if (!truthy(item) && truthy(wrapper)) item = wrapper;
+
+        const title = or(item.title, item.note_title, '');
+        const desc = or(item.desc, item.description, '');
+        if (typeof title !== 'string' || typeof desc !== 'string') throw FALLBACK;
+        let tagList = or(item.tagList, item.tag_list, []);
+        tagList = Array.isArray(tagList) ? tagList.map((t) => isDict(t) && 'name' in t ? { name: t.name } : t) : [];
+        let imageList = or(item.imageList, item.image_list, []);
+        if (!Array.isArray(imageList)) imageList = [];
+        imageList = imageList.map((img) => {
+            if (!isDict(img)) throw FALLBACK;
+            const info = 'infoList' in img ? img.infoList : [{}];
+            if (!Array.isArray(info) || info.length === 0) throw FALLBACK;
+            const chosen = info.length > 1 ? info[1] : info[0];
+            if (!isDict(chosen)) throw FALLBACK;
+            return { infoList: [{ url: 'url' in chosen ? chosen.url : '' }] };
+        });
+        const out = { note: { noteDetailMap: { [keys[0]]: { note: { title, desc, tagList, imageList } } } } };
+        if (measure) out.fullBytes = new TextEncoder().encode(JSON.stringify({ note: { noteDetailMap: map } })).length;
+        return out;
+    } catch (e) {
+        if (e === FALLBACK) return FALLBACK;
+        throw e;
+    }
+}"""
+
+# 浏览器路径每条笔记经 page.evaluate 传回的 state 字节数（按 JSON UTF-8 估算）：
+# slim=精简提取，full=完整 map（关闭精简或结构非常规回退），full_measured=精简提取时页面内测得的完整 map 大小
+# （slim.fallbacks 为精简提取因结构非常规回退到完整 map 的次数）
+STATE_TRANSFER_STATS: Dict[str, Dict[str, int]] = {
+    "slim": {"count": 0, "bytes": 0, "fallbacks": 0},
+    "full": {"count": 0, "bytes": 0},
+    "full_measured": {"count": 0, "bytes": 0},
+}
+
+
+def record_state_transfer(mode: str, nbytes: int) -> None:
+    entry = STATE_TRANSFER_STATS[mode]
+    entry["count"] += 1
+    entry["bytes"] += nbytes
+    metrics.STATE_TRANSFER_BYTES.labels(mode).observe(nbytes)
+
+
+def state_transfer_stats() -> dict:
+    result = {
+        mode: {**v, "avg_bytes": round(v["bytes"] / v["count"]) if v["count"] else 0}
+        for mode, v in STATE_TRANSFER_STATS.items()
+    }
+    result["slim_enabled"] = SLIM_STATE
+    return result
+
+# 各阶段累计耗时（秒）与次数，用于 /api/stats 观察平均耗时
+STAGE_TIMING_STATS: Dict[str, Dict[str, float]] = {}
+
+
+def record_stage_timings(timings: Dict[str, float]) -> None:
+    """
+    把一次抓取的阶段耗时累加到 STAGE_TIMING_STATS，并记入 Prometheus 阶段直方图（total 除外）。
+    传入 time.perf_counter() 测得的原始秒数，不要先取整（亚毫秒的阶段取整后会记成 0）。
+    """
+    for stage, seconds in timings.items():
+        entry = STAGE_TIMING_STATS.setdefault(stage, {"count": 0, "total_seconds": 0.0})
+        entry["count"] += 1
+        entry["total_seconds"] += seconds
+        if stage != "total":
+            metrics.observe_stage(stage, seconds)
+
+
+def rounded_timings(timings: Dict[str, float]) -> Dict[str, float]:
+    """返回给前端的 timings 字段：保留 3 位小数。"""
+    return {stage: round(seconds, 3) for stage, seconds in timings.items()}
+
+
+# 笔记页路径中的 24 位十六进制笔记 ID：/explore/<id>、/discovery/item/<id>
+_NOTE_ID_RE = re.compile(r"/(?:explore|discovery/item|item)/([0-9a-fA-F]{24})(?:[/?#]|$)")
+
+
+def url_deadline(deadline: Optional[float] = None) -> Optional[float]:
+    """
+    单条链接的截止时刻（time.monotonic()）：从现在起 SCRAPE_DEADLINE_SECONDS 秒，
+    与外部传入的截止时刻（如整批的截止时间）取较早者；都没有时返回 None（不限）。
+    """
+    own = time.monotonic() + SCRAPE_DEADLINE_SECONDS if SCRAPE_DEADLINE_SECONDS else None
+    if deadline is None or own is None:
+        return own if deadline is None else deadline
+    return min(own, deadline)
+
+
+def _deadline_reached(deadline: Optional[float]) -> bool:
+    """剩余预算已不足以开始任何阶段（用于判断某阶段失败是否因为被截短的超时）。"""
+    return deadline is not None and deadline - time.monotonic() < _MIN_STAGE_SECONDS
+
+
+def _ensure_budget(deadline: Optional[float], stage: str) -> None:
+    """剩余预算不足以开始该阶段时抛出 ScrapeTimeoutError。"""
+    if _deadline_reached(deadline):
+        raise ScrapeTimeoutError(f"抓取超时：{stage}前时间预算已用完，已放弃该链接，可稍后重试。")
+
+
+def stage_budget(deadline: Optional[float], stage: str, cap: float) -> float:
+    """某阶段可用的秒数：不超过该阶段自身的超时 cap 与剩余预算；剩余预算不足以开始该阶段时抛出 ScrapeTimeoutError。"""
+    if deadline is None:
+        return cap
+    _ensure_budget(deadline, stage)
+    return min(cap, deadline - time.monotonic())
+
+
+def _check_retry_budget(deadline: Optional[float], delay: float, last_error: Exception) -> None:
+    """重试间隔过后剩余预算不足以再开始一次抓取时直接放弃，不再空等。"""
+    if deadline is not None and time.monotonic() + delay + _MIN_STAGE_SECONDS >= deadline:
+        raise ScrapeTimeoutError(
+            f"抓取超时：剩余时间预算不足以再次重试，已放弃该链接（上次错误：{last_error}）"
+        ) from last_error
+
+
+def extract_note_id(url: str) -> Optional[str]:
+    """从笔记页 URL 中取出规范化的笔记 ID（小写）；xhslink 短链等无法直接识别时返回 None。"""
+    m = _NOTE_ID_RE.search(url or "")
+    return m.group(1).lower() if m else None
+
+
+def _find_initial_state_literal(html: str) -> Optional[str]:
+    """
+    取出 window.__INITIAL_STATE__ = {...} 的对象字面量文本。
+    常见情况下赋值语句独占一个 <script>，直接截到其后第一个 </script>，避免非贪婪正则逐字符回溯整页 state；
+    不符合该形态时再用完整正则匹配。
+    """
+    m = _INITIAL_STATE_START_RE.search(html)
+    if not m:
+        return None
+    end = html.find("</script>", m.end())
+    if end >= 0:
+        raw = html[m.end():end].rstrip()
+        if raw.endswith(";"):
+            raw = raw[:-1].rstrip()
+        if raw.startswith("{") and raw.endswith("}"):
+            return raw
+    m = _INITIAL_STATE_RE.search(html)
+    return m.group(1) if m else None
+
+
+def parse_initial_state_from_html(html: str) -> Optional[dict]:
+    """从笔记页 HTML 中提取内嵌的 window.__INITIAL_STATE__ 并解析为 dict；不存在或解析失败返回 None。"""
+    if not html:
+        return None
+    raw = _find_initial_state_literal(html)
+    if raw is None:
+        return None
+    if "undefined" in raw:
+        raw = _JS_UNDEFINED_RE.sub(_undefined_to_null, raw)
+    try:
+        state = json.loads(raw)
+    except ValueError:
+        return None
+    return state if isinstance(state, dict) else None
+
+
+# 浏览器启动参数与 context 配置（独立模式与共享浏览器池共用）
+BROWSER_LAUNCH_ARGS = ["--disable-blink-features=AutomationControlled"]
+CONTEXT_OPTIONS = {
+    "viewport": {"width": 1920, "height": 1080},
+    "user_agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+}
+
+# HTTP 快速路径与短链解析共用的客户端（连接池复用 TLS 连接），由 lifespan 关闭；首次使用时创建，独立运行时同样可用
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            follow_redirects=True,
+            timeout=HTTP_FAST_PATH_TIMEOUT,
+            headers={
+                "User-Agent": CONTEXT_OPTIONS["user_agent"],
+                "Referer": "https://www.xiaohongshu.com/",
+            },
+        )
+    return _http_client
+
+
+async def close_http_client() -> None:
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
 
 
 class XHSScraper:
-    def __init__(self):
+    def __init__(self, pool=None):
+        """
+        pool: 共享浏览器池（browser_pool.BrowserPool）。传入时从池中租用页面，不自行启动浏览器；
+        不传时保持独立模式，自己启动并在 close() 时关闭浏览器。
+        """
+        self.pool = pool
+        self.last_timings: Dict[str, float] = {}
+        self.playwright = None
         self.browser = None
         self.context = None
+        self.page_pool: Optional[PagePool] = None
 
     async def start(self):
-        """启动浏览器"""
+        """启动浏览器（使用共享池时无需启动）"""
+        if self.pool is not None:
+            return
         if not self.browser:
-            p = await async_playwright().start()
-            self.browser = await p.chromium.launch(
+            self.playwright = await async_playwright().start()
+            self.browser = await self.playwright.chromium.launch(
                 headless=True,
-                args=["--disable-blink-features=AutomationControlled"],
-            )
-            self.context = await self.browser.new_context(
-                viewport={"width": 1920, "height": 1080},
-                user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+                args=BROWSER_LAUNCH_ARGS,
             )
+            self.context = await self.browser.new_context(**CONTEXT_OPTIONS)
+            await resource_filter.install(self.context)
+            self.page_pool = PagePool(self.context, max_idle=1)
 
     async def close(self):
-        """关闭资源"""
+        """关闭资源（共享池由应用 lifespan 负责关闭）"""
+        if self.page_pool:
+            await self.page_pool.close()
+            self.page_pool = None
         if self.browser:
             await self.browser.close()
+            self.browser = None
+        if self.playwright:
+            await self.playwright.stop()
+            self.playwright = None
 
     def _get_no_watermark_img(self, img_url: str) -> str:
         """保留：去水印逻辑已改为直接返回原图。"""
@@ -61,6 +371,7 @@ class XHSScraper:
         """
         从 __INITIAL_STATE__ 中解析出笔记数据（纯函数，便于单测与换数据源）。
         若数据结构异常或内容为空，抛出 DataFetchError / DataEmptyError。
+        兼容的结构变体见 bench/fixtures/state，改动后用 bench/bench_extract.py 对照旧实现验证。
         """
         if not initial_state:
             raise DataFetchError("__INITIAL_STATE__ 为空")
@@ -141,111 +452,63 @@ class XHSScraper:
         except Exception:
             return "（页面已跳转或无法获取）"
 
-    async def _resolve_xhslink(self, url: str) -> str:
+    @staticmethod
+    async def _resolve_xhslink(url: str) -> str:
         """
-        用 HTTP 跟随 xhslink 跳转；当前未使用（主流程改为直接 goto(url) 更稳）。
+        用 HTTP 跟随 xhslink 跳转；仅用于解析前的链接规范化与去重（url_canon），抓取仍直接 goto 原链接更稳。
         若得到笔记页 URL（含 explore/discovery）则返回，否则返回原 url。
         """
         if "xhslink.com" not in url:
             return url
         try:
-            async with httpx.AsyncClient(
-                follow_redirects=True,
-                timeout=12.0,
-                headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36"},
-            ) as client:
-                r = await client.get(url)
-                final_url = str(r.url)
-                if not final_url or "xiaohongshu.com" not in final_url:
-                    return url
-                # 只有明确像笔记页（explore/discovery）才用，否则可能是首页/登录页
-                if "explore" in final_url or "discovery" in final_url:
-                    _log(f"   [抓取] xhslink 解析为笔记页: {final_url[:70]}...")
-                    return final_url
-                print(f"   [抓取] xhslink 解析到非笔记页，改用浏览器打开原链接: {final_url[:60]}...")
+            r = await http_client().get(url, timeout=12.0)
+            final_url = str(r.url)
+            if not final_url or "xiaohongshu.com" not in final_url:
+                return url
+            # 只有明确像笔记页（explore/discovery）才用，否则可能是首页/登录页
+            if "explore" in final_url or "discovery" in final_url:
+                _log(f"   [抓取] xhslink 解析为笔记页: {final_url[:70]}...")
+                return final_url
+            print(f"   [抓取] xhslink 解析到非笔记页，改用浏览器打开原链接: {final_url[:60]}...")
         except Exception as e:
             print(f"   [抓取] xhslink 解析失败，用原链接: {e}")
         return url
 
-    async def _fetch_page_state(self, page, url: str) -> dict:
+    async def _fetch_page_state(self, page, url: str, deadline: Optional[float] = None) -> dict:
         """
         打开笔记页并返回 __INITIAL_STATE__。
         直接 goto 用户给的链接（xhslink 或 explore 均可），由浏览器自然跳转，不做 HTTP 预解析与等标题，避免引入超时/竞态。
+        goto 只等 domcontentloaded，随后在页面内同时检测「限流页 / 登录跳转 / 笔记数据就绪」，任一判定即返回，
+        不再固定 sleep；各阶段耗时记录在 self.last_timings。
+        deadline 为截止时刻（time.monotonic()），goto 与页面判定的超时不超过剩余预算，预算用完抛出 ScrapeTimeoutError。
         """
-        t0 = time.time()
+        t0 = time.perf_counter()
+        timings: Dict[str, float] = {}
+        self.last_timings = timings
         _log(f"   [抓取-步骤] 1) 将打开: {url[:80]}...")
-        await page.goto(url, wait_until="load", timeout=25000)
-        _log(f"   [抓取-步骤] 2) goto 完成，耗时 {time.time()-t0:.1f}s")
+        goto_timeout = stage_budget(deadline, "打开页面", 25)
         try:
-            cur_url = page.url
-            title = await self._safe_page_title(page)
-            _log(f"   [抓取-步骤]    当前 URL: {cur_url[:80]}...")
-            _log(f"   [抓取-步骤]    当前 title: {title!r}")
-        except Exception:
-            pass
-        _log("   [抓取-步骤] 3) sleep 2.5s...")
-        await asyncio.sleep(2.5)
-
-        # 检测限流页（不重试）
-        try:
-            page_text = await page.evaluate(
-                "() => document.body ? document.body.innerText : ''"
-            )
-            _log(f"   [抓取-步骤] 4) 限流检测: body 长度={len(page_text)}, 含安全限制={('安全限制' in page_text or '300013' in page_text)}")
-            if (
-                "安全限制" in page_text
-                or "Too many requests" in page_text
-                or "300013" in page_text
-            ):
-                print(f"❌ [抓取] 命中限流页。URL={url}")
-                raise RateLimitError(
-                    "访问受限：请求过于频繁，请稍后再试（错误码 300013）。可调低并发数或间隔几分钟再解析。"
-                )
-        except RateLimitError:
+            await page.goto(url, wait_until="domcontentloaded", timeout=goto_timeout * 1000)
+        except Exception as e:
+            if _deadline_reached(deadline):
+                raise ScrapeTimeoutError("抓取超时：打开页面时超出时间预算，已放弃该链接，可稍后重试。") from e
             raise
-        except Exception:
-            pass
+        timings["goto"] = time.perf_counter() - t0
+        _log(f"   [抓取-步骤] 2) goto(domcontentloaded) 完成，耗时 {timings['goto']:.1f}s")
 
-        # 等待第一条笔记的「内容」就绪（title/desc/imageList 至少有一个），避免读到空壳导致第一次必失败
-        _log("   [抓取-步骤] 5) 等待笔记内容注入（title/desc/imageList，最多 22s）...")
+        # 三个检测器在页面内同一轮询里竞争，谁先判定就返回：ratelimit / login / ready
+        ready_timeout = stage_budget(deadline, "等待页面数据", 22)
+        _log(f"   [抓取-步骤] 3) 等待页面判定（限流 / 登录 / 笔记就绪，最多 {ready_timeout:.0f}s）...")
+        t_ready = time.perf_counter()
         try:
-            await page.wait_for_function(
-                """() => {
-                    const s = window.__INITIAL_STATE__;
-                    if (!s?.note?.noteDetailMap || typeof s.note.noteDetailMap !== 'object') return false;
-                    const keys = Object.keys(s.note.noteDetailMap);
-                    if (keys.length === 0) return false;
-                    let note = s.note.noteDetailMap[keys[0]]?.note || s.note.noteDetailMap[keys[0]];
-                    if (!note || typeof note !== 'object') return false;
-                    while (note.note && typeof note.note === 'object') { note = note.note; }
-                    const hasTitle = (note.title || note.note_title || '').trim().length > 0;
-                    const hasDesc = (note.desc || note.description || '').trim().length > 0;
-                    const imgs = note.imageList || note.image_list;
-                    const hasImages = Array.isArray(imgs) && imgs.length > 0;
-                    return hasTitle || hasDesc || hasImages;
-                }""",
-                timeout=22000,
-            )
-            # 在页面内只取 note 部分返回，避免整 __INITIAL_STATE__ 序列化失败或过大
-            initial_state = await page.evaluate(
-                """() => {
-                    const s = window.__INITIAL_STATE__;
-                    if (!s?.note?.noteDetailMap || typeof s.note.noteDetailMap !== 'object') return null;
-                    const keys = Object.keys(s.note.noteDetailMap);
-                    if (keys.length === 0) return null;
-                    return { note: { noteDetailMap: s.note.noteDetailMap } };
-                }"""
+            handle = await page.wait_for_function(
+                READINESS_JS, polling=READINESS_POLL_MS, timeout=ready_timeout * 1000
             )
-            _log(f"   [抓取-步骤] 6) wait_for_function 通过，耗时 {time.time()-t0:.1f}s")
-            if initial_state is not None and isinstance(initial_state, dict):
-                _log(f"   [抓取-步骤]     state 顶层键: {list(initial_state.keys())[:15]}")
-                note_map = (initial_state.get("note") or {}) if isinstance(initial_state.get("note"), dict) else {}
-                detail = note_map.get("noteDetailMap") or note_map.get("note_detail_map")
-                if detail and isinstance(detail, dict):
-                    _log(f"   [抓取-步骤]     noteDetailMap 键数: {len(detail)}, 首键: {list(detail.keys())[:1]}")
-            else:
-                _log(f"   [抓取-步骤]     evaluate 返回类型: {type(initial_state).__name__}, 是否空: {not initial_state}")
+            verdict = await handle.json_value()
         except Exception as wait_err:
+            timings["readiness"] = time.perf_counter() - t_ready
+            if _deadline_reached(deadline):
+                raise ScrapeTimeoutError("抓取超时：等待笔记数据时超出时间预算，已放弃该链接，可稍后重试。") from wait_err
             title = await self._safe_page_title(page)
             current_url = page.url or ""
             if "/login" in current_url or "login" in current_url.lower():
@@ -256,68 +519,194 @@ class XHSScraper:
             print(f"❌ [抓取] 等待笔记数据注入超时或异常: {wait_err}")
             print(f"   URL: {url}")
             print(f"   页面标题: {title}")
-            _log(f"   [抓取-步骤] 6) wait_for_function 异常，当前 page.url: {current_url[:80] if current_url else 'N/A'}...", always=True)
+            _log(f"   [抓取-步骤] 3) 页面判定异常，当前 page.url: {current_url[:80] if current_url else 'N/A'}...", always=True)
             raise DataFetchError(
                 f"未检测到笔记数据（页面可能未加载完成或链接无效）。当前页面标题: {title!r}"
             )
+        timings["readiness"] = time.perf_counter() - t_ready
+        _log(f"   [抓取-步骤] 4) 页面判定={verdict}，等待 {timings['readiness']:.1f}s")
+
+        if verdict == "ratelimit":
+            print(f"❌ [抓取] 命中限流页。URL={url}")
+            raise RateLimitError(
+                "访问受限：请求过于频繁，请稍后再试（错误码 300013）。可调低并发数或间隔几分钟再解析。"
+            )
+        if verdict == "login":
+            print(f"❌ [抓取] 被重定向到登录页。原始 URL={url}, 当前 page.url={(page.url or '')[:80]}...")
+            raise DataFetchError(
+                "本次请求被重定向到登录页（偶发、无法避免，本工具无需登录）。自动重试中，若仍失败可稍后或调低并发再试。"
+            )
+
+        # 在页面内只取 note 部分返回，避免整 __INITIAL_STATE__ 序列化失败或过大；默认再精简到解析所需字段
+        t_eval = time.perf_counter()
+        state_mode = "slim" if SLIM_STATE else "full"
+        initial_state = await page.evaluate(SLIM_STATE_JS, STATE_TRANSFER_MEASURE) if SLIM_STATE else None
+        if isinstance(initial_state, dict) and initial_state.get("fallback"):
+            STATE_TRANSFER_STATS["slim"]["fallbacks"] += 1
+            _log("   [抓取-步骤]     state 结构非常规，改取完整 noteDetailMap", always=True)
+            state_mode = "full"
+        if state_mode == "full":
+            initial_state = await page.evaluate(FULL_STATE_JS)
+        timings["evaluate"] = time.perf_counter() - t_eval
+        if isinstance(initial_state, dict):
+            full_bytes = initial_state.pop("fullBytes", None)
+            if full_bytes is not None:
+                record_state_transfer("full_measured", full_bytes)
+            record_state_transfer(state_mode, len(json.dumps(initial_state, ensure_ascii=False).encode()))
+        if initial_state is not None and isinstance(initial_state, dict):
+            note_map = (initial_state.get("note") or {}) if isinstance(initial_state.get("note"), dict) else {}
+            detail = note_map.get("noteDetailMap") or note_map.get("note_detail_map")
+            if detail and isinstance(detail, dict):
+                _log(f"   [抓取-步骤]     noteDetailMap 键数: {len(detail)}, 首键: {list(detail.keys())[:1]}")
+        else:
+            _log(f"   [抓取-步骤]     evaluate 返回类型: {type(initial_state).__name__}, 是否空: {not initial_state}")
 
         if not initial_state:
             title = await self._safe_page_title(page)
             print(f"❌ [抓取] __INITIAL_STATE__ 为空。URL={url}, 页面标题={title}")
             try:
                 has_state = await page.evaluate("() => typeof window.__INITIAL_STATE__ !== 'undefined'")
-                _log(f"   [抓取-步骤] 7) state 为空，但 window.__INITIAL_STATE__ 存在={has_state}", always=True)
+                _log(f"   [抓取-步骤] 5) state 为空，但 window.__INITIAL_STATE__ 存在={has_state}", always=True)
             except Exception:
                 pass
             raise DataFetchError(
                 f"未检测到笔记数据（__INITIAL_STATE__ 为空）。当前页面标题: {title!r}"
             )
-        _log(f"   [抓取-步骤] 7) 拿到 state，总耗时 {time.time()-t0:.1f}s")
+        timings["total"] = time.perf_counter() - t0
+        _log(f"   [抓取-步骤] 5) 拿到 state，阶段耗时 {timings}")
         return initial_state
 
-    async def scrape_note(self, url: str) -> Dict:
+    async def scrape_note(self, url: str, deadline: Optional[float] = None) -> Dict:
         """
         打开网页 -> 取 __INITIAL_STATE__ -> 解析笔记。
         限流不重试；其他失败按 PARSE_RETRY_TIMES 重试，间隔 PARSE_RETRY_DELAY。
+        有共享浏览器池时从池中租用页面，否则使用自己的浏览器。
+        整条链接（HTTP 快速路径、等待浏览器、各次重试）共用 SCRAPE_DEADLINE_SECONDS 的时间预算；
+        经调度器抓取时 deadline 由调度器在放行本次抓取时算好传入（等熔断 / 冷却的时间不计入），
+        未传时从现在起算。超出预算抛出 ScrapeTimeoutError。
         """
         _log(f"[抓取] 开始 scrape_note url={url[:70]}...")
-        await self.start()
-        page = await self.context.new_page()
-        last_error: Optional[Exception] = None
+        deadline = url_deadline(deadline)
+        if HTTP_FAST_PATH:
+            note = await self._scrape_via_http(url, deadline)
+            if note is not None:
+                FETCH_MODE_STATS["http"] += 1
+                note["fetch_mode"] = "http"
+                return note
+            FETCH_MODE_STATS["http_miss"] += 1
+
+        _ensure_budget(deadline, "启动浏览器")
+        try:
+            async with asyncio.timeout_at(deadline):
+                if self.pool is not None:
+                    t_acquire = time.perf_counter()
+                    async with self.pool.lease_page() as page:
+                        acquire_seconds = time.perf_counter() - t_acquire
+                        note = await self._scrape_on_page(page, url, deadline)
+                    note["timings"]["browser_acquire"] = round(acquire_seconds, 3)
+                    record_stage_timings({"browser_acquire": acquire_seconds})
+                else:
+                    await self.start()
+                    async with self.page_pool.lease() as page:
+                        note = await self._scrape_on_page(page, url, deadline)
+        except TimeoutError as e:
+            raise ScrapeTimeoutError("抓取超时：等待浏览器或页面时超出时间预算，已放弃该链接，可稍后重试。") from e
+        FETCH_MODE_STATS["browser"] += 1
+        note["fetch_mode"] = "browser"
+        return note
 
+    async def _scrape_via_http(self, url: str, deadline: Optional[float] = None) -> Optional[Dict]:
+        """
+        快速路径：纯 HTTP 请求笔记页，解析 HTML 内嵌的 __INITIAL_STATE__。
+        拿不到 state、被重定向到登录页、或解析结果不完整（无图片或无标题正文）时返回 None，由调用方回退浏览器；
+        命中限流 / 验证码页时抛出 RateLimitError（交给调度器降速与熔断，不再用浏览器重复访问）。
+        请求超时不超过 deadline 的剩余预算。
+        """
+        t0 = time.perf_counter()
+        timeout = stage_budget(deadline, "HTTP 快速路径", HTTP_FAST_PATH_TIMEOUT)
         try:
-            for attempt in range(PARSE_RETRY_TIMES + 1):
-                _log(f"[抓取] 第 {attempt + 1}/{PARSE_RETRY_TIMES + 1} 次尝试")
-                try:
-                    state = await self._fetch_page_state(page, url)
-                    _log("[抓取] _fetch_page_state 完成，开始 extract_note_from_state")
-                    note = self.extract_note_from_state(state, url)
-                    _log(f"[抓取] 解析成功: title={(note.get('title') or '')[:40]}..., 图片数={len(note.get('images') or [])}")
-                    return note
-                except RateLimitError:
+            r = await http_client().get(url, timeout=timeout)
+            if r.status_code == 429 or "captcha" in str(r.url):
+                print(f"❌ [抓取-HTTP] 命中限流 / 验证码页（状态码 {r.status_code}）。URL={url}")
+                raise RateLimitError(
+                    "访问受限：请求过于频繁，请稍后再试（错误码 300013）。可调低并发数或间隔几分钟再解析。"
+                )
+            if r.status_code != 200:
+                _log(f"   [抓取-HTTP] 状态码 {r.status_code}，回退浏览器")
+                return None
+            if "/login" in str(r.url):
+                _log("   [抓取-HTTP] 被重定向到登录页，回退浏览器")
+                return None
+            state = parse_initial_state_from_html(r.text)
+            if not state:
+                if any(marker in r.text for marker in _RATE_LIMIT_MARKERS):
+                    print(f"❌ [抓取-HTTP] 命中限流页。URL={url}")
+                    raise RateLimitError(
+                        "访问受限：请求过于频繁，请稍后再试（错误码 300013）。可调低并发数或间隔几分钟再解析。"
+                    )
+                _log("   [抓取-HTTP] 页面未内嵌 __INITIAL_STATE__，回退浏览器")
+                return None
+            t_extract = time.perf_counter()
+            note = self.extract_note_from_state(state, url)
+            extract_seconds = time.perf_counter() - t_extract
+        except RateLimitError:
+            raise
+        except (DataEmptyError, DataFetchError) as e:
+            _log(f"   [抓取-HTTP] state 不完整（{e}），回退浏览器")
+            return None
+        except Exception as e:
+            _log(f"   [抓取-HTTP] 请求失败（{e}），回退浏览器")
+            return None
+        if not note.get("images") or not (note.get("title") or note.get("content")):
+            _log("   [抓取-HTTP] state 缺少图片或标题正文，回退浏览器")
+            return None
+        timings = {"http": time.perf_counter() - t0, "extract": extract_seconds}
+        note["timings"] = rounded_timings(timings)
+        record_stage_timings(timings)
+        _log(f"   [抓取-HTTP] 命中快速路径，耗时 {time.perf_counter() - t0:.1f}s")
+        return note
+
+    async def _scrape_on_page(self, page, url: str, deadline: Optional[float] = None) -> Dict:
+        """在给定页面上执行带重试的抓取与解析；剩余预算不够再试一次时不再重试，直接抛出 ScrapeTimeoutError。"""
+        last_error: Optional[Exception] = None
+        for attempt in range(PARSE_RETRY_TIMES + 1):
+            _log(f"[抓取] 第 {attempt + 1}/{PARSE_RETRY_TIMES + 1} 次尝试")
+            try:
+                state = await self._fetch_page_state(page, url, deadline)
+                _log("[抓取] _fetch_page_state 完成，开始 extract_note_from_state")
+                t_extract = time.perf_counter()
+                note = self.extract_note_from_state(state, url)
+                self.last_timings["extract"] = time.perf_counter() - t_extract
+                note["timings"] = rounded_timings(self.last_timings)
+                record_stage_timings(self.last_timings)
+                _log(f"[抓取] 解析成功: title={(note.get('title') or '')[:40]}..., 图片数={len(note.get('images') or [])}")
+                return note
+            except (RateLimitError, ScrapeTimeoutError):
+                raise
+            except (DataEmptyError, DataFetchError) as e:
+                last_error = e
+                if attempt < PARSE_RETRY_TIMES:
+                    delay = random.uniform(PARSE_RETRY_DELAY_MIN, PARSE_RETRY_DELAY_MAX)
+                    _check_retry_budget(deadline, delay, e)
+                    print(f"   [抓取] 第 {attempt + 1} 次失败，{delay:.1f}s 后重试: {e}")
+                    # 失败的页面可能停在登录页/限流页，重试前先清空页面状态
+                    await asyncio.gather(asyncio.sleep(delay), reset_page(page))
+                else:
+                    raise
+            except Exception as e:
+                last_error = e
+                if attempt < PARSE_RETRY_TIMES:
+                    delay = random.uniform(PARSE_RETRY_DELAY_MIN, PARSE_RETRY_DELAY_MAX)
+                    _check_retry_budget(deadline, delay, e)
+                    print(f"   [抓取] 第 {attempt + 1} 次失败，{delay:.1f}s 后重试: {e}")
+                    # 失败的页面可能停在登录页/限流页，重试前先清空页面状态
+                    await asyncio.gather(asyncio.sleep(delay), reset_page(page))
+                else:
+                    import traceback
+                    print(f"❌ [抓取] 失败 URL={url}")
+                    print(f"   错误: {e}")
+                    traceback.print_exc()
                     raise
-                except (DataEmptyError, DataFetchError) as e:
-                    last_error = e
-                    if attempt < PARSE_RETRY_TIMES:
-                        delay = random.uniform(PARSE_RETRY_DELAY_MIN, PARSE_RETRY_DELAY_MAX)
-                        print(f"   [抓取] 第 {attempt + 1} 次失败，{delay:.1f}s 后重试: {e}")
-                        await asyncio.sleep(delay)
-                    else:
-                        raise
-                except Exception as e:
-                    last_error = e
-                    if attempt < PARSE_RETRY_TIMES:
-                        delay = random.uniform(PARSE_RETRY_DELAY_MIN, PARSE_RETRY_DELAY_MAX)
-                        print(f"   [抓取] 第 {attempt + 1} 次失败，{delay:.1f}s 后重试: {e}")
-                        await asyncio.sleep(delay)
-                    else:
-                        import traceback
-                        print(f"❌ [抓取] 失败 URL={url}")
-                        print(f"   错误: {e}")
-                        traceback.print_exc()
-                        raise
-            if last_error:
-                raise last_error
-            raise DataFetchError("抓取失败")
-        finally:
-            await page.close()
+        if last_error:
+            raise last_error
+        raise DataFetchError("抓取失败")
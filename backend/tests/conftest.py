@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+# 后端模块以脚本目录为导入根（uvicorn main:app 从 backend 目录启动）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
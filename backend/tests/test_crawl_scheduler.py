@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""调度器 / 熔断器 / bounded_map 的行为测试（时间按比例缩小）。"""
+import asyncio
+import time
+
+import pytest
+
+from crawl_scheduler import CircuitBreaker, CrawlScheduler, bounded_map
+from exception import RateLimitError
+
+
+def _scheduler(breaker_cooldown: float, rate_limit_retries: int = 2) -> CrawlScheduler:
+    breaker = CircuitBreaker(
+        enabled=True, window=10, min_events=2, threshold=0.3, cooldown=breaker_cooldown, cooldown_max=breaker_cooldown
+    )
+    return CrawlScheduler(
+        max_concurrency=2, rate=100, rate_max=100, burst=10, cooldown=0.05, rate_limit_retries=rate_limit_retries, breaker=breaker
+    )
+
+
+def test_breaker_trip_does_not_consume_url_budget():
+    """熔断冷却（0.6s）长于单链接预算（0.3s）：熔断恢复后排队中的链接仍能在各自预算内完成。"""
+    scheduler = _scheduler(breaker_cooldown=0.6)
+    budget = 0.3
+    calls = 0
+
+    async def fetch(i, deadline=None):
+        nonlocal calls
+        calls += 1
+        assert deadline is not None and deadline - time.monotonic() <= budget
+        if calls <= 2:
+            raise RateLimitError("限流")
+        await asyncio.sleep(0.02)
+        return i
+
+    async def main():
+        results = []
+        async for value in bounded_map(range(8), lambda i: scheduler.run(fetch, i, budget=budget), workers=4):
+            results.append(value)
+        return results
+
+    results = asyncio.run(main())
+    assert sorted(results) == list(range(8))
+    assert scheduler.breaker.trips == 1
+    assert scheduler.breaker.state == "closed"
+
+
+def test_batch_deadline_still_applies_while_breaker_open():
+    """整批截止时间在等熔断期间照常计时，预算的截止时刻不晚于它。"""
+    scheduler = _scheduler(breaker_cooldown=5, rate_limit_retries=0)
+
+    async def limited(i, deadline=None):
+        raise RateLimitError("限流")
+
+    async def main():
+        batch_deadline = time.monotonic() + 0.3
+        for i in range(2):
+            with pytest.raises(RateLimitError):
+                await scheduler.run(limited, i, budget=1)
+        assert scheduler.breaker.blocking
+        with pytest.raises(TimeoutError):
+            async with asyncio.timeout_at(batch_deadline):
+                await scheduler.run(limited, 2, deadline=batch_deadline, budget=1)
+
+    asyncio.run(main())
+
+
+def test_budget_cancels_slow_attempt():
+    scheduler = _scheduler(breaker_cooldown=1)
+
+    async def slow(deadline=None):
+        await asyncio.sleep(1)
+
+    async def main():
+        started = time.monotonic()
+        with pytest.raises(TimeoutError):
+            await scheduler.run(slow, budget=0.1)
+        assert time.monotonic() - started < 0.5
+
+    asyncio.run(main())
+
+
+def test_bounded_map_surfaces_source_error():
+    """异步输入源中途出错时，消费方收到该异常而不是一直等待。"""
+
+    async def source():
+        yield 1
+        yield 2
+        raise ValueError("请求体格式错误")
+
+    async def echo(i):
+        return i
+
+    async def main():
+        results = []
+        with pytest.raises(ValueError):
+            async with asyncio.timeout(2):
+                async for value in bounded_map(source(), echo, workers=3):
+                    results.append(value)
+        return results
+
+    assert set(asyncio.run(main())) <= {1, 2}
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""NoteDeduper 的批内去重行为。"""
+import asyncio
+
+import url_canon
+from url_canon import NoteDeduper
+
+
+def _key_by_path(monkeypatch):
+    async def canonical_key(url):
+        return url.split("?")[0]
+
+    monkeypatch.setattr(url_canon, "canonical_key", canonical_key)
+
+
+def test_in_flight_duplicates_share_one_parse(monkeypatch):
+    _key_by_path(monkeypatch)
+    calls = []
+
+    async def parse(key, url):
+        calls.append(url)
+        await asyncio.sleep(0.05)
+        return {"key": key}
+
+    async def main():
+        deduper = NoteDeduper()
+        return await asyncio.gather(*(deduper.run(f"/explore/a?t={i}", parse) for i in range(3))), deduper
+
+    results, deduper = asyncio.run(main())
+    assert calls == ["/explore/a?t=0"]
+    assert results == [{"key": "/explore/a"}] * 3
+    assert deduper._notes == {}
+
+
+def test_finished_notes_keep_only_the_key(monkeypatch):
+    _key_by_path(monkeypatch)
+
+    async def parse(key, url):
+        return {"key": key}
+
+    async def main():
+        remembering, forgetting = NoteDeduper(), NoteDeduper(remember_keys=False)
+        for deduper in (remembering, forgetting):
+            await deduper.run("/explore/a", parse)
+        return remembering, forgetting
+
+    remembering, forgetting = asyncio.run(main())
+    assert remembering._notes == {} and remembering.completed("/explore/a")
+    assert forgetting._notes == {} and not forgetting.completed("/explore/a")
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+图片转码（webp -> PNG / 高质量 JPEG）放到进程池执行，避免 PIL 的解码与 optimize 压缩阻塞事件循环
+（否则打包大图时 SSE 进度等所有请求都会卡住）。
+
+- 进程数 XHS_TRANSCODE_WORKERS；排队上限 XHS_TRANSCODE_MAX_PENDING，满了之后新的转码请求等待
+- 输出格式按请求选择：png / jpeg / passthrough（不转码）；只转码 webp，其余格式原样返回
+- 转码结果按「源图 sha256 + 目标格式」缓存（复用 ImageCache 的内存 + 磁盘两级缓存），同一张图不会转两次
+"""
+import os
+import io
+import asyncio
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+
+import metrics
+from image_cache import ImageCache
+from parse_cache import DATA_DIR
+
+
+IMAGE_FORMATS = ("png", "jpeg", "passthrough")
+
+# 转码进程数
+TRANSCODE_WORKERS = max(1, int(os.getenv("XHS_TRANSCODE_WORKERS", str(min(2, os.cpu_count() or 1)))))
+# 同时排队 + 执行中的转码任务上限
+TRANSCODE_MAX_PENDING = max(1, int(os.getenv("XHS_TRANSCODE_MAX_PENDING", "32")))
+# JPEG 输出质量
+TRANSCODE_JPEG_QUALITY = min(100, max(1, int(os.getenv("XHS_TRANSCODE_JPEG_QUALITY", "92"))))
+# 转码结果缓存上限（内存 / 磁盘字节数）
+TRANSCODE_MEM_CACHE_BYTES = max(0, int(os.getenv("XHS_TRANSCODE_MEM_CACHE_BYTES", str(32 * 1024 * 1024))))
+TRANSCODE_DISK_CACHE_BYTES = max(0, int(os.getenv("XHS_TRANSCODE_DISK_CACHE_BYTES", str(512 * 1024 * 1024))))
+
+
+def _transcode_sync(data: bytes, image_format: str, jpeg_quality: int) -> Tuple[bytes, str]:
+    """在子进程中执行的转码函数（需为模块级函数以便 pickle）。"""
+    from PIL import Image
+
+    img = Image.open(io.BytesIO(data))
+    buffer = io.BytesIO()
+    if image_format == "jpeg":
+        # JPEG 不支持透明通道，透明部分铺白底
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+        else:
+            img = img.convert("RGB")
+        img.save(buffer, format="JPEG", quality=jpeg_quality, optimize=True, progressive=True)
+        return buffer.getvalue(), "image/jpeg"
+    # 如果是RGBA模式，保持透明度；否则转换为RGB
+    img = img.convert("RGBA") if img.mode == "RGBA" else img.convert("RGB")
+    img.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue(), "image/png"
+
+
+class Transcoder:
+    def __init__(self, workers: int = TRANSCODE_WORKERS, max_pending: int = TRANSCODE_MAX_PENDING):
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = asyncio.Semaphore(max_pending)
+        self.max_pending = max_pending
+        self.cache = ImageCache(
+            root=os.path.join(DATA_DIR, "transcoded"),
+            mem_max_bytes=TRANSCODE_MEM_CACHE_BYTES,
+            disk_max_bytes=TRANSCODE_DISK_CACHE_BYTES,
+        )
+
+        # 统计
+        self.queued = 0
+        self.converted = 0
+        self.failed = 0
+
+    def start(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, data: bytes, image_format: str) -> Optional[dict]:
+        self.start()
+        self.queued += 1
+        try:
+            async with self._pending:
+                loop = asyncio.get_running_loop()
+                with metrics.stage_timer("transcode"):
+                    out, mime = await loop.run_in_executor(
+                        self._executor, _transcode_sync, data, image_format, TRANSCODE_JPEG_QUALITY
+                    )
+        except BrokenProcessPool:
+            # 子进程异常退出后进程池不可再用，重建后下次再试
+            self._executor = None
+            raise
+        finally:
+            self.queued -= 1
+        self.converted += 1
+        return {"mime_type": mime, "data": out}
+
+    async def transcode(self, data: bytes, mime_type: str, image_format: str = "png") -> Tuple[bytes, str]:
+        """
+        按 image_format 转码 webp 图片，返回 (数据, MIME)。不需要转码或转码失败时原样返回。
+        """
+        if image_format == "passthrough" or "webp" not in (mime_type or "").lower():
+            return data, mime_type
+        key = f"{hashlib.sha256(data).hexdigest()}:{image_format}"
+        try:
+            img = await self.cache.get_or_fetch(key, lambda: self._run(data, image_format))
+        except Exception as e:
+            self.failed += 1
+            print(f"   - 图片转换失败，使用原格式: {e}")
+            return data, mime_type
+        if img is None:
+            return data, mime_type
+        return img.data, img.mime_type
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "queued": self.queued,
+            "converted": self.converted,
+            "failed": self.failed,
+            "cache": self.cache.stats(),
+        }
+
+
+# 进程内共享实例
+transcoder = Transcoder()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+解析前的链接规范化与批内去重：
+
+- xhslink 短链先经 HTTP 跳转解析为笔记页（结果持久化缓存，同一短链只解析一次）
+- 所有链接归一到笔记 ID（忽略 xsec_token 等查询参数差异）
+- 同一笔记在途的多个链接只抓取一次，结果再分发给这些原始链接；之后的重复链接命中解析缓存（NoteDeduper）
+
+规范化在 worker 取到链接时才进行（短链此时才解析），首条结果不必等整批短链解析完。
+抓取时使用该笔记最先到达的原始链接（保留其 xsec_token 等参数），规范化只用于去重与缓存键。
+"""
+import os
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Optional, Set, TypeVar
+
+from scraper import XHSScraper, extract_note_id
+from parse_cache import DATA_DIR
+
+
+R = TypeVar("R")
+
+
+# 短链解析结果缓存有效期（秒），默认 30 天
+LINK_CACHE_TTL = float(os.getenv("XHS_LINK_CACHE_TTL", str(30 * 24 * 3600)))
+# 同时解析短链的并发数
+LINK_RESOLVE_CONCURRENCY = max(1, int(os.getenv("XHS_LINK_RESOLVE_CONCURRENCY", "5")))
+_resolve_slots = asyncio.Semaphore(LINK_RESOLVE_CONCURRENCY)
+
+# 规范化统计：收到的链接数、去重后的笔记数、合并掉的重复链接数、短链解析次数与缓存命中
+CANON_STATS: Dict[str, int] = {
+    "urls": 0,
+    "unique": 0,
+    "duplicates_collapsed": 0,
+    "short_links": 0,
+    "short_link_cache_hits": 0,
+    "short_link_unresolved": 0,
+}
+
+
+class LinkResolutionCache:
+    """xhslink 短链 -> 笔记页 URL 的持久化缓存（SQLite）。只缓存成功解析出笔记 ID 的结果。"""
+
+    def __init__(self, path: Optional[str] = None, ttl: float = LINK_CACHE_TTL):
+        self.path = path or os.path.join(DATA_DIR, "link_cache.db")
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS links (
+                    short_url TEXT PRIMARY KEY,
+                    resolved_url TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )"""
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, short_url: str) -> Optional[str]:
+        with self._lock:
+            row = self._db().execute(
+                "SELECT resolved_url, created_at FROM links WHERE short_url = ?", (short_url,)
+            ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return row[0]
+
+    def put(self, short_url: str, resolved_url: str) -> None:
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO links (short_url, resolved_url, created_at) VALUES (?, ?, ?)",
+                (short_url, resolved_url, time.time()),
+            )
+            db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+link_cache = LinkResolutionCache()
+
+
+async def resolve_short_link(url: str) -> str:
+    """xhslink 短链解析为笔记页 URL（先查缓存）；非短链或解析失败时原样返回。"""
+    if "xhslink.com" not in url:
+        return url
+    CANON_STATS["short_links"] += 1
+    cached = await asyncio.to_thread(link_cache.get, url)
+    if cached:
+        CANON_STATS["short_link_cache_hits"] += 1
+        return cached
+    async with _resolve_slots:
+        resolved = await XHSScraper._resolve_xhslink(url)
+    if resolved != url and extract_note_id(resolved):
+        await asyncio.to_thread(link_cache.put, url, resolved)
+    else:
+        CANON_STATS["short_link_unresolved"] += 1
+    return resolved
+
+
+def _fallback_key(url: str) -> str:
+    return "url:" + hashlib.md5(url.encode()).hexdigest()[:12]
+
+
+async def canonical_key(url: str) -> str:
+    """链接的规范化键：能识别出笔记 ID 时为笔记 ID，否则为原链接摘要。"""
+    url = url.strip()
+    note_id = extract_note_id(url)
+    if note_id:
+        return note_id
+    return extract_note_id(await resolve_short_link(url)) or _fallback_key(url)
+
+
+class NoteDeduper:
+    """
+    一个批次内按笔记去重：同一笔记正在解析时，后到的重复链接等待并复用同一结果。
+    解析完成后不保留结果（批次再大内存也不随之增长），之后的重复链接靠解析缓存命中；
+    remember_keys=True 时记住已完成的笔记键（只有键），调用方可据此让重复链接跳过 force_refresh、直接读刚写入的缓存。
+    remember_keys=False 时连键也不记（不限长度的流式导入用）。
+    """
+
+    def __init__(self, remember_keys: bool = True):
+        self.remember_keys = remember_keys
+        self._notes: Dict[str, asyncio.Future] = {}
+        self._done: Set[str] = set()
+
+    def completed(self, key: str) -> bool:
+        """本批内该笔记是否已解析完成过（remember_keys=False 时总是 False）。"""
+        return key in self._done
+
+    async def run(self, url: str, fn: Callable[[str, str], Awaitable[R]]) -> R:
+        """
+        规范化 url 后执行 fn(规范化键, url)；同一笔记已有解析在进行时直接等待其结果。
+        返回的是该笔记最先到达的链接的结果，调用方按需改写为 url 自己的结果。
+        """
+        key = await canonical_key(url)
+        CANON_STATS["urls"] += 1
+        while True:
+            future = self._notes.get(key)
+            if future is None:
+                break
+            try:
+                result = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # 先到的链接被取消而本链接仍有效时，由本链接重新发起解析
+                if not future.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                continue
+            CANON_STATS["duplicates_collapsed"] += 1
+            return result
+
+        future = self._notes[key] = asyncio.get_running_loop().create_future()
+        CANON_STATS["duplicates_collapsed" if key in self._done else "unique"] += 1
+        try:
+            result = await fn(key, url)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 没有等待者时避免 "exception was never retrieved" 警告
+            raise
+        else:
+            future.set_result(result)
+            if self.remember_keys:
+                self._done.add(key)
+        finally:
+            # 等待者已拿到 future，这里只去掉批次对结果的引用
+            if self._notes.get(key) is future:
+                del self._notes[key]
+        return result
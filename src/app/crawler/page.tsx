@@ -15,7 +15,7 @@ import {
   MoreVertical,
   ListTodo,
 } from "lucide-react";
-import { cn, getProxyImageUrl } from "@/lib/utils";
+import { cn, getProxyImageUrl, describeBreaker, type BreakerState } from "@/lib/utils";
 import NotePreviewModal from "@/components/NotePreviewModal";
 
 const STORAGE_KEY_NOTES = "xhs_crawler_notes";
@@ -29,6 +29,7 @@ export default function CrawlerPage() {
   const [urlInput, setUrlInput] = useState("");
   const [isParsing, setIsParsing] = useState(false);
   const [parseProgress, setParseProgress] = useState({ current: 0, total: 0 });
+  const [breakerNotice, setBreakerNotice] = useState<string | null>(null);
   const [notes, setNotes] = useState<Note[]>([]);
   const [trash, setTrash] = useState<Note[]>([]);
   const [selectedNoteIds, setSelectedNoteIds] = useState<Set<string>>(new Set());
@@ -233,7 +234,7 @@ export default function CrawlerPage() {
     if (!reader) throw new Error("无法读取流式响应");
 
     let buffer = "";
-    let data: { notes: any[]; failed: any[] } = { notes: [], failed: [] };
+    const data: { notes: any[]; failed: any[] } = { notes: [], failed: [] };
     while (true) {
       const { done, value } = await reader.read();
       if (done) break;
@@ -248,13 +249,20 @@ export default function CrawlerPage() {
             type: string;
             current?: number;
             total?: number;
-            notes?: any[];
-            failed?: any[];
+            note?: any | null;
+            failed?: { url: string; error?: string } | null;
+            breaker?: BreakerState;
           };
-          if (event.type === "progress" && event.current != null && event.total != null) {
-            setParseProgress({ current: event.current, total: event.total });
-          } else if (event.type === "done") {
-            data = { notes: event.notes || [], failed: event.failed || [] };
+          // 结果随每条 progress 下发（done 只带汇总数），在前端逐条累积
+          if (event.type === "progress") {
+            if (event.note) data.notes.push(event.note);
+            if (event.failed) data.failed.push(event.failed);
+            if (event.current != null && event.total != null) {
+              setParseProgress({ current: event.current, total: event.total });
+            }
+          } else if (event.type === "breaker") {
+            // 限流熔断：批次暂停等待恢复，不是失败
+            setBreakerNotice(describeBreaker(event.breaker));
           }
         } catch {
           /* ignore */
@@ -265,8 +273,11 @@ export default function CrawlerPage() {
       const match = buffer.match(/^data:\s*(.+)$/m);
       if (match) {
         try {
-          const event = JSON.parse(match[1].trim()) as { type: string; notes?: any[]; failed?: any[] };
-          if (event.type === "done") data = { notes: event.notes || [], failed: event.failed || [] };
+          const event = JSON.parse(match[1].trim()) as { type: string; note?: any | null; failed?: any | null };
+          if (event.type === "progress") {
+            if (event.note) data.notes.push(event.note);
+            if (event.failed) data.failed.push(event.failed);
+          }
         } catch {
           /* ignore */
         }
@@ -336,6 +347,7 @@ export default function CrawlerPage() {
       alert("解析失败：" + err.message);
     } finally {
       setIsParsing(false);
+      setBreakerNotice(null);
     }
   };
 
@@ -418,26 +430,55 @@ export default function CrawlerPage() {
     }
 
     const selectedNotes = notes.filter((n) => selectedNoteIds.has(n.id));
-    let successCount = 0;
-    let failCount = 0;
+    const totalImages = selectedNotes.reduce((sum, n) => sum + n.images.length, 0);
+    setDownloadProgress({ current: 0, total: totalImages, noteTitle: `${selectedNotes.length} 个笔记` });
 
-    // 批量下载时，每个文件之间添加小延迟，避免浏览器阻止多个下载
-    for (let i = 0; i < selectedNotes.length; i++) {
-      const note = selectedNotes[i];
-      try {
-        await handleDownload(note, note.images.map((_, idx) => idx), batchIncludeText);
-        successCount++;
-        // 如果不是最后一个，等待一小段时间再下载下一个
-        if (i < selectedNotes.length - 1) {
-          await new Promise(resolve => setTimeout(resolve, 300)); // 延迟300ms，减少批量下载总时长
-        }
-      } catch (e) {
-        failCount++;
-        console.error(`下载笔记失败: ${note.title}`, e);
+    // 一次请求打包为一个ZIP：每个笔记一个子文件夹，manifest.json 记录失败图片
+    try {
+      const BACKEND_BASE =
+        process.env.NEXT_PUBLIC_BACKEND_URL || "http://127.0.0.1:8000";
+
+      const res = await fetch(`${BACKEND_BASE}/api/download_zip_batch`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({
+          notes: selectedNotes.map((note) => ({
+            note_data: {
+              title: note.title,
+              content: note.content,
+              tags: note.tags,
+              images: note.images,
+              origin_url: note.url,
+            },
+            selected_image_indices: null,
+          })),
+          include_text: batchIncludeText,
+        }),
+      });
+
+      if (!res.ok) {
+        const errorData = await res.json().catch(() => ({}));
+        throw new Error(errorData?.detail || errorData?.message || "下载失败");
       }
+
+      const blob = await res.blob();
+      setDownloadProgress({ current: totalImages, total: totalImages, noteTitle: `${selectedNotes.length} 个笔记` });
+      const url = window.URL.createObjectURL(blob);
+      const a = document.createElement("a");
+      a.href = url;
+      a.download = `xhs_notes_${selectedNotes.length}.zip`;
+      document.body.appendChild(a);
+      a.click();
+      document.body.removeChild(a);
+      window.URL.revokeObjectURL(url);
+      alert(`批量下载完成：共 ${selectedNotes.length} 个笔记（失败图片见 ZIP 内 manifest.json）`);
+    } catch (err: any) {
+      console.error(err);
+      alert("批量下载失败：" + err.message);
+    } finally {
+      setDownloadProgress(null);
     }
 
-    alert(`批量下载完成：成功 ${successCount} 个，失败 ${failCount} 个`);
     setSelectedNoteIds(new Set());
     setIsBatchMode(false);
   };
@@ -717,6 +758,7 @@ export default function CrawlerPage() {
                       <div className="flex items-center justify-between text-sm text-gray-600">
                         <span>已解析 {parseProgress.current}/{parseProgress.total}</span>
                       </div>
+                      {breakerNotice && <div className="text-xs text-amber-600">{breakerNotice}</div>}
                       <div className="w-full bg-gray-200 rounded-full h-2 overflow-hidden">
                         <div
                           className="bg-blue-600 h-full transition-all duration-300 ease-out"
@@ -4,7 +4,7 @@ import { useState, useEffect, useCallback } from "react";
 import Link from "next/link";
 import { Note, ParseRequest, TodoItem } from "@/types";
 import { Loader2, ListTodo, Check, X, ArrowLeft } from "lucide-react";
-import { cn } from "@/lib/utils";
+import { cn, describeBreaker, type BreakerState } from "@/lib/utils";
 
 const STORAGE_KEY_NOTES = "xhs_crawler_notes";
 const STORAGE_KEY_PARSE_HISTORY = "xhs_crawler_parse_history";
@@ -23,6 +23,7 @@ export default function TodoPage() {
   const [todoInput, setTodoInput] = useState("");
   const [isParsing, setIsParsing] = useState(false);
   const [parseProgress, setParseProgress] = useState({ current: 0, total: 0 });
+  const [breakerNotice, setBreakerNotice] = useState<string | null>(null);
 
   useEffect(() => {
     const saved = localStorage.getItem(STORAGE_KEY_TODO);
@@ -58,7 +59,7 @@ export default function TodoPage() {
     if (!reader) throw new Error("无法读取流式响应");
 
     let buffer = "";
-    let data: { notes: any[]; failed: any[] } = { notes: [], failed: [] };
+    const data: { notes: any[]; failed: any[] } = { notes: [], failed: [] };
     while (true) {
       const { done, value } = await reader.read();
       if (done) break;
@@ -73,13 +74,20 @@ export default function TodoPage() {
             type: string;
             current?: number;
             total?: number;
-            notes?: any[];
-            failed?: any[];
+            note?: any | null;
+            failed?: { url: string; error?: string } | null;
+            breaker?: BreakerState;
           };
-          if (event.type === "progress" && event.current != null && event.total != null) {
-            setParseProgress({ current: event.current, total: event.total });
-          } else if (event.type === "done") {
-            data = { notes: event.notes || [], failed: event.failed || [] };
+          // 结果随每条 progress 下发（done 只带汇总数），在前端逐条累积
+          if (event.type === "progress") {
+            if (event.note) data.notes.push(event.note);
+            if (event.failed) data.failed.push(event.failed);
+            if (event.current != null && event.total != null) {
+              setParseProgress({ current: event.current, total: event.total });
+            }
+          } else if (event.type === "breaker") {
+            // 限流熔断：批次暂停等待恢复，不是失败
+            setBreakerNotice(describeBreaker(event.breaker));
           }
         } catch {
           /* ignore */
@@ -90,8 +98,11 @@ export default function TodoPage() {
       const match = buffer.match(/^data:\s*(.+)$/m);
       if (match) {
         try {
-          const event = JSON.parse(match[1].trim()) as { type: string; notes?: any[]; failed?: any[] };
-          if (event.type === "done") data = { notes: event.notes || [], failed: event.failed || [] };
+          const event = JSON.parse(match[1].trim()) as { type: string; note?: any | null; failed?: any | null };
+          if (event.type === "progress") {
+            if (event.note) data.notes.push(event.note);
+            if (event.failed) data.failed.push(event.failed);
+          }
         } catch {
           /* ignore */
         }
@@ -166,6 +177,7 @@ export default function TodoPage() {
       alert("解析失败：" + (err instanceof Error ? err.message : String(err)));
     } finally {
       setIsParsing(false);
+      setBreakerNotice(null);
     }
   };
 
@@ -278,6 +290,7 @@ export default function TodoPage() {
                       style={{ width: `${(parseProgress.current / parseProgress.total) * 100}%` }}
                     />
                   </div>
+                  {breakerNotice && <div className="mt-1 text-xs text-amber-600">{breakerNotice}</div>}
                 </div>
               )}
               <ul className="rounded-lg border border-gray-200 divide-y divide-gray-100 max-h-[50vh] overflow-y-auto">
@@ -14,4 +14,17 @@ export function getProxyImageUrl(imageUrl: string): string {
   if (imageUrl.startsWith(backendBase)) return imageUrl;
   // 否则通过后端代理
   return `${backendBase}/api/proxy_image?url=${encodeURIComponent(imageUrl)}`;
-}
\ No newline at end of file
+}
+// 流式解析中后端推送的限流熔断状态（breaker 事件）
+export interface BreakerState {
+  state: "closed" | "open" | "half_open";
+  cooldown_seconds_left?: number;
+}
+
+// 熔断状态的提示文案；已恢复（closed）时返回 null
+export function describeBreaker(breaker?: BreakerState | null): string | null {
+  if (!breaker || breaker.state === "closed") return null;
+  if (breaker.state === "half_open") return "正在试探是否已解除访问限制…";
+  const seconds = Math.ceil(breaker.cooldown_seconds_left ?? 0);
+  return `访问受限，已暂停解析，约 ${seconds} 秒后自动重试（未完成的链接不会丢失）`;
+}